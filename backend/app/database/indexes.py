@@ -0,0 +1,55 @@
+"""
+indexes.py — Indexes of the backend's collections, created once at startup.
+
+create_index is a no-op for an index that already exists, so every API process
+calls ensure_indexes() from its lifespan.
+
+Collections:
+  - retrieval_indexes: unique content_id (one index per content; read on every
+    summary, quiz, flashcards and chat request).
+  - chunk_cache: TTL on expires_at (artifacts of chunks no content reused lately).
+  - generation_cache: TTL on expires_at (MongoDB deletes expired entries itself)
+    and last_used_at (least-recently-used eviction sorts on it).
+  - generated_outputs: content_ids, sparse (multi-document chats, found by their
+    set of contents and deleted with any of them).
+"""
+
+from app.database.connection import get_database
+from app.models.blob_storage import delete_packed, unpack_value
+from app.models.term_stats import remove_term_stats
+
+
+def _drop_duplicate_retrieval_indexes(db) -> int:
+    """
+    Keep only the most recently updated retrieval index per content (rebuilds that raced
+    before the unique index existed). Returns how many documents were removed.
+    """
+    duplicates = db.retrieval_indexes.aggregate([
+        {"$sort": {"updated_at": -1}},
+        {"$group": {"_id": "$content_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}},
+    ])
+    stale = [doc_id for group in duplicates for doc_id in group["ids"][1:]]
+    for doc in db.retrieval_indexes.find({"_id": {"$in": stale}}, {"index.hashed": 1, "blob_refs": 1}):
+        remove_term_stats(unpack_value((doc.get("index") or {}).get("hashed")))
+        delete_packed(doc.get("blob_refs") or [])
+    if stale:
+        db.retrieval_indexes.delete_many({"_id": {"$in": stale}})
+    return len(stale)
+
+
+def ensure_indexes() -> None:
+    """Create every index the backend relies on (idempotent)."""
+    db = get_database()
+
+    removed = _drop_duplicate_retrieval_indexes(db)
+    if removed:
+        print(f"[INDEXES] Removed {removed} duplicate retrieval index document(s)")
+    db.retrieval_indexes.create_index("content_id", unique=True)
+
+    db.chunk_cache.create_index("expires_at", expireAfterSeconds=0)
+
+    db.generation_cache.create_index("expires_at", expireAfterSeconds=0)
+    db.generation_cache.create_index("last_used_at")
+
+    db.generated_outputs.create_index("content_ids", sparse=True)
@@ -2,15 +2,21 @@ from contextlib import asynccontextmanager
 
 from app.auth.routes import router as auth_router
 from app.database.connection import get_database
+from app.database.indexes import ensure_indexes
 from app.routes.content import router as content_router
+from app.services.context_compression import compression_stats
+from app.services.generation_cache import generation_cache_stats
+from app.services.llm_gateway import llm_stats
+from app.services.retrieval_cache import retrieval_cache
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup: warm up the database connection
+    # Startup: warm up the database connection and create missing indexes
     get_database()
+    ensure_indexes()
     yield
 
 
@@ -36,3 +42,13 @@ app.include_router(content_router)
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
+
+
+@app.get("/metrics")
+def metrics():
+    return {
+        "retrieval_cache":     retrieval_cache.stats(),
+        "context_compression": compression_stats.stats(),
+        "llm":                 llm_stats.stats(),
+        "generation_cache":    generation_cache_stats.stats(),
+    }
@@ -0,0 +1,190 @@
+"""
+blob_storage.py — Transparent compression and out-of-document storage for large fields.
+
+A long lecture transcript (normalized_text) or a large generated output can
+approach MongoDB's 16 MB document limit, and every read of such a document
+moves megabytes over the wire. Large field values are therefore stored packed:
+
+  - Values that serialize to fewer than COMPRESS_MIN_BYTES are stored as-is.
+  - Larger values are compressed (zstd when `zstandard` is installed, zlib
+    otherwise) and stored inline as {"_blob": 1, "codec", "data"}.
+  - If the compressed value is still larger than INLINE_MAX_BYTES it is written
+    to the blob store (GridFS by default, see set_blob_store) and only a
+    reference {"_blob": 1, "codec", "store", "ref"} stays in the document.
+
+Documents read through the models are wrapped in StoredDocument, which unpacks
+a field the first time it is accessed, so callers that never touch
+normalized_text never pay for decompressing or fetching it.
+"""
+
+import os
+import zlib
+from collections.abc import Iterable
+from typing import Any, Protocol
+
+import bson
+import gridfs
+from app.database.connection import get_database
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is used instead
+    zstandard = None
+
+# ─── THRESHOLDS ──────────────────────────────────────────────────────────────
+COMPRESS_MIN_BYTES = int(os.getenv("STORAGE_COMPRESS_MIN_BYTES", 16 * 1024))
+INLINE_MAX_BYTES = int(os.getenv("STORAGE_INLINE_MAX_BYTES", 4 * 1024 * 1024))
+
+ZSTD_LEVEL = 3
+ZLIB_LEVEL = 6
+
+
+# ─── CODECS ──────────────────────────────────────────────────────────────────
+
+def _compress(data: bytes) -> tuple[str, bytes]:
+    if zstandard is not None:
+        return "zstd", zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return "zlib", zlib.compress(data, ZLIB_LEVEL)
+
+
+def _decompress(codec: str, data: bytes) -> bytes:
+    if codec == "zlib":
+        return zlib.decompress(data)
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("Stored field is zstd-compressed; install `zstandard` to read it")
+        return zstandard.ZstdDecompressor().decompress(data)
+    raise ValueError(f"Unknown storage codec: {codec}")
+
+
+# ─── BLOB STORES ─────────────────────────────────────────────────────────────
+
+class BlobStore(Protocol):
+    """Where packed values too large to stay inline are kept."""
+
+    name: str
+
+    def put(self, data: bytes) -> Any: ...
+    def get(self, ref: Any) -> bytes: ...
+    def delete(self, ref: Any) -> None: ...
+
+
+class GridFSBlobStore:
+    """Default store: GridFS in the application database (bucket `blobs`)."""
+
+    name = "gridfs"
+
+    def _fs(self) -> gridfs.GridFS:
+        return gridfs.GridFS(get_database(), collection="blobs")
+
+    def put(self, data: bytes) -> Any:
+        return self._fs().put(data)
+
+    def get(self, ref: Any) -> bytes:
+        return self._fs().get(ref).read()
+
+    def delete(self, ref: Any) -> None:
+        self._fs().delete(ref)
+
+
+_stores: dict[str, BlobStore] = {}
+_default_store: BlobStore | None = None
+
+
+def set_blob_store(store: BlobStore) -> None:
+    """Write new spilled values to this store (e.g. S3); existing refs keep resolving by name."""
+    global _default_store
+    _stores[store.name] = store
+    _default_store = store
+
+
+def _get_store(name: str | None = None) -> BlobStore:
+    if _default_store is None:
+        set_blob_store(GridFSBlobStore())
+    if name is None:
+        return _default_store
+    store = _stores.get(name)
+    if store is None:
+        raise RuntimeError(f"No blob store registered as {name!r}")
+    return store
+
+
+# ─── PACK / UNPACK ───────────────────────────────────────────────────────────
+
+def is_packed(value: Any) -> bool:
+    return isinstance(value, dict) and value.get("_blob") == 1
+
+
+def pack_value(value: Any, spill: bool = True) -> Any:
+    """
+    The value to store for a field: unchanged when small, compressed, or spilled.
+    With spill=False a large value stays inline (check packed_size against the budget).
+    """
+    if value is None or is_packed(value):
+        return value
+
+    raw = bson.encode({"v": value})
+    if len(raw) < COMPRESS_MIN_BYTES:
+        return value
+
+    codec, data = _compress(raw)
+    packed = {"_blob": 1, "codec": codec, "data": data}
+    return packed if not spill or len(data) <= INLINE_MAX_BYTES else spill_packed(packed)
+
+
+def packed_size(value: Any) -> int:
+    """Bytes of a packed value kept inline (0 for plain or spilled values)."""
+    return len(value["data"]) if is_packed(value) and value.get("data") is not None else 0
+
+
+def spill_packed(value: Any) -> Any:
+    """Move a packed value kept inline to the blob store (for documents over a size budget)."""
+    if not is_packed(value) or value.get("data") is None:
+        return value
+    store = _get_store()
+    data = value["data"]
+    return {"_blob": 1, "codec": value["codec"], "store": store.name, "ref": store.put(data), "size": len(data)}
+
+
+def unpack_value(value: Any) -> Any:
+    """Inverse of pack_value; plain values pass through."""
+    if not is_packed(value):
+        return value
+    data = value.get("data")
+    if data is None:
+        data = _get_store(value["store"]).get(value["ref"])
+    return bson.decode(_decompress(value["codec"], bytes(data)))["v"]
+
+
+def delete_packed(values: Iterable[Any]) -> None:
+    """Remove the spilled blobs behind packed values (call when deleting their documents)."""
+    for value in values:
+        if is_packed(value) and value.get("ref") is not None:
+            _get_store(value["store"]).delete(value["ref"])
+
+
+class StoredDocument(dict):
+    """
+    A MongoDB document whose packed fields are unpacked on first access.
+    Supports the dict reads used by the routes and services: [], get, items, values.
+    """
+
+    def __getitem__(self, key):
+        value = super().__getitem__(key)
+        if is_packed(value):
+            value = unpack_value(value)
+            super().__setitem__(key, value)
+        return value
+
+    def get(self, key, default=None):
+        return self[key] if key in self else default
+
+    def items(self):
+        return [(key, self[key]) for key in self]
+
+    def values(self):
+        return [self[key] for key in self]
+
+
+def stored_document(doc: dict | None) -> StoredDocument | None:
+    return StoredDocument(doc) if doc is not None else None
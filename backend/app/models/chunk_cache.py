@@ -0,0 +1,54 @@
+from datetime import datetime, timedelta
+
+from app.database.connection import get_database
+from pymongo import UpdateOne
+
+# Entries not written or reused for this long are deleted by MongoDB (TTL index on
+# expires_at, created in database/indexes.py).
+CHUNK_CACHE_RETENTION = timedelta(days=90)
+
+
+def get_chunk_artifacts(chunk_hashes: list[str]) -> dict[str, dict]:
+    """
+    Stored per-chunk artifacts by chunk hash: {chunk_hash: {artifact_key: bytes}}.
+    Hashes with nothing stored are absent from the result.
+    """
+    db = get_database()
+    chunk_cache = db.chunk_cache
+
+    docs = chunk_cache.find({"_id": {"$in": chunk_hashes}}, {"artifacts": 1})
+    return {doc["_id"]: doc.get("artifacts") or {} for doc in docs}
+
+
+def save_chunk_artifacts(new_artifacts: dict[str, dict], reused_hashes: list[str] | None = None) -> None:
+    """
+    Upsert newly computed artifacts ({chunk_hash: {artifact_key: bytes}}) and extend
+    the retention of entries that were reused.
+    """
+    db = get_database()
+    chunk_cache = db.chunk_cache
+
+    now = datetime.utcnow()
+    expires_at = now + CHUNK_CACHE_RETENTION
+
+    operations = [
+        UpdateOne(
+            {"_id": chunk_hash},
+            {
+                "$set": {
+                    **{f"artifacts.{key}": value for key, value in artifacts.items()},
+                    "updated_at": now,
+                    "expires_at": expires_at,
+                },
+                "$setOnInsert": {"created_at": now},
+            },
+            upsert=True,
+        )
+        for chunk_hash, artifacts in new_artifacts.items()
+    ]
+    if operations:
+        chunk_cache.bulk_write(operations, ordered=False)
+
+    reused = [h for h in (reused_hashes or []) if h not in new_artifacts]
+    if reused:
+        chunk_cache.update_many({"_id": {"$in": reused}}, {"$set": {"expires_at": expires_at}})
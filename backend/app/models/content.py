@@ -1,8 +1,29 @@
+from collections.abc import Sequence
 from datetime import datetime
 
+import bson
+import numpy as np
 from app.database.connection import get_database
+from app.models.blob_storage import (
+    delete_packed,
+    is_packed,
+    pack_value,
+    spill_packed,
+    stored_document,
+    unpack_value,
+)
+from app.models.term_stats import add_term_stats, remove_term_stats
 from bson import ObjectId
 from pydantic import BaseModel
+from pymongo.errors import DuplicateKeyError
+
+
+# Characters of normalized_text kept readable next to a packed text, for history previews.
+STORED_PREVIEW_CHARS = 500
+
+# A retrieval index document is kept under this size (MongoDB rejects documents over
+# 16 MB): its largest packed sections are spilled to the blob store until it fits.
+RETRIEVAL_INDEX_MAX_BYTES = 12 * 1024 * 1024
 
 
 class ContentCreate(BaseModel):
@@ -12,6 +33,7 @@ class ContentCreate(BaseModel):
     title: str | None = None
     chunks: list[str] | None = None
     chunk_metadata: dict | None = None
+    retrieval_index: dict | None = None
 
 class GeneratedOutputCreate(BaseModel):
     user_id: str
@@ -20,22 +42,146 @@ class GeneratedOutputCreate(BaseModel):
     options: dict
     output: dict
 
+class ChunkView(Sequence):
+    """
+    Read-only list of a content's chunks, backed by normalized_text and packed
+    (start, end) offsets. A chunk string is only sliced out when it is accessed,
+    so callers that read the top-k chunks never materialize the rest.
+    """
+
+    __slots__ = ("_text", "_offsets")
+
+    def __init__(self, text: str, packed_offsets: bytes):
+        self._text = text
+        self._offsets = np.frombuffer(packed_offsets, dtype=np.uint32).reshape(-1, 2)
+
+    def __len__(self) -> int:
+        return len(self._offsets)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        start, end = self._offsets[i]
+        return self._text[start:end]
+
+    def span(self, i: int) -> tuple[int, int]:
+        """(start, end) of chunk i in normalized_text."""
+        start, end = self._offsets[i]
+        return int(start), int(end)
+
+
+def pack_chunk_offsets(text: str, chunks: list[str]) -> bytes | None:
+    """
+    (start, end) of every chunk in text, packed as uint32 pairs.
+    None if any chunk is not an exact slice of text; the strings are stored then.
+    """
+    offsets = np.empty((len(chunks), 2), dtype=np.uint32)
+    cursor = 0
+    for i, chunk in enumerate(chunks):
+        # Chunks are in text order; overlapping chunks start before the previous one ends.
+        start = text.find(chunk, cursor)
+        if start < 0:
+            start = text.find(chunk)
+            if start < 0:
+                return None
+        offsets[i] = (start, start + len(chunk))
+        cursor = start
+    return offsets.tobytes()
+
+
+def get_content_chunks(content: dict) -> Sequence[str]:
+    """
+    The stored chunks of a content document, whichever way they were stored:
+    offsets into normalized_text (ChunkView) or, for older documents, a list of strings.
+    """
+    packed = content.get("chunk_offsets")
+    if packed is not None and content.get("normalized_text") is not None:
+        return ChunkView(content["normalized_text"], packed)
+    return content.get("chunks") or []
+
+
+def _chunk_fields(normalized_text: str, chunks: list[str] | None) -> dict:
+    """Stored form of a content's chunks: offsets when they are slices of the text, else the strings."""
+    # Chunks are slices of normalized_text: store 8 bytes of offsets per chunk instead of a copy.
+    chunk_offsets = pack_chunk_offsets(normalized_text, chunks) if chunks else None
+    return {
+        "chunks": pack_value(None if chunk_offsets is not None else chunks),
+        "chunk_offsets": chunk_offsets,
+    }
+
+
 def create_content(content_data: ContentCreate) -> str:
     db = get_database()
     content_collection = db.content
 
+    # Large text is stored compressed (or spilled to the blob store); see blob_storage.py.
+    normalized_text = pack_value(content_data.normalized_text)
     content_doc = {
         "user_id": content_data.user_id,
         "input_type": content_data.input_type,
-        "normalized_text": content_data.normalized_text,
+        "normalized_text": normalized_text,
         "title": content_data.title,
-        "chunks": content_data.chunks,
+        **_chunk_fields(content_data.normalized_text, content_data.chunks),
         "chunk_metadata": content_data.chunk_metadata,
         "created_at": datetime.utcnow()
     }
+    if is_packed(normalized_text):
+        # The history list reads these instead of unpacking the text.
+        content_doc["text_preview"] = content_data.normalized_text[:STORED_PREVIEW_CHARS]
+        content_doc["text_length"] = len(content_data.normalized_text)
 
     result = content_collection.insert_one(content_doc)
-    return str(result.inserted_id)
+    content_id = str(result.inserted_id)
+
+    if content_data.retrieval_index:
+        try:
+            save_retrieval_index(content_id, content_data.retrieval_index, content_data.user_id)
+        except Exception:
+            # Never leave a content behind without its index: the upload fails as a whole.
+            delete_content_blobs(content_id)
+            content_collection.delete_one({"_id": result.inserted_id})
+            raise
+        # Corpus-wide document frequencies (services/global_idf.py) grow with every upload.
+        add_term_stats(content_data.retrieval_index.get("hashed"))
+
+    return content_id
+
+def update_content_chunks(
+    content_id: str,
+    normalized_text: str,
+    chunks: list[str],
+    chunk_metadata: dict,
+) -> dict:
+    """
+    Replace the stored chunks and chunk_metadata of an existing content (backfill, re-chunking).
+    Returns the fields as written, with chunks unpacked, for updating an in-memory copy.
+    """
+    db = get_database()
+    content_collection = db.content
+
+    fields = {**_chunk_fields(normalized_text, chunks), "chunk_metadata": chunk_metadata}
+    previous = content_collection.find_one({"_id": ObjectId(content_id)}, _blob_refs("chunks"))
+    content_collection.update_one({"_id": ObjectId(content_id)}, {"$set": fields})
+    if previous:
+        delete_packed([previous.get("chunks")])
+
+    fields["chunks"] = None if fields["chunk_offsets"] is not None else chunks
+    return fields
+
+
+def mark_chunk_offsets_unavailable(content_id: str) -> None:
+    """
+    Record that a content's chunks are not slices of its text, so they stay stored as
+    strings and the backfill stops retrying. Cleared by re-chunking (new chunk_metadata).
+    """
+    db = get_database()
+    content_collection = db.content
+
+    content_collection.update_one(
+        {"_id": ObjectId(content_id)},
+        {"$set": {"chunk_metadata.offsets_unavailable": True}},
+    )
+
 
 def get_content_by_id(content_id: str) -> dict | None:
     db = get_database()
@@ -43,16 +189,193 @@ def get_content_by_id(content_id: str) -> dict | None:
 
     try:
         content = content_collection.find_one({"_id": ObjectId(content_id)})
-        return content
+        return stored_document(content)
     except Exception:
         return None
 
-def get_user_content(user_id: str) -> list:
+def get_user_content(user_id: str, projection: dict | None = None) -> list:
+    db = get_database()
+    content_collection = db.content
+
+    contents = content_collection.find({"user_id": user_id}, projection).sort("created_at", -1)
+    return [stored_document(c) for c in contents]
+
+def get_user_content_previews(user_id: str, preview_chars: int = 200) -> list:
+    """
+    List a user's contents without transferring full documents.
+    Only the first preview_chars characters of normalized_text leave the database.
+    """
+    db = get_database()
+    content_collection = db.content
+
+    return list(content_collection.aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$sort": {"created_at": -1}},
+        {"$project": {
+            "input_type": 1,
+            "created_at": 1,
+            "title": 1,
+            "preview": {"$cond": [
+                {"$eq": [{"$type": "$normalized_text"}, "string"]},
+                {"$substrCP": ["$normalized_text", 0, preview_chars]},
+                {"$substrCP": [{"$ifNull": ["$text_preview", ""]}, 0, preview_chars]},
+            ]},
+            "text_length": {"$cond": [
+                {"$eq": [{"$type": "$normalized_text"}, "string"]},
+                {"$strLenCP": "$normalized_text"},
+                {"$ifNull": ["$text_length", 0]},
+            ]},
+        }},
+    ]))
+
+def get_contents_by_ids(content_ids: list[str], projection: dict | None = None) -> dict[str, dict]:
+    """Fetch several content documents in one query, keyed by content_id."""
+    db = get_database()
+    content_collection = db.content
+
+    object_ids = [ObjectId(cid) for cid in content_ids if ObjectId.is_valid(cid)]
+    docs = content_collection.find({"_id": {"$in": object_ids}}, projection)
+    return {str(doc["_id"]): stored_document(doc) for doc in docs}
+
+def get_chunk_texts(selection: dict[str, list[int]]) -> dict[str, dict[int, str]]:
+    """
+    Selected chunks of several contents, {content_id: {chunk_index: text}}, in two queries.
+    Where normalized_text is a plain string, MongoDB cuts the chunks out ($substrCP over the
+    stored offsets), so whole texts never leave the database. Compressed or spilled texts
+    (blob_storage.py) and documents without offsets are loaded and sliced here.
+    """
     db = get_database()
     content_collection = db.content
 
-    contents = list(content_collection.find({"user_id": user_id}).sort("created_at", -1))
-    return contents
+    object_ids = [ObjectId(cid) for cid in selection if ObjectId.is_valid(cid)]
+    heads = content_collection.aggregate([
+        {"$match": {"_id": {"$in": object_ids}}},
+        {"$project": {
+            "chunk_offsets": 1,
+            "plain_text": {"$eq": [{"$type": "$normalized_text"}, "string"]},
+        }},
+    ])
+
+    branches = []
+    wanted: dict[str, list[int]] = {}
+    load_whole: list[str] = []
+    for head in heads:
+        content_id = str(head["_id"])
+        if not head.get("plain_text") or head.get("chunk_offsets") is None:
+            load_whole.append(content_id)
+            continue
+        offsets = np.frombuffer(head["chunk_offsets"], dtype=np.uint32).reshape(-1, 2)
+        wanted[content_id] = [i for i in selection[content_id] if 0 <= i < len(offsets)]
+        branches.append({
+            "case": {"$eq": ["$_id", head["_id"]]},
+            "then": [
+                {"$substrCP": ["$normalized_text", int(offsets[i][0]), int(offsets[i][1] - offsets[i][0])]}
+                for i in wanted[content_id]
+            ],
+        })
+
+    texts: dict[str, dict[int, str]] = {}
+    if branches:
+        docs = content_collection.aggregate([
+            {"$match": {"_id": {"$in": [ObjectId(cid) for cid in wanted]}}},
+            {"$project": {"parts": {"$switch": {"branches": branches, "default": []}}}},
+        ])
+        for doc in docs:
+            content_id = str(doc["_id"])
+            texts[content_id] = dict(zip(wanted[content_id], doc["parts"]))
+
+    if load_whole:
+        projection = {"normalized_text": 1, "chunk_offsets": 1, "chunks": 1}
+        for content_id, content in get_contents_by_ids(load_whole, projection).items():
+            chunks = get_content_chunks(content)
+            texts[content_id] = {i: chunks[i] for i in selection[content_id] if 0 <= i < len(chunks)}
+    return texts
+
+def get_retrieval_index_sections(content_ids: list[str], *sections: str) -> dict[str, dict]:
+    """
+    Some backend sections (or other fields, e.g. token_counts) of the stored retrieval
+    index for several contents at once.
+    Returns {content_id: {"version", "chunk_count", *sections}} — other sections are not transferred.
+    """
+    db = get_database()
+    retrieval_indexes = db.retrieval_indexes
+
+    docs = retrieval_indexes.find(
+        {"content_id": {"$in": content_ids}},
+        {
+            "content_id": 1,
+            "index.version": 1,
+            "index.chunk_count": 1,
+            **{f"index.{section}": 1 for section in sections},
+        },
+    )
+    return {doc["content_id"]: stored_document(doc.get("index") or {}) for doc in docs}
+
+def get_retrieval_index(content_id: str) -> dict | None:
+    """Stored retrieval index for a content document (kept in a side collection)."""
+    db = get_database()
+    retrieval_indexes = db.retrieval_indexes
+
+    doc = retrieval_indexes.find_one({"content_id": content_id})
+    return stored_document(doc.get("index")) if doc else None
+
+def _pack_retrieval_index(index: dict) -> dict:
+    """
+    Stored form of a retrieval index: every large section packed (blob_storage.py), and
+    the largest ones spilled to the blob store while the document is over RETRIEVAL_INDEX_MAX_BYTES.
+    """
+    packed = {key: pack_value(value) for key, value in index.items()}
+    while len(bson.encode(packed)) > RETRIEVAL_INDEX_MAX_BYTES:
+        inline = [key for key, value in packed.items() if is_packed(value) and value.get("data") is not None]
+        if not inline:
+            break
+        largest = max(inline, key=lambda key: len(packed[key]["data"]))
+        packed[largest] = spill_packed(packed[largest])
+    return packed
+
+def _spilled(index: dict) -> list[dict]:
+    # References of the sections kept in the blob store, so they can be deleted with the index.
+    return [value for value in index.values() if is_packed(value) and value.get("ref") is not None]
+
+def save_retrieval_index(content_id: str, index: dict, user_id: str | None = None) -> None:
+    """Insert or replace the retrieval index for a content document."""
+    db = get_database()
+    retrieval_indexes = db.retrieval_indexes
+
+    packed = _pack_retrieval_index(index)
+    update = {"index": packed, "blob_refs": _spilled(packed), "updated_at": datetime.utcnow()}
+    if user_id is not None:
+        update["user_id"] = user_id
+    previous = retrieval_indexes.find_one({"content_id": content_id}, {"blob_refs": 1}) or {}
+
+    # content_id is unique (database/indexes.py): a racing upsert that loses updates instead
+    try:
+        retrieval_indexes.update_one(
+            {"content_id": content_id},
+            {"$set": update},
+            upsert=True
+        )
+    except DuplicateKeyError:
+        retrieval_indexes.update_one({"content_id": content_id}, {"$set": update})
+    delete_packed(previous.get("blob_refs") or [])
+
+def replace_retrieval_index(content_id: str, index: dict | None, user_id: str | None = None) -> None:
+    """Swap a content's retrieval index for a rebuilt one, keeping the term statistics in step."""
+    delete_retrieval_index(content_id)
+    if index:
+        save_retrieval_index(content_id, index, user_id)
+        add_term_stats(index.get("hashed"))
+
+def delete_retrieval_index(content_id: str) -> None:
+    """Delete a content's retrieval index and take its chunks out of the term statistics."""
+    db = get_database()
+    retrieval_indexes = db.retrieval_indexes
+
+    docs = list(retrieval_indexes.find({"content_id": content_id}, {"index.hashed": 1, "blob_refs": 1}))
+    for doc in docs:
+        remove_term_stats(unpack_value((doc.get("index") or {}).get("hashed")))
+    retrieval_indexes.delete_many({"content_id": content_id})
+    delete_packed(ref for doc in docs for ref in doc.get("blob_refs") or [])
 
 def create_generated_output(output_data: GeneratedOutputCreate) -> str:
     db = get_database()
@@ -63,38 +386,77 @@ def create_generated_output(output_data: GeneratedOutputCreate) -> str:
         "content_id": output_data.content_id,
         "feature": output_data.feature,
         "options": output_data.options,
-        "output": output_data.output,
+        "output": pack_value(output_data.output),
         "created_at": datetime.utcnow()
     }
 
     result = generated_outputs.insert_one(output_doc)
     return str(result.inserted_id)
 
+def get_or_create_generated_output(output_data: GeneratedOutputCreate) -> tuple[str, dict]:
+    """
+    The user's latest output of this feature and options on this content, or a new one
+    saving output_data (for generation-cache hits: one history entry per output, not per
+    request). Returns its id and its output.
+    """
+    db = get_database()
+    generated_outputs = db.generated_outputs
+
+    existing = generated_outputs.find_one({
+        "user_id": output_data.user_id,
+        "content_id": output_data.content_id,
+        "feature": output_data.feature,
+        "options": output_data.options
+    }, {"output": 1}, sort=[("created_at", -1)])
+
+    if existing:
+        return str(existing["_id"]), unpack_value(existing["output"])
+
+    return create_generated_output(output_data), output_data.output
+
+def _outputs_of_content(content_id: str) -> dict:
+    # Outputs of this content alone, and multi-document chats that include it
+    return {"$or": [{"content_id": content_id}, {"content_ids": content_id}]}
+
 def get_generated_outputs(content_id: str, user_id: str) -> list:
     db = get_database()
     generated_outputs = db.generated_outputs
 
-    outputs = list(generated_outputs.find({
-        "content_id": content_id,
+    outputs = generated_outputs.find({
+        **_outputs_of_content(content_id),
         "user_id": user_id
-    }).sort("created_at", -1))
+    }).sort("created_at", -1)
+
+    return [stored_document(o) for o in outputs]
 
-    return outputs
+def get_generated_output_by_id(output_id: str) -> dict | None:
+    db = get_database()
+    generated_outputs = db.generated_outputs
+
+    try:
+        return stored_document(generated_outputs.find_one({"_id": ObjectId(output_id)}))
+    except Exception:
+        return None
 
 def update_generated_output(output_id: str, output_data: dict) -> bool:
     """Update an existing generated output"""
     db = get_database()
     generated_outputs = db.generated_outputs
 
+    previous = generated_outputs.find_one({"_id": ObjectId(output_id)}, _blob_refs("output"))
+
     result = generated_outputs.update_one(
         {"_id": ObjectId(output_id)},
         {"$set": {
-            "output": output_data["output"],
+            "output": pack_value(output_data["output"]),
             "options": output_data["options"],
             "updated_at": datetime.utcnow()
         }}
     )
 
+    if previous:
+        delete_packed([previous.get("output")])
+
     return result.modified_count > 0
 
 def get_or_create_chatbot_output(content_id: str, user_id: str) -> str:
@@ -124,3 +486,58 @@ def get_or_create_chatbot_output(content_id: str, user_id: str) -> str:
 
     result = generated_outputs.insert_one(output_doc)
     return str(result.inserted_id)
+
+def get_or_create_multi_chat_output(content_ids: list[str], user_id: str) -> str:
+    """
+    Get the user's multi-document conversation over exactly these contents, or create it.
+    Stored with the whole (sorted) set in content_ids, so it is listed with and deleted
+    along with each of its contents.
+    """
+    db = get_database()
+    generated_outputs = db.generated_outputs
+
+    content_ids = sorted(content_ids)
+    existing = generated_outputs.find_one({
+        "user_id": user_id,
+        "feature": "chat_multi",
+        "content_ids": content_ids
+    }, {"_id": 1})
+
+    if existing:
+        return str(existing["_id"])
+
+    output_doc = {
+        "user_id": user_id,
+        "content_ids": content_ids,
+        "feature": "chat_multi",
+        "options": {"content_ids": content_ids, "message_count": 0},
+        "output": {"conversation": []},
+        "created_at": datetime.utcnow()
+    }
+
+    result = generated_outputs.insert_one(output_doc)
+    return str(result.inserted_id)
+
+def _blob_refs(*fields: str) -> dict:
+    # Only the reference parts of packed fields, never the (possibly large) data.
+    return {f"{field}.{part}": 1 for field in fields for part in ("_blob", "store", "ref")}
+
+def delete_content_blobs(content_id: str) -> None:
+    """Remove spilled blobs of a content document and of its generated outputs."""
+    db = get_database()
+
+    raw = db.content.find_one({"_id": ObjectId(content_id)}, _blob_refs("normalized_text", "chunks")) or {}
+    outputs = db.generated_outputs.find(_outputs_of_content(content_id), _blob_refs("output"))
+    delete_packed([raw.get("normalized_text"), raw.get("chunks"), *(o.get("output") for o in outputs)])
+
+def delete_content_outputs(content_id: str) -> None:
+    """Delete a content's generated outputs, including multi-document chats over it."""
+    db = get_database()
+    db.generated_outputs.delete_many(_outputs_of_content(content_id))
+
+def delete_output_blobs(output_id: str) -> None:
+    """Remove the spilled blob of one generated output, if it has one."""
+    db = get_database()
+
+    raw = db.generated_outputs.find_one({"_id": ObjectId(output_id)}, _blob_refs("output")) or {}
+    delete_packed([raw.get("output")])
@@ -0,0 +1,72 @@
+from datetime import datetime, timedelta
+
+from app.database.connection import get_database
+from app.models.blob_storage import INLINE_MAX_BYTES, pack_value, packed_size, unpack_value
+
+# Entries not written or hit for their retention are deleted by MongoDB (TTL index on
+# expires_at); size-based eviction drops the least recently used entries first (index on
+# last_used_at). Both indexes: database/indexes.py.
+# Outputs are stored compressed but never spilled to the blob store: a TTL deletion
+# cannot remove blobs, so an output too large to stay inline is not cached.
+
+
+def get_cached_generation(key: str, retention: timedelta) -> dict | None:
+    """
+    A cached generation output by key, or None. A hit refreshes the entry's
+    retention and recency.
+    """
+    db = get_database()
+    generation_cache = db.generation_cache
+
+    now = datetime.utcnow()
+    doc = generation_cache.find_one_and_update(
+        {"_id": key, "expires_at": {"$gt": now}},
+        {
+            "$set": {"last_used_at": now, "expires_at": now + retention},
+            "$inc": {"hits": 1},
+        },
+        {"output": 1},
+    )
+    return unpack_value(doc["output"]) if doc else None
+
+
+def save_cached_generation(key: str, parts: dict, output: dict, retention: timedelta) -> bool:
+    """
+    Insert or replace a cached generation output; `parts` are the fields its key was
+    built from. Returns False (nothing stored) for outputs too large to keep inline.
+    """
+    db = get_database()
+    generation_cache = db.generation_cache
+
+    packed = pack_value(output, spill=False)
+    if packed_size(packed) > INLINE_MAX_BYTES:
+        return False
+
+    now = datetime.utcnow()
+    generation_cache.update_one(
+        {"_id": key},
+        {
+            "$set": {
+                **parts,
+                "output": packed,
+                "last_used_at": now,
+                "expires_at": now + retention,
+            },
+            "$setOnInsert": {"created_at": now, "hits": 0},
+        },
+        upsert=True,
+    )
+    return True
+
+
+def evict_cached_generations(max_entries: int) -> int:
+    """Delete the least recently used entries beyond max_entries. Returns how many were deleted."""
+    db = get_database()
+    generation_cache = db.generation_cache
+
+    excess = generation_cache.estimated_document_count() - max_entries
+    if excess <= 0:
+        return 0
+    oldest = list(generation_cache.find({}, {"_id": 1}).sort("last_used_at", 1).limit(excess))
+    generation_cache.delete_many({"_id": {"$in": [doc["_id"] for doc in oldest]}})
+    return len(oldest)
@@ -0,0 +1,31 @@
+from datetime import datetime
+
+from app.database.connection import get_database
+
+
+def get_migration_state(name: str) -> dict | None:
+    """Checkpoint and progress of a background migration, by name."""
+    db = get_database()
+    migrations = db.migrations
+
+    return migrations.find_one({"_id": name})
+
+
+def save_migration_state(name: str, state: dict) -> None:
+    """Insert or update a migration's checkpoint and progress counters."""
+    db = get_database()
+    migrations = db.migrations
+
+    migrations.update_one(
+        {"_id": name},
+        {"$set": {**state, "updated_at": datetime.utcnow()}},
+        upsert=True,
+    )
+
+
+def reset_migration_state(name: str) -> None:
+    """Forget a migration's checkpoint; the next run starts from the beginning."""
+    db = get_database()
+    migrations = db.migrations
+
+    migrations.delete_one({"_id": name})
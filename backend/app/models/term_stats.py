@@ -0,0 +1,98 @@
+import numpy as np
+from app.database.connection import get_database
+from app.utils.sparse_codec import unpack_row_indices
+from pymongo import UpdateOne
+
+# Document frequencies live in shard documents {_id: "df-<n>", df: {"<offset>": count}}
+# covering TERM_STATS_SHARD_SIZE hashed features each, so an upload is one $inc per
+# touched shard. {_id: "meta"} holds the chunk total and the hashed feature space
+# (retrievers.HASHED_SPACE_VERSION) the counts belong to.
+TERM_STATS_SHARD_SIZE = 4096
+
+
+def _section_space(section: dict) -> str:
+    # Sections from before the format had its own version: the version was the space's.
+    return section.get("space", section["version"])
+
+
+def _section_frequencies(section: dict) -> tuple[np.ndarray, np.ndarray, int]:
+    """(features, chunks containing each feature, chunk count) of a stored hashed section."""
+    indptr = np.frombuffer(section["indptr"], dtype=np.int32)
+    if "space" in section:
+        indices = unpack_row_indices(section["indices"], indptr)
+    else:
+        indices = np.frombuffer(section["indices"], dtype=np.int32)
+    chunk_count = len(indptr) - 1
+    # A chunk row lists each feature once, so occurrences = chunks containing it.
+    features, counts = np.unique(indices, return_counts=True)
+    return features, counts, chunk_count
+
+
+def _update_term_stats(section: dict | None, sign: int) -> bool:
+    if not section:
+        return False
+
+    db = get_database()
+    term_stats = db.term_stats
+
+    term_stats.update_one(
+        {"_id": "meta"},
+        {"$setOnInsert": {"version": _section_space(section), "chunks": 0}},
+        upsert=True,
+    )
+    meta = term_stats.find_one({"_id": "meta"})
+    if meta.get("version") != _section_space(section):
+        # Counts belong to another hashed feature space; rebuild them instead (global_idf.py).
+        return False
+
+    features, counts, chunk_count = _section_frequencies(section)
+    shards: dict[int, dict[str, int]] = {}
+    for feature, count in zip(features.tolist(), counts.tolist()):
+        shard, offset = divmod(feature, TERM_STATS_SHARD_SIZE)
+        shards.setdefault(shard, {})[f"df.{offset}"] = sign * count
+
+    operations = [
+        UpdateOne({"_id": f"df-{shard}"}, {"$inc": increments}, upsert=True)
+        for shard, increments in shards.items()
+    ]
+    operations.append(UpdateOne({"_id": "meta"}, {"$inc": {"chunks": sign * chunk_count}}))
+    term_stats.bulk_write(operations, ordered=False)
+    return True
+
+
+def add_term_stats(section: dict | None) -> bool:
+    """Count a new content's chunks (its stored hashed section) into the global statistics."""
+    return _update_term_stats(section, 1)
+
+
+def remove_term_stats(section: dict | None) -> bool:
+    """Take a deleted content's chunks back out of the global statistics."""
+    return _update_term_stats(section, -1)
+
+
+def get_term_stats(n_features: int) -> tuple[np.ndarray, int, str | None]:
+    """(document frequency per hashed feature, total chunks, version) as currently stored."""
+    db = get_database()
+    term_stats = db.term_stats
+
+    df = np.zeros(n_features, dtype=np.int64)
+    chunks, version = 0, None
+    for doc in term_stats.find({}):
+        if doc["_id"] == "meta":
+            chunks, version = int(doc.get("chunks", 0)), doc.get("version")
+            continue
+        base = int(doc["_id"].split("-", 1)[1]) * TERM_STATS_SHARD_SIZE
+        for offset, count in (doc.get("df") or {}).items():
+            position = base + int(offset)
+            if position < n_features:
+                df[position] = count
+    return np.maximum(df, 0), max(chunks, 0), version
+
+
+def reset_term_stats(version: str) -> None:
+    """Drop all counts and start over for this hashed feature space."""
+    db = get_database()
+    term_stats = db.term_stats
+
+    term_stats.delete_many({})
+    term_stats.insert_one({"_id": "meta", "version": version, "chunks": 0})
@@ -10,10 +10,19 @@ from app.models.content import (
     GeneratedOutputCreate,
     create_content,
     create_generated_output,
+    delete_content_blobs,
+    delete_content_outputs,
+    delete_output_blobs,
+    delete_retrieval_index,
     get_content_by_id,
+    get_contents_by_ids,
+    get_generated_output_by_id,
     get_generated_outputs,
+    get_content_chunks,
     get_or_create_chatbot_output,
-    get_user_content,
+    get_or_create_generated_output,
+    get_or_create_multi_chat_output,
+    get_user_content_previews,
     update_generated_output,
 )
 from app.models.job import (
@@ -26,16 +35,36 @@ from app.models.quiz_attempt import (
     create_quiz_attempt,
 )
 from app.services.chatbot import chat_with_content as chatbot_service
-from app.services.content_metadata import build_content_chunk_data, build_content_title
+from app.services.chatbot import chat_with_contents, stream_chat_with_content
+from app.services.chunker import retriever_sections
+from app.services.content_metadata import (
+    build_content_chunk_data,
+    build_content_title,
+    ensure_content_chunks,
+    load_retrieval_index,
+    load_retrieval_indexes,
+)
 from app.services.content_processor import (
     process_content,
     process_content_with_progress,
 )
+from app.services.flashcards import FLASHCARD_MODEL, FLASHCARD_PROMPT_VERSION, iter_flashcard_batches
 from app.services.flashcards import generate_flashcards as create_flashcards
+from app.services.generation_cache import generation_key, get_cached_output, store_output
+from app.services.library_search import (
+    DEFAULT_SEARCH_TOP_K,
+    MAX_SEARCH_TOP_K,
+    add_to_library,
+    remove_from_library,
+    search_library,
+)
 from app.services.ppt import generate_presentation
+from app.services.quiz import QUIZ_MODEL, QUIZ_PROMPT_VERSION
 from app.services.quiz import generate_quiz as create_quiz
 from app.services.quiz_evaluator import evaluate_quiz
-from app.services.summary import generate_summary
+from app.services.retrieval_cache import invalidate_content
+from app.services.sections import get_content_sections, get_section
+from app.services.summary import SUMMARY_MODEL, SUMMARY_PROMPT_VERSION, generate_summary
 from bson import ObjectId
 from fastapi import (
     APIRouter,
@@ -44,6 +73,7 @@ from fastapi import (
     File,
     Form,
     HTTPException,
+    Query,
     Request,
     UploadFile,
 )
@@ -71,7 +101,7 @@ async def _process_async_upload(
     try:
         update_job_status(job_id, STATUS_PROCESSING, 5, "Starting content processing...")
 
-        input_type, normalized_text = await process_content_with_progress(
+        input_type, normalized_text, headings = await process_content_with_progress(
             file,
             youtube_url,
             text,
@@ -85,7 +115,7 @@ async def _process_async_upload(
             input_type=input_type,
         )
 
-        chunks, chunk_metadata = build_content_chunk_data(normalized_text)
+        chunks, chunk_metadata, retrieval_index = build_content_chunk_data(normalized_text, headings)
 
         content_data = ContentCreate(
             user_id=user_id,
@@ -94,9 +124,11 @@ async def _process_async_upload(
             title=title,
             chunks=chunks,
             chunk_metadata=chunk_metadata,
+            retrieval_index=retrieval_index,
         )
 
         content_id = create_content(content_data)
+        add_to_library(user_id, content_id, retrieval_index)
         update_job_status(
             job_id,
             STATUS_COMPLETE,
@@ -132,6 +164,49 @@ class _StoredUploadFile:
 
 router = APIRouter(prefix="/content", tags=["Content"])
 
+MAX_CHAT_CONTENTS = 20
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no"
+}
+
+def _requested_section(content: dict, section: int | None) -> dict | None:
+    """The section a feature request is scoped to (None: whole content); 400 if there is no such section."""
+    if section is None:
+        return None
+    found = get_section(content, section)
+    if found is None:
+        raise HTTPException(status_code=400, detail="Section not found")
+    return found
+
+def _flashcards_cache_key(
+    content: dict,
+    stored_chunks: list[str],
+    flashcard_type: str,
+    number_of_cards: int,
+    scope: dict | None,
+) -> tuple[str, dict]:
+    """generation_cache key of a deck (shared by the plain and streaming endpoints)."""
+    return generation_key(
+        content, stored_chunks, "flashcards",
+        {
+            "flashcard_type":  flashcard_type,
+            "number_of_cards": number_of_cards,
+            "chunk_range":     (scope["start"], scope["end"]) if scope else None,
+        },
+        FLASHCARD_PROMPT_VERSION, FLASHCARD_MODEL,
+    )
+
+def _save_output(output_data: GeneratedOutputCreate, cached: dict | None) -> tuple[str, dict]:
+    """
+    Save a generated output; on a generation-cache hit, reuse the user's saved output with
+    the same options instead of adding a copy. Returns its id and the output to send.
+    """
+    if cached is not None:
+        return get_or_create_generated_output(output_data)
+    return create_generated_output(output_data), output_data.output
 
 @router.post("/upload-async")
 async def upload_content_async(
@@ -217,7 +292,7 @@ async def upload_content(
     text: str | None = Form(None)
 ):
     try:
-        input_type, normalized_text = await process_content(file, youtube_url, text)
+        input_type, normalized_text, headings = await process_content(file, youtube_url, text)
 
         # Generate meaningful title
         title = build_content_title(
@@ -227,7 +302,7 @@ async def upload_content(
             input_type=input_type,
         )
 
-        chunks, chunk_metadata = build_content_chunk_data(normalized_text)
+        chunks, chunk_metadata, retrieval_index = build_content_chunk_data(normalized_text, headings)
 
         content_data = ContentCreate(
             user_id=current_user["user_id"],
@@ -235,10 +310,12 @@ async def upload_content(
             normalized_text=normalized_text,
             title=title,
             chunks=chunks,
-            chunk_metadata=chunk_metadata
+            chunk_metadata=chunk_metadata,
+            retrieval_index=retrieval_index
         )
 
         content_id = create_content(content_data)
+        add_to_library(current_user["user_id"], content_id, retrieval_index)
 
         return {
             "content_id": content_id,
@@ -296,7 +373,7 @@ async def upload_content_stream(
     async def process_and_signal():
         """Process content and signal completion/error via queue"""
         try:
-            input_type, normalized_text = await process_content_with_progress(
+            input_type, normalized_text, headings = await process_content_with_progress(
                 file, youtube_url, text, progress_callback
             )
 
@@ -308,7 +385,7 @@ async def upload_content_stream(
                 input_type=input_type,
             )
 
-            chunks, chunk_metadata = build_content_chunk_data(normalized_text)
+            chunks, chunk_metadata, retrieval_index = build_content_chunk_data(normalized_text, headings)
 
             # Save to database
             content_data = ContentCreate(
@@ -317,10 +394,12 @@ async def upload_content_stream(
                 normalized_text=normalized_text,
                 title=title,
                 chunks=chunks,
-                chunk_metadata=chunk_metadata
+                chunk_metadata=chunk_metadata,
+                retrieval_index=retrieval_index
             )
 
             content_id = create_content(content_data)
+            add_to_library(current_user["user_id"], content_id, retrieval_index)
 
             # Signal completion
             await progress_queue.put({
@@ -372,20 +451,14 @@ async def upload_content_stream(
                 except asyncio.CancelledError:
                     pass
 
-    return StreamingResponse(
-        generate_progress(),
-        media_type="text/event-stream",
-        headers={
-            "Cache-Control": "no-cache",
-            "Connection": "keep-alive",
-            "X-Accel-Buffering": "no"
-        }
-    )
+    return StreamingResponse(generate_progress(), media_type="text/event-stream", headers=SSE_HEADERS)
 
 @router.post("/summary")
 async def generate_content_summary(
     content_id: str = Form(...),
     summary_type: str = Form("detailed"),
+    section: int | None = Form(None),
+    regenerate: bool = Form(False),
     current_user: dict = Depends(get_current_user)
 ):
     try:
@@ -405,28 +478,46 @@ async def generate_content_summary(
         }
 
         prompt_suffix = summary_prompts.get(summary_type, summary_prompts["detailed"])
-        stored_chunks = content.get('chunks') or []
-        summary = generate_summary(
-            prompt_suffix=prompt_suffix,
-            stored_chunks=stored_chunks if stored_chunks else None,
-            normalized_text=content['normalized_text'] if not stored_chunks else None,
+        stored_chunks = get_content_chunks(ensure_content_chunks(content))
+        scope = _requested_section(content, section)
+        chunk_range = (scope["start"], scope["end"]) if scope else None
+        # Same document + options + prompts = same summary, whoever uploaded it (generation_cache)
+        cache_key, key_parts = generation_key(
+            content, stored_chunks, "summary",
+            {"prompt_suffix": prompt_suffix, "chunk_range": chunk_range},
+            SUMMARY_PROMPT_VERSION, SUMMARY_MODEL,
         )
+        cached = get_cached_output(cache_key, "summary", regenerate)
+        if cached:
+            summary = cached["summary"]
+        else:
+            summary = generate_summary(
+                prompt_suffix=prompt_suffix,
+                stored_chunks=stored_chunks,
+                retrieval_index=load_retrieval_index(content),
+                chunk_range=chunk_range,
+            )
+            if summary:
+                store_output(cache_key, key_parts, {"summary": summary})
 
         output_data = GeneratedOutputCreate(
             user_id=current_user["user_id"],
             content_id=content_id,
             feature="summary",
-            options={"summary_type": summary_type},
+            options={"summary_type": summary_type, "section": section},
             output={"summary": summary}
         )
 
-        output_id = create_generated_output(output_data)
+        output_id, output = _save_output(output_data, cached)
+        summary = output["summary"]
 
         return {
             "content_id": content_id,
             "summary": summary,
             "summary_type": summary_type,
-            "output_id": output_id
+            "section": scope,
+            "output_id": output_id,
+            "cached": cached is not None
         }
     except HTTPException:
         raise
@@ -438,6 +529,8 @@ async def generate_flashcards_endpoint(
     content_id: str = Form(...),
     flashcard_type: str = Form("Concept → Definition"),
     number_of_cards: int = Form(10),
+    section: int | None = Form(None),
+    regenerate: bool = Form(False),
     current_user: dict = Depends(get_current_user)
 ):
     try:
@@ -449,40 +542,124 @@ async def generate_flashcards_endpoint(
         if content["user_id"] != current_user["user_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
 
-        stored_chunks = content.get('chunks') or []
-        flashcards = create_flashcards(
-            flashcard_type=flashcard_type,
-            num_cards=number_of_cards,
-            stored_chunks=stored_chunks if stored_chunks else None,
-            normalized_text=content['normalized_text'] if not stored_chunks else None,
-        )
+        stored_chunks = get_content_chunks(ensure_content_chunks(content))
+        scope = _requested_section(content, section)
+        cache_key, key_parts = _flashcards_cache_key(content, stored_chunks, flashcard_type, number_of_cards, scope)
+        cached = get_cached_output(cache_key, "flashcards", regenerate)
+        if cached:
+            flashcards = cached
+        else:
+            flashcards = create_flashcards(
+                flashcard_type=flashcard_type,
+                num_cards=number_of_cards,
+                stored_chunks=stored_chunks,
+                retrieval_index=load_retrieval_index(content),
+                chunk_range=(scope["start"], scope["end"]) if scope else None,
+            )
+            if flashcards.get("flashcards"):
+                store_output(cache_key, key_parts, flashcards)
 
         output_data = GeneratedOutputCreate(
             user_id=current_user["user_id"],
             content_id=content_id,
             feature="flashcards",
-            options={"flashcard_type": flashcard_type, "number_of_cards": number_of_cards},
+            options={"flashcard_type": flashcard_type, "number_of_cards": number_of_cards, "section": section},
             output=flashcards
         )
 
-        output_id = create_generated_output(output_data)
+        output_id, flashcards = _save_output(output_data, cached)
 
         return {
             "content_id": content_id,
             "flashcards": flashcards,
-            "output_id": output_id
+            "section": scope,
+            "output_id": output_id,
+            "cached": cached is not None
         }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/flashcards/stream")
+async def stream_flashcards_endpoint(
+    content_id: str = Form(...),
+    flashcard_type: str = Form("Concept → Definition"),
+    number_of_cards: int = Form(10),
+    section: int | None = Form(None),
+    regenerate: bool = Form(False),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Flashcards as server-sent events: "cards" with each batch as soon as it is generated
+    (a cached deck comes as one batch), then "complete" with the output_id of the saved
+    deck (or "error").
+    """
+    content = get_content_by_id(content_id)
+
+    if not content:
+        raise HTTPException(status_code=404, detail="Content not found")
+
+    if content["user_id"] != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    stored_chunks = get_content_chunks(ensure_content_chunks(content))
+    scope = _requested_section(content, section)
+    retrieval_index = load_retrieval_index(content)
+    cache_key, key_parts = _flashcards_cache_key(content, stored_chunks, flashcard_type, number_of_cards, scope)
+
+    def generate_cards():
+        """Runs in the threadpool (sync generator); a generated deck is saved once, after the last batch."""
+        yield f"data: {json.dumps({'stage': 'start', 'total': number_of_cards, 'section': scope})}\n\n"
+        flashcards: list[dict] = []
+        options = {"flashcard_type": flashcard_type, "number_of_cards": number_of_cards, "section": section}
+        try:
+            cached = get_cached_output(cache_key, "flashcards", regenerate)
+            if cached:
+                # Saved (or reused) before streaming, so the one batch is the saved deck
+                output_id, saved = _save_output(GeneratedOutputCreate(
+                    user_id=current_user["user_id"],
+                    content_id=content_id,
+                    feature="flashcards",
+                    options=options,
+                    output=cached
+                ), cached)
+                batches = [saved["flashcards"]]
+            else:
+                batches = iter_flashcard_batches(
+                    flashcard_type=flashcard_type,
+                    num_cards=number_of_cards,
+                    stored_chunks=stored_chunks,
+                    retrieval_index=retrieval_index,
+                    chunk_range=(scope["start"], scope["end"]) if scope else None,
+                )
+            for cards in batches:
+                flashcards.extend(cards)
+                yield f"data: {json.dumps({'stage': 'cards', 'flashcards': cards, 'count': len(flashcards)})}\n\n"
+            if not cached:
+                if flashcards:
+                    store_output(cache_key, key_parts, {"flashcards": flashcards})
+                output_id = create_generated_output(GeneratedOutputCreate(
+                    user_id=current_user["user_id"],
+                    content_id=content_id,
+                    feature="flashcards",
+                    options=options,
+                    output={"flashcards": flashcards}
+                ))
+            yield f"data: {json.dumps({'stage': 'complete', 'count': len(flashcards), 'output_id': output_id, 'cached': cached is not None})}\n\n"
+        except Exception as e:
+            yield f"data: {json.dumps({'stage': 'error', 'message': str(e)})}\n\n"
+
+    return StreamingResponse(generate_cards(), media_type="text/event-stream", headers=SSE_HEADERS)
+
 @router.post("/quiz")
 async def generate_quiz_endpoint(
     content_id: str = Form(...),
     number_of_questions: int = Form(10),
     difficulty: str = Form("Medium"),
     mode: str = Form("Practice"),
+    section: int | None = Form(None),
+    regenerate: bool = Form(False),
     current_user: dict = Depends(get_current_user)
 ):
     try:
@@ -494,14 +671,29 @@ async def generate_quiz_endpoint(
         if content["user_id"] != current_user["user_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
 
-        stored_chunks = content.get('chunks') or []
-        quiz_data = create_quiz(
-            max_questions=number_of_questions,
-            difficulty_level=difficulty,
-            quiz_mode=mode,
-            stored_chunks=stored_chunks if stored_chunks else None,
-            normalized_text=content['normalized_text'] if not stored_chunks else None,
+        stored_chunks = get_content_chunks(ensure_content_chunks(content))
+        scope = _requested_section(content, section)
+        chunk_range = (scope["start"], scope["end"]) if scope else None
+        # The mode only changes how the quiz is taken, not the questions: not part of the key
+        cache_key, key_parts = generation_key(
+            content, stored_chunks, "quiz",
+            {"number_of_questions": number_of_questions, "difficulty": difficulty, "chunk_range": chunk_range},
+            QUIZ_PROMPT_VERSION, QUIZ_MODEL,
         )
+        cached = get_cached_output(cache_key, "quiz", regenerate)
+        if cached:
+            quiz_data = cached
+        else:
+            quiz_data = create_quiz(
+                max_questions=number_of_questions,
+                difficulty_level=difficulty,
+                quiz_mode=mode,
+                stored_chunks=stored_chunks,
+                retrieval_index=load_retrieval_index(content),
+                chunk_range=chunk_range,
+            )
+            if quiz_data.get("quiz"):
+                store_output(cache_key, key_parts, quiz_data)
 
         output_data = GeneratedOutputCreate(
             user_id=current_user["user_id"],
@@ -510,24 +702,80 @@ async def generate_quiz_endpoint(
             options={
                 "number_of_questions": number_of_questions,
                 "difficulty": difficulty,
-                "mode": mode
+                "mode": mode,
+                "section": section
             },
             output=quiz_data
         )
 
-        output_id = create_generated_output(output_data)
+        output_id, quiz_data = _save_output(output_data, cached)
 
         return {
             "content_id": content_id,
             "quiz": quiz_data,
             "mode": mode,
-            "output_id": output_id
+            "section": scope,
+            "output_id": output_id,
+            "cached": cached is not None
         }
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _parse_chat_history(chat_history: str | None) -> list[dict]:
+    """Chat history sent by the frontend as [{role, content}] turns (old {sender, text} format too)."""
+    history = []
+    if chat_history:
+        try:
+            parsed_history = json.loads(chat_history)
+            # Handle both formats: {role, content} from frontend or {sender, text} from old format
+            for msg in parsed_history:
+                if msg.get('role'):
+                    # New format: {role: 'user'|'assistant', content: 'text'}
+                    history.append({"role": msg.get('role'), "content": msg.get('content', '')})
+                elif msg.get('sender'):
+                    # Old format: {sender: 'user'|'ai', text: 'text'}
+                    role = 'user' if msg.get('sender') == 'user' else 'assistant'
+                    history.append({"role": role, "content": msg.get('text', '')})
+        except Exception:
+            history = []
+    return history
+
+def _save_chat_turn(content_id: str, user_id: str, question: str, answer: str) -> str:
+    """Append a question and its answer to the user's conversation about a content; returns its output_id."""
+    # Get or create chatbot conversation for this content
+    output_id = get_or_create_chatbot_output(content_id, user_id)
+
+    # CRITICAL: Retrieve EXISTING conversation from database first
+    existing_output = get_generated_output_by_id(output_id)
+
+    # Start with existing conversation from database
+    full_conversation = []
+    if existing_output and existing_output.get('output') and existing_output['output'].get('conversation'):
+        # Filter out any empty or invalid messages from existing conversation
+        existing_conv = existing_output['output']['conversation']
+        full_conversation = [
+            msg for msg in existing_conv
+            if msg.get('sender') and msg.get('text') and msg.get('text').strip()
+        ]
+
+    # Add the new question and answer (with validation)
+    if question and question.strip():
+        full_conversation.append({"sender": "user", "text": question.strip()})
+    if answer and answer.strip():
+        full_conversation.append({"sender": "ai", "text": answer.strip()})
+
+    # Log the conversation being saved (for debugging)
+    print(f"[CHATBOT] Saving conversation with {len(full_conversation)} messages for content {content_id}")
+
+    # Update the existing conversation with the merged history
+    update_generated_output(output_id, {
+        "output": {"conversation": full_conversation},
+        "options": {"message_count": len(full_conversation)}
+    })
+    return output_id
+
 @router.post("/chat")
 async def chat_with_content_endpoint(
     content_id: str = Form(...),
@@ -536,8 +784,6 @@ async def chat_with_content_endpoint(
     current_user: dict = Depends(get_current_user)
 ):
     try:
-        import json
-
         content = get_content_by_id(content_id)
 
         if not content:
@@ -546,79 +792,130 @@ async def chat_with_content_endpoint(
         if content["user_id"] != current_user["user_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
 
-        # Parse chat history if provided
-        history = []
-        frontend_messages = []
-        if chat_history:
-            try:
-                parsed_history = json.loads(chat_history)
-                # Handle both formats: {role, content} from frontend or {sender, text} from old format
-                for msg in parsed_history:
-                    if msg.get('role'):
-                        # New format: {role: 'user'|'assistant', content: 'text'}
-                        history.append({"role": msg.get('role'), "content": msg.get('content', '')})
-                        frontend_messages.append({
-                            "sender": "user" if msg.get('role') == 'user' else "ai",
-                            "text": msg.get('content', '')
-                        })
-                    elif msg.get('sender'):
-                        # Old format: {sender: 'user'|'ai', text: 'text'}
-                        role = 'user' if msg.get('sender') == 'user' else 'assistant'
-                        history.append({"role": role, "content": msg.get('text', '')})
-                        frontend_messages.append({
-                            "sender": msg.get('sender'),
-                            "text": msg.get('text', '')
-                        })
-            except Exception:
-                history = []
-                frontend_messages = []
-
-        # Use stored chunks if available (new content), fall back to raw text for old content
-        stored_chunks = content.get('chunks') or []
+        # Content from before stored chunks is backfilled once here (see worker/backfill.py)
+        stored_chunks = get_content_chunks(ensure_content_chunks(content))
         answer = chatbot_service(
             question=question,
-            chat_history=history,
-            stored_chunks=stored_chunks if stored_chunks else None,
-            normalized_text=content['normalized_text'] if not stored_chunks else None,
+            chat_history=_parse_chat_history(chat_history),
+            stored_chunks=stored_chunks,
+            retrieval_index=load_retrieval_index(content),
         )
 
-        # Get or create chatbot conversation for this content
-        output_id = get_or_create_chatbot_output(content_id, current_user["user_id"])
+        output_id = _save_chat_turn(content_id, current_user["user_id"], question, answer)
 
-        # CRITICAL: Retrieve EXISTING conversation from database first
-        db = get_database()
-        generated_outputs = db.generated_outputs
-        existing_output = generated_outputs.find_one({"_id": ObjectId(output_id)})
-
-        # Start with existing conversation from database
-        full_conversation = []
-        if existing_output and existing_output.get('output') and existing_output['output'].get('conversation'):
-            # Filter out any empty or invalid messages from existing conversation
-            existing_conv = existing_output['output']['conversation']
-            full_conversation = [
-                msg for msg in existing_conv
-                if msg.get('sender') and msg.get('text') and msg.get('text').strip()
-            ]
+        return {
+            "content_id": content_id,
+            "question": question,
+            "answer": answer,
+            "output_id": output_id
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/chat/stream")
+async def stream_chat_with_content_endpoint(
+    content_id: str = Form(...),
+    question: str = Form(...),
+    chat_history: str = Form(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    /chat as server-sent events: "token" with each piece of the answer as the model
+    generates it, then "complete" with the full answer and output_id once the turn is
+    saved (or "error"; nothing is saved then).
+    """
+    content = get_content_by_id(content_id)
+
+    if not content:
+        raise HTTPException(status_code=404, detail="Content not found")
+
+    if content["user_id"] != current_user["user_id"]:
+        raise HTTPException(status_code=403, detail="Access denied")
+
+    stored_chunks = get_content_chunks(ensure_content_chunks(content))
+    retrieval_index = load_retrieval_index(content)
+    history = _parse_chat_history(chat_history)
 
-        # Add the new question and answer (with validation)
+    def generate_answer():
+        """Runs in the threadpool (sync generator); the conversation is saved once, after the last token."""
+        yield f"data: {json.dumps({'stage': 'start'})}\n\n"
+        pieces: list[str] = []
+        try:
+            for text in stream_chat_with_content(
+                question=question,
+                chat_history=history,
+                stored_chunks=stored_chunks,
+                retrieval_index=retrieval_index,
+            ):
+                pieces.append(text)
+                yield f"data: {json.dumps({'stage': 'token', 'text': text})}\n\n"
+
+            answer = "".join(pieces).strip()
+            output_id = _save_chat_turn(content_id, current_user["user_id"], question, answer)
+            yield f"data: {json.dumps({'stage': 'complete', 'answer': answer, 'output_id': output_id})}\n\n"
+        except Exception as e:
+            print(f"[CHATBOT] Stream error: {e}")
+            yield f"data: {json.dumps({'stage': 'error', 'message': str(e)})}\n\n"
+
+    return StreamingResponse(generate_answer(), media_type="text/event-stream", headers=SSE_HEADERS)
+
+@router.post("/chat/multi")
+async def chat_with_contents_endpoint(
+    content_ids: str = Form(...),
+    question: str = Form(...),
+    chat_history: str = Form(None),
+    current_user: dict = Depends(get_current_user)
+):
+    """Chat across several contents at once; content_ids is a JSON list"""
+    try:
+        try:
+            ids = list(dict.fromkeys(json.loads(content_ids)))
+        except Exception:
+            raise HTTPException(status_code=400, detail="content_ids must be a JSON list")
+        if not ids or len(ids) > MAX_CHAT_CONTENTS:
+            raise HTTPException(status_code=400, detail=f"Select between 1 and {MAX_CHAT_CONTENTS} contents")
+
+        # Ownership, titles and chunk counts only — no texts are loaded here
+        contents = get_contents_by_ids(ids, {"user_id": 1, "title": 1, "input_type": 1, "chunk_metadata.count": 1})
+        if len(contents) != len(ids):
+            raise HTTPException(status_code=404, detail="Content not found")
+        if any(c["user_id"] != current_user["user_id"] for c in contents.values()):
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        answer, sources = chat_with_contents(
+            question=question,
+            chat_history=_parse_chat_history(chat_history),
+            retrieval_indexes=load_retrieval_indexes(contents, *retriever_sections("chatbot")),
+            titles={
+                cid: c.get("title") or f"{c['input_type'].capitalize()} Content"
+                for cid, c in contents.items()
+            },
+        )
+
+        # One conversation per set of contents, kept like single-content chat
+        output_id = get_or_create_multi_chat_output(ids, current_user["user_id"])
+        existing_output = get_generated_output_by_id(output_id)
+        conversation = [
+            msg for msg in ((existing_output or {}).get("output") or {}).get("conversation", [])
+            if msg.get("sender") and msg.get("text") and msg.get("text").strip()
+        ]
         if question and question.strip():
-            full_conversation.append({"sender": "user", "text": question.strip()})
+            conversation.append({"sender": "user", "text": question.strip()})
         if answer and answer.strip():
-            full_conversation.append({"sender": "ai", "text": answer.strip()})
-
-        # Log the conversation being saved (for debugging)
-        print(f"[CHATBOT] Saving conversation with {len(full_conversation)} messages for content {content_id}")
+            conversation.append({"sender": "ai", "text": answer.strip(), "sources": sources})
 
-        # Update the existing conversation with the merged history
         update_generated_output(output_id, {
-            "output": {"conversation": full_conversation},
-            "options": {"message_count": len(full_conversation)}
+            "output": {"conversation": conversation},
+            "options": {"content_ids": sorted(ids), "message_count": len(conversation)}
         })
 
         return {
-            "content_id": content_id,
+            "content_ids": ids,
             "question": question,
             "answer": answer,
+            "sources": sources,
             "output_id": output_id
         }
     except HTTPException:
@@ -629,7 +926,8 @@ async def chat_with_content_endpoint(
 @router.get("/history")
 async def get_content_history(current_user: dict = Depends(get_current_user)):
     try:
-        contents = get_user_content(current_user["user_id"])
+        # Only a 200-char preview of each text leaves the database
+        contents = get_user_content_previews(current_user["user_id"], preview_chars=200)
 
         history = []
         for c in contents:
@@ -638,13 +936,26 @@ async def get_content_history(current_user: dict = Depends(get_current_user)):
                 "input_type": c["input_type"],
                 "created_at": c["created_at"],
                 "title": c.get("title") or f"{c['input_type'].capitalize()} Content",
-                "preview": c["normalized_text"][:200] + "..." if len(c["normalized_text"]) > 200 else c["normalized_text"]
+                "preview": c["preview"] + "..." if c["text_length"] > 200 else c["preview"]
             })
 
         return {"history": history}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/search")
+async def search_content_library(
+    q: str = Query(..., min_length=1),
+    top_k: int = Query(DEFAULT_SEARCH_TOP_K, ge=1, le=MAX_SEARCH_TOP_K),
+    current_user: dict = Depends(get_current_user)
+):
+    """Search every content the user owns and return the best-matching chunks."""
+    try:
+        results = search_library(current_user["user_id"], q, top_k)
+        return {"query": q, "results": results}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{content_id}/source")
 async def get_content_source(
     content_id: str,
@@ -673,6 +984,39 @@ async def get_content_source(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/{content_id}/sections")
+async def get_content_sections_endpoint(
+    content_id: str,
+    current_user: dict = Depends(get_current_user)
+):
+    """List the content's sections; pass a section's number as `section` to scope a feature to it"""
+    try:
+        db = get_database()
+        content = db.content.find_one(
+            {"_id": ObjectId(content_id)},
+            {"user_id": 1, "chunk_metadata.sections": 1, "chunk_metadata.sections_source": 1},
+        )
+
+        if not content:
+            raise HTTPException(status_code=404, detail="Content not found")
+
+        if content["user_id"] != current_user["user_id"]:
+            raise HTTPException(status_code=403, detail="Access denied")
+
+        return {
+            "content_id": content_id,
+            "source": (content.get("chunk_metadata") or {}).get("sections_source"),
+            "sections": [
+                {"section": number, "title": section["title"], "level": section["level"],
+                 "chunk_count": section["end"] - section["start"]}
+                for number, section in enumerate(get_content_sections(content))
+            ]
+        }
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.get("/{content_id}/outputs")
 async def get_content_outputs(
     content_id: str,
@@ -725,8 +1069,7 @@ async def evaluate_quiz_attempt(
         except Exception:
             raise HTTPException(status_code=400, detail="Responses must be valid JSON array")
 
-        db = get_database()
-        quiz_output = db.generated_outputs.find_one({"_id": ObjectId(quiz_id)})
+        quiz_output = get_generated_output_by_id(quiz_id)
         if not quiz_output:
             raise HTTPException(status_code=404, detail="Quiz not found")
 
@@ -769,10 +1112,7 @@ async def get_output_by_id(
     current_user: dict = Depends(get_current_user)
 ):
     try:
-        db = get_database()
-        generated_outputs = db.generated_outputs
-
-        output = generated_outputs.find_one({"_id": ObjectId(output_id)})
+        output = get_generated_output_by_id(output_id)
 
         if not output:
             raise HTTPException(status_code=404, detail="Output not found")
@@ -782,7 +1122,8 @@ async def get_output_by_id(
 
         return {
             "output_id": str(output["_id"]),
-            "content_id": output["content_id"],
+            "content_id": output.get("content_id"),
+            "content_ids": output.get("content_ids"),  # multi-document chats
             "feature": output["feature"],
             "options": output["options"],
             "output": output["output"],
@@ -808,7 +1149,7 @@ async def update_output_score(
         db = get_database()
         generated_outputs = db.generated_outputs
 
-        output = generated_outputs.find_one({"_id": ObjectId(output_id)})
+        output = generated_outputs.find_one({"_id": ObjectId(output_id)}, {"user_id": 1})
 
         if not output:
             raise HTTPException(status_code=404, detail="Output not found")
@@ -849,7 +1190,7 @@ async def delete_output(
         db = get_database()
         generated_outputs = db.generated_outputs
 
-        output = generated_outputs.find_one({"_id": ObjectId(output_id)})
+        output = generated_outputs.find_one({"_id": ObjectId(output_id)}, {"user_id": 1})
 
         if not output:
             raise HTTPException(status_code=404, detail="Output not found")
@@ -857,7 +1198,8 @@ async def delete_output(
         if output["user_id"] != current_user["user_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
 
-        # Delete the output
+        # Delete the output (and its spilled payload, if any)
+        delete_output_blobs(output_id)
         generated_outputs.delete_one({"_id": ObjectId(output_id)})
 
         return {"success": True, "message": "Output deleted successfully"}
@@ -872,6 +1214,7 @@ async def generate_ppt_endpoint(
     slide_count: int = Form(10),
     theme: str = Form("modern"),
     include_images: bool = Form(True),
+    section: int | None = Form(None),
     current_user: dict = Depends(get_current_user)
 ):
     try:
@@ -885,18 +1228,29 @@ async def generate_ppt_endpoint(
         if content["user_id"] != current_user["user_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
 
+        # One section: its text only. Whole content: sampled section by section when indexed.
+        scope = _requested_section(ensure_content_chunks(content), section)
+        if scope:
+            source_text = content['normalized_text'][scope["char_start"]:scope["char_end"]]
+            sections = None
+        else:
+            source_text = content['normalized_text']
+            sections = get_content_sections(content)
+
         # First, analyze content and get structure for preview
         slide_structure = analyze_content_for_slides(
-            normalized_text=content['normalized_text'],
-            slide_count=slide_count
+            normalized_text=source_text,
+            slide_count=slide_count,
+            sections=sections
         )
 
         # Generate presentation file
         file_path = generate_presentation(
-            normalized_text=content['normalized_text'],
+            normalized_text=source_text,
             slide_count=slide_count,
             theme=theme,
-            include_images=include_images
+            include_images=include_images,
+            sections=sections
         )
 
         # Save output metadata with slide structure
@@ -907,7 +1261,8 @@ async def generate_ppt_endpoint(
             options={
                 "slide_count": slide_count,
                 "theme": theme,
-                "include_images": include_images
+                "include_images": include_images,
+                "section": section
             },
             output={
                 "file_path": file_path,
@@ -927,7 +1282,8 @@ async def generate_ppt_endpoint(
             "options": {
                 "slide_count": slide_count,
                 "theme": theme,
-                "include_images": include_images
+                "include_images": include_images,
+                "section": section
             }
         }
 
@@ -946,10 +1302,7 @@ async def download_ppt(
 
         from fastapi.responses import FileResponse
 
-        db = get_database()
-        generated_outputs = db.generated_outputs
-
-        output = generated_outputs.find_one({"_id": ObjectId(output_id)})
+        output = get_generated_output_by_id(output_id)
 
         if not output:
             raise HTTPException(status_code=404, detail="Output not found")
@@ -1010,7 +1363,7 @@ async def rename_content(
         if not title:
             raise HTTPException(status_code=400, detail="Title cannot be empty")
 
-        content = content_collection.find_one({"_id": ObjectId(content_id)})
+        content = get_content_by_id(content_id)
 
         if not content:
             raise HTTPException(status_code=404, detail="Content not found")
@@ -1023,6 +1376,7 @@ async def rename_content(
             {"_id": ObjectId(content_id)},
             {"$set": {"title": title}}
         )
+        invalidate_content(content)
 
         return {"success": True, "message": "Content renamed successfully", "title": title}
     except HTTPException:
@@ -1038,10 +1392,9 @@ async def delete_content(
     try:
         db = get_database()
         content_collection = db.content
-        generated_outputs = db.generated_outputs
         quiz_attempts = db.quiz_attempts
 
-        content = content_collection.find_one({"_id": ObjectId(content_id)})
+        content = get_content_by_id(content_id)
 
         if not content:
             raise HTTPException(status_code=404, detail="Content not found")
@@ -1049,14 +1402,22 @@ async def delete_content(
         if content["user_id"] != current_user["user_id"]:
             raise HTTPException(status_code=403, detail="Access denied")
 
-        # Delete all related outputs
-        generated_outputs.delete_many({"content_id": content_id})
+        # Delete spilled text/output payloads before the documents referencing them
+        delete_content_blobs(content_id)
+
+        # Delete all related outputs (multi-document chats over it too)
+        delete_content_outputs(content_id)
 
         # Delete all related quiz attempts
         quiz_attempts.delete_many({"content_id": content_id})
 
+        # Delete the stored retrieval index (and its share of the global term statistics)
+        delete_retrieval_index(content_id)
+
         # Delete the content itself
         content_collection.delete_one({"_id": ObjectId(content_id)})
+        remove_from_library(current_user["user_id"], content_id)
+        invalidate_content(content)
 
         return {"success": True, "message": "Content and all related data deleted successfully"}
     except HTTPException:
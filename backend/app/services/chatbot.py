@@ -1,74 +1,205 @@
 """
 chatbot.py — RAG-based chatbot service.
 
-Supports pre-stored chunks (MongoDB content['chunks']) and raw normalized_text fallback.
+Reads the content's stored chunks; raw text passed in directly is chunked the same way.
+Multi-document chat (chat_with_contents) ranks chunks across several contents'
+stored indexes and fetches only the chunks it uses. Retrieved chunks are cut
+down to the sentences relevant to the question (context_compression.py).
+stream_chat_with_content yields the answer as the model generates it.
 """
 
 import os
+from collections.abc import Iterator, Sequence
 
-from app.services.chunker import get_chunks_for_feature, retrieve_top_k
+from app.models.content import get_chunk_texts
+from app.services.chunker import compute_chunks, get_chunks_across_contents, get_packed_chunks_for_feature
+from app.services.context_compression import compress_context, compress_passages
+from app.services.llm_gateway import chat_completion, stream_chat_completion
+from app.services.tokens import count_tokens_many, pack_texts, prompt_budget
 from dotenv import load_dotenv
-from groq import Groq
 
 load_dotenv()
 
+CHAT_MODEL = "llama-3.1-8b-instant"
+CHAT_MAX_TOKENS = 400
+CHAT_HISTORY_TURNS = 4
+
+CHAT_SYSTEM_TEMPLATE = """You are a helpful assistant. Answer the user's question using ONLY the following context.
+If the context doesn't contain enough information, say so honestly.
+
+=== RELEVANT CONTEXT ===
+{context}
+========================
+
+Be concise, accurate, and cite specific details from the context when possible."""
+
+NO_CONTENT_ANSWER = "No content available to answer your question."
+
 
 def chat_with_content(
     text_input: str | None = None,
     question: str = "",
     chat_history: list[dict] | None = None,
-    stored_chunks: list[str] | None = None,
-    normalized_text: str | None = None,
+    stored_chunks: Sequence[str] | None = None,
+    retrieval_index: dict | None = None,
 ) -> str:
     """
     Answer user questions using RAG over stored_chunks or raw text.
 
     Args:
-        text_input: Positional fallback parameter.
+        text_input: Raw text, used only when there are no stored chunks.
         question: User's question.
         chat_history: Previous conversation turns.
         stored_chunks: Pre-computed chunks list from MongoDB.
-        normalized_text: Raw text fallback.
+        retrieval_index: Stored retrieval index for stored_chunks, if available.
     """
+    messages = _content_messages(text_input, question, chat_history, stored_chunks, retrieval_index)
+    if messages is None:
+        return NO_CONTENT_ANSWER
+    return _answer(messages)
+
+
+def stream_chat_with_content(
+    text_input: str | None = None,
+    question: str = "",
+    chat_history: list[dict] | None = None,
+    stored_chunks: Sequence[str] | None = None,
+    retrieval_index: dict | None = None,
+) -> Iterator[str]:
+    """
+    chat_with_content, yielding the answer in pieces as the model generates it
+    (same arguments). Errors are raised to the caller instead of being answered.
+    """
+    messages = _content_messages(text_input, question, chat_history, stored_chunks, retrieval_index)
+    if messages is None:
+        yield NO_CONTENT_ANSWER
+        return
+    yield from stream_chat_completion(
+        model=CHAT_MODEL,
+        messages=messages,
+        temperature=0.7,
+        max_tokens=CHAT_MAX_TOKENS,
+    )
+
+
+def _content_messages(
+    text_input: str | None,
+    question: str,
+    chat_history: list[dict] | None,
+    stored_chunks: Sequence[str] | None,
+    retrieval_index: dict | None,
+) -> list[dict] | None:
+    """Chat messages answering `question` over one content; None if there is no content."""
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise ValueError("GROQ_API_KEY environment variable not set")
 
-    content_raw = text_input or normalized_text or ""
-    if stored_chunks and isinstance(stored_chunks, list) and len(stored_chunks) > 0:
-        chunks = stored_chunks
-    elif content_raw:
-        chunks = get_chunks_for_feature(content_raw, "chatbot")
-    else:
-        return "No content available to answer your question."
+    # Stored content always has chunks (legacy documents are backfilled: worker/backfill.py)
+    chunks = stored_chunks
+    if not chunks and text_input:
+        chunks = compute_chunks(text_input)
+    if not chunks:
+        return None
 
-    # Retrieve 3 most relevant chunks for user's question
-    relevant_chunks = retrieve_top_k(chunks, question, top_k=3)
-    context = "\n\n".join(relevant_chunks)
+    history = (chat_history or [])[-CHAT_HISTORY_TURNS:]
 
-    system_message = f"""You are a helpful assistant. Answer the user's question using ONLY the following context.
-If the context doesn't contain enough information, say so honestly.
+    # Retrieve the most relevant chunks for user's question (backend per RETRIEVER_CONFIG),
+    # keeping only what fits the model budget next to the prompt, history and answer
+    budget = prompt_budget(
+        CHAT_MODEL,
+        CHAT_MAX_TOKENS,
+        CHAT_SYSTEM_TEMPLATE.format(context=""),
+        question,
+        *(turn.get("content") or "" for turn in history),
+    )
+    packed = get_packed_chunks_for_feature(chunks, "chatbot", budget, user_query=question, index=retrieval_index)
+    context = compress_context(packed[0], "chatbot", question) if packed else ""
 
-=== RELEVANT CONTEXT ===
-{context}
-========================
+    return _messages(context, history, question)
 
-Be concise, accurate, and cite specific details from the context when possible."""
 
-    messages = [{"role": "system", "content": system_message}]
+def chat_with_contents(
+    question: str,
+    chat_history: list[dict] | None = None,
+    retrieval_indexes: dict[str, dict] | None = None,
+    titles: dict[str, str] | None = None,
+) -> tuple[str, list[dict]]:
+    """
+    Answer user questions using RAG over several contents at once.
+
+    Args:
+        question: User's question.
+        chat_history: Previous conversation turns.
+        retrieval_indexes: {content_id: current stored retrieval index} of every selected content
+                           (content_metadata.load_retrieval_indexes).
+        titles: {content_id: title}, used to label each chunk with its source.
 
-    if chat_history:
-        messages.extend(chat_history[-4:])
+    Returns:
+        (answer, sources) — sources: [{"content_id", "title", "chunk_index", "score"}]
+        for the chunks in the context, best first.
+    """
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY environment variable not set")
+
+    titles = titles or {}
+    history = (chat_history or [])[-CHAT_HISTORY_TURNS:]
+    hits = get_chunks_across_contents(retrieval_indexes or {}, question)
+    if not hits:
+        return "I couldn't find anything about that in the selected contents.", []
+
+    # Only the selected chunks are fetched, never whole texts
+    selection: dict[str, list[int]] = {}
+    for content_id, chunk_index, _ in hits:
+        selection.setdefault(content_id, []).append(chunk_index)
+    texts = get_chunk_texts(selection)
+
+    found = [(hit, texts.get(hit[0], {}).get(hit[1])) for hit in hits]
+    found = [(hit, text) for hit, text in found if text]
+    # Only the sentences relevant to the question are kept, across all sources together
+    compressed = compress_passages([text for _, text in found], "chat_multi", question)
+
+    sources, labeled = [], []
+    for (content_id, chunk_index, score), text in zip((hit for hit, _ in found), compressed):
+        if not text:
+            continue
+        title = titles.get(content_id) or "Untitled"
+        labeled.append(f"[Source: {title}]\n{text}")
+        sources.append({"content_id": content_id, "title": title, "chunk_index": chunk_index, "score": round(score, 4)})
+
+    budget = prompt_budget(
+        CHAT_MODEL,
+        CHAT_MAX_TOKENS,
+        CHAT_SYSTEM_TEMPLATE.format(context=""),
+        question,
+        *(turn.get("content") or "" for turn in history),
+    )
+    packed = pack_texts(labeled, count_tokens_many(labeled), budget)
+    context = packed[0] if packed else ""
+    # Sources that did not fit the budget are not reported as used
+    sources = [source for source, text in zip(sources, labeled) if text[:200] in context]
+
+    return _answer(_messages(context, history, question)), sources
+
+
+def _messages(context: str, history: list[dict], question: str) -> list[dict]:
+    """The retrieved context as system prompt, then the recent history and the question."""
+    system_message = CHAT_SYSTEM_TEMPLATE.format(context=context)
 
+    messages = [{"role": "system", "content": system_message}]
+    messages.extend(history)
     messages.append({"role": "user", "content": question})
+    return messages
+
 
+def _answer(messages: list[dict]) -> str:
+    """One chat completion over the chat messages."""
     try:
-        client = Groq(api_key=api_key)
-        response = client.chat.completions.create(
-            model="llama-3.1-8b-instant",
+        response = chat_completion(
+            model=CHAT_MODEL,
             messages=messages,
             temperature=0.7,
-            max_tokens=400,
+            max_tokens=CHAT_MAX_TOKENS,
         )
         result_text = response.choices[0].message.content
         return result_text.strip() if result_text else "Sorry, I couldn't generate a response. Please try again."
@@ -0,0 +1,91 @@
+"""
+chunk_artifacts.py — Per-chunk artifacts stored once by chunk hash and reused.
+
+Everything derived from a single chunk's text alone (token count, MinHash
+signature, dense and hashed vectors) is a pure function of that text, so it is
+kept in the chunk_cache collection under the chunk's hash and reused whenever
+the same chunk appears again — in a re-upload of an edited file, or in any
+other content of any user. With content-defined chunking (chunker.py,
+CHUNKING_MODE=cdc) an edit only changes the chunks around it, so ingest cost
+for a near-duplicate document is proportional to what changed.
+
+Artifacts are stored as bytes under "<kind>:<version>" keys; a new backend or
+model version simply misses and recomputes.
+"""
+
+from collections.abc import Callable
+
+from app.models.chunk_cache import get_chunk_artifacts, save_chunk_artifacts
+from app.services.chunker import chunk_hash
+
+
+def _artifact_key(kind: str, version: str) -> str:
+    # MongoDB field names may not contain dots.
+    return f"{kind}:{version}".replace(".", "_")
+
+
+class ChunkArtifacts:
+    """
+    Artifact lookups for one content's chunks: one read of chunk_cache up front,
+    one bulk write of whatever had to be computed in save().
+    """
+
+    def __init__(self, chunks: list[str]):
+        self._hash_of = {chunk: chunk_hash(chunk) for chunk in chunks}
+        self._stored = get_chunk_artifacts(list(set(self._hash_of.values())))
+        self._new: dict[str, dict] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def hash(self, chunk: str) -> str:
+        h = self._hash_of.get(chunk)
+        if h is None:
+            h = self._hash_of[chunk] = chunk_hash(chunk)
+        return h
+
+    def get_or_compute(
+        self,
+        kind: str,
+        version: str,
+        chunks: list[str],
+        compute: Callable[[list[str]], list[bytes]],
+    ) -> list[bytes]:
+        """
+        One artifact per chunk, in order. Only chunks with no stored artifact for
+        (kind, version) are passed to compute, in a single batch. Empty results
+        (e.g. no model deployed) are returned but never stored.
+        """
+        key = _artifact_key(kind, version)
+        hashes = [self.hash(chunk) for chunk in chunks]
+        values: list[bytes | None] = []
+        missing: dict[str, list[int]] = {}
+
+        for position, h in enumerate(hashes):
+            stored = self._stored.get(h, {}).get(key)
+            if stored is None:
+                stored = self._new.get(h, {}).get(key)
+            if stored is None:
+                missing.setdefault(h, []).append(position)
+            values.append(stored)
+
+        self.hits += len(hashes) - sum(len(p) for p in missing.values())
+
+        if missing:
+            todo = list(missing)
+            computed = compute([chunks[missing[h][0]] for h in todo])
+            for h, value in zip(todo, computed):
+                value = bytes(value)
+                if value:
+                    self._new.setdefault(h, {})[key] = value
+                    self.misses += 1
+                for position in missing[h]:
+                    values[position] = value
+
+        return values
+
+    def save(self) -> None:
+        """Persist newly computed artifacts and refresh the retention of reused ones."""
+        save_chunk_artifacts(self._new, reused_hashes=list(self._stored))
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses}
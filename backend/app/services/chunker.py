@@ -6,6 +6,12 @@ Design (final — do not revert):
   - All features use the SAME stored chunks. Chunk size never varies per feature.
   - top_k (how many chunks each feature reads) is a CODE concern, not a storage concern.
   - Changing how many chunks quiz reads = one line change here, zero DB migrations.
+  - Retrieval indexes (retrievers.py backends) are also built once at upload and
+    stored per content. Requests only score the query against them, no refitting.
+  - Which backend a feature uses is a CODE concern too: RETRIEVER_CONFIG.
+  - Optional content-defined chunking (CHUNKING_MODE=cdc): boundaries come from
+    the text itself, so an edit only changes nearby chunks and per-chunk work is
+    reused by chunk hash (chunk_artifacts.py). Fixed-size chunking stays the default.
 
 What the previous design did wrong:
   - Used FEATURE_CHUNK_SIZES: different chunk sizes per feature.
@@ -14,29 +20,73 @@ What the previous design did wrong:
     a 400-char chatbot chunk of the same text — you cannot share them.
 """
 
+import hashlib
+import json
+import os
 import re
+from collections.abc import Iterable, Iterator
 
 import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from app.services.retrieval_cache import content_fingerprint, normalize_query, retrieval_cache
+from app.services.retrievers import RETRIEVERS, score_texts
+from app.services.tokens import count_tokens_many, get_tokenizer_name, pack_texts
 
 # ─── CANONICAL STORAGE PARAMETERS ────────────────────────────────────────────
 # Stored once per content document. Never changed without a deliberate decision.
 CHUNK_SIZE = 400     # characters per chunk
 CHUNK_OVERLAP = 50   # overlap between adjacent chunks
+# A "sentence" longer than CHUNK_SIZE (unpunctuated captions, tables) is split at
+# word boundaries first (inside a word when it has no space), so no chunk exceeds
+# CHUNK_SIZE + CHUNK_OVERLAP + 1 chars and every chunk stays small in tokens too.
+
+# Stored in chunk_metadata. Bump it whenever the same text would chunk differently;
+# documents chunked under an older version are re-chunked by worker/backfill.py.
+#   1: oversize sentences kept whole
+#   2: oversize sentences split at word boundaries (_bounded)
+#   3: parts cut inside a word are joined back without a space (chunks stay slices)
+CHUNKING_VERSION = 3
+
+# "fixed" (above) or "cdc": content-defined chunks. A chunk closes at a sentence
+# end once it holds CDC_MIN_SIZE chars and the hash of the last CDC_WINDOW chars
+# has its CDC_BOUNDARY_MASK bits clear (about every other sentence), or before it
+# would pass CDC_MAX_SIZE. No overlap, so a chunk depends only on its own text.
+CHUNKING_MODE = os.getenv("CHUNKING_MODE", "fixed")
+CDC_MIN_SIZE = 200
+CDC_MAX_SIZE = 600
+CDC_WINDOW = 64
+CDC_BOUNDARY_MASK = 0x1
 
 # ─── RUNTIME RETRIEVAL PARAMETERS ────────────────────────────────────────────
 # How many chunks each feature reads from the pre-stored list.
 # Lives in code, not in the database. Change here with zero DB impact.
 TOP_K_CONFIG: dict[str, int] = {
     "chatbot":    3,
+    "chat_multi": 6,   # across all selected contents (get_chunks_across_contents)
     "quiz":       6,
     "flashcards": 4,
     "summary":    8,
     "ppt":        10,
 }
 
-# Semantic hint queries for TF-IDF retrieval. chatbot uses the real user question.
+# Which retrieval backend (see retrievers.RETRIEVERS) each feature reads from.
+# Moving a feature to another engine = one line change here; stored indexes
+# are rebuilt lazily because the index version covers this mapping.
+RETRIEVER_CONFIG: dict[str, str] = {
+    "chatbot":    "dense",
+    "quiz":       "hashed",
+    "flashcards": "hashed",
+    "summary":    "hashed",
+    "ppt":        "hashed",
+}
+
+# Backend to read instead when a content has no section for the configured one
+# (e.g. dense when no LSA model file is deployed).
+RETRIEVER_FALLBACK: dict[str, str] = {
+    "dense": "bm25",
+    "bm25":  "hashed",
+}
+
+# Semantic hint queries for retrieval. chatbot uses the real user question.
 RETRIEVAL_QUERIES: dict[str, str | None] = {
     "chatbot":    None,
     "quiz":       "key concepts definitions facts formulas important topics explained",
@@ -45,74 +95,441 @@ RETRIEVAL_QUERIES: dict[str, str | None] = {
     "ppt":        "main topic section overview key points introduction conclusion chapter",
 }
 
+# ─── RETRIEVAL INDEX PARAMETERS ──────────────────────────────────────────────
+# Every backend in RETRIEVERS builds its section of the index once at upload, and
+# the ranked chunk indices for every feature with a static hint query are stored
+# with it, as are per-chunk token counts (tokens.py). The version covers backend
+# versions, RETRIEVAL_QUERIES, RETRIEVER_CONFIG and the tokenizer, so editing any
+# of them makes stored indexes stale and they get rebuilt lazily on the next request.
+# CHUNKING_VERSION is covered too, so a new one starts a fresh backfill pass.
+RETRIEVAL_INDEX_VERSION = "idx-5-" + hashlib.sha1(
+    json.dumps(
+        [
+            CHUNKING_VERSION,
+            {name: retriever.version for name, retriever in RETRIEVERS.items()},
+            RETRIEVAL_QUERIES,
+            RETRIEVER_CONFIG,
+            get_tokenizer_name(),
+        ],
+        sort_keys=True,
+    ).encode()
+).hexdigest()[:8]
+
+# Chunks scoring at or below this similarity are treated as irrelevant.
+MIN_SIMILARITY = 0.01
+
+# Whitespace after ., ! or ? ends a sentence.
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
 
 # ─── CHUNKING — called ONCE at upload, result stored in MongoDB ───────────────
 
-def compute_chunks(text: str) -> list[str]:
+def compute_chunks(text: str, mode: str | None = None) -> list[str]:
     """
-    Split text into canonical overlapping chunks.
+    Split text into canonical chunks (overlapping fixed-size, or content-defined
+    when CHUNKING_MODE / mode is "cdc").
     Called once at upload. Stored in content['chunks'] in MongoDB.
     Never called again for the same content.
     """
-    sentences = re.split(r'(?<=[.!?])\s+', text)
-    chunks: list[str] = []
-    current = ""
+    if (mode or CHUNKING_MODE) == "cdc":
+        return list(iter_cdc_chunks([text]))
+    return list(iter_chunks([text]))
+
+
+def chunk_hash(chunk: str) -> str:
+    """Stable 128-bit hash of one chunk's text; the key for reusing per-chunk work."""
+    return hashlib.blake2b(chunk.encode("utf-8"), digest_size=16).hexdigest()
+
+
+def iter_sentences(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    Stream sentences out of text pieces (pages, paragraphs, caption snippets).
+
+    Yields exactly what re.split(_SENTENCE_BOUNDARY, "".join(pieces)) would, but
+    only buffers the sentence currently being read, never the whole text.
+    """
+    buffer = ""
+    resume = 0
+    for piece in pieces:
+        if not piece:
+            continue
+        buffer += piece
+        start = 0
+        unfinished = None
+        # The lookbehind still sees the character before `resume`.
+        for match in _SENTENCE_BOUNDARY.finditer(buffer, resume):
+            if match.end() == len(buffer):
+                # The whitespace run may continue in the next piece.
+                unfinished = match.start()
+                break
+            yield buffer[start:match.start()]
+            start = match.end()
+        buffer = buffer[start:]
+        resume = len(buffer) if unfinished is None else unfinished - start
+    yield from _SENTENCE_BOUNDARY.split(buffer)
+
 
+def _bounded(sentences: Iterable[str]) -> Iterator[tuple[str, str]]:
+    """
+    Split sentences longer than CHUNK_SIZE at the last space that keeps each part within it,
+    or at CHUNK_SIZE when there is none. Yields (joiner, part): what goes between the part and
+    the one before it, " " at sentence ends and spaces, "" after a cut inside a word, so parts
+    joined back are still slices of the (whitespace-normalized) text.
+    """
     for sentence in sentences:
-        if len(current) + len(sentence) > CHUNK_SIZE and current:
-            chunks.append(current.strip())
-            current = current[-CHUNK_OVERLAP:].lstrip() + " " + sentence
+        joiner = " "
+        while len(sentence) > CHUNK_SIZE:
+            cut = sentence.rfind(" ", 0, CHUNK_SIZE + 1)
+            if cut <= 0:
+                yield joiner, sentence[:CHUNK_SIZE]
+                sentence, joiner = sentence[CHUNK_SIZE:], ""
+            else:
+                yield joiner, sentence[:cut]
+                sentence, joiner = sentence[cut:].lstrip(" "), " "
+        yield joiner, sentence
+
+
+def iter_chunks(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    Streaming form of compute_chunks: yields the canonical CHUNK_SIZE / CHUNK_OVERLAP
+    chunks of "".join(pieces), byte-identical to compute_chunks on the joined text.
+    Memory stays bounded by the current sentence and chunk, not the full text.
+    """
+    head: list[str] = []
+    head_len = 0
+
+    def _record_head(source: Iterable[str]) -> Iterator[str]:
+        nonlocal head_len
+        for piece in source:
+            if head_len < CHUNK_SIZE:
+                head.append(piece[:CHUNK_SIZE - head_len])
+                head_len += len(head[-1])
+            yield piece
+
+    parts: list[str] = []
+    length = 0
+    produced = False
+
+    for joiner, sentence in _bounded(iter_sentences(_record_head(pieces))):
+        if length + len(sentence) > CHUNK_SIZE and length:
+            current = "".join(parts)
+            yield current.strip()
+            produced = True
+            current = current[-CHUNK_OVERLAP:].lstrip() + joiner + sentence
+            parts, length = [current], len(current)
+        elif length:
+            parts += (joiner, sentence)
+            length += len(joiner) + len(sentence)
         else:
-            current += (" " + sentence) if current else sentence
+            parts, length = [sentence], len(sentence)
+
+    current = "".join(parts).strip()
+    if current:
+        yield current
+        produced = True
+
+    if not produced:
+        yield "".join(head)
+
+
+def _is_cdc_boundary(sentence: str) -> bool:
+    window = sentence[-CDC_WINDOW:].encode("utf-8")
+    digest = int.from_bytes(hashlib.blake2b(window, digest_size=8).digest(), "little")
+    return digest & CDC_BOUNDARY_MASK == 0
+
+
+def iter_cdc_chunks(pieces: Iterable[str]) -> Iterator[str]:
+    """
+    Content-defined chunks of "".join(pieces), aligned to sentences.
 
-    if current.strip():
-        chunks.append(current.strip())
+    Whether a sentence end is a boundary depends only on the last CDC_WINDOW
+    chars before it and the length of the current chunk, so after an edit the
+    boundaries fall back into step within a chunk or two and every later chunk
+    (and its chunk_hash) is unchanged.
+    """
+    parts: list[str] = []
+    length = 0
+    produced = False
+
+    for joiner, sentence in _bounded(iter_sentences(pieces)):
+        sentence = sentence.strip()
+        if not sentence:
+            continue
+        if length and length + len(joiner) + len(sentence) > CDC_MAX_SIZE:
+            yield "".join(parts)
+            produced = True
+            parts, length = [], 0
+        if parts:
+            parts.append(joiner)
+            length += len(joiner)
+        parts.append(sentence)
+        length += len(sentence)
+        if length >= CDC_MIN_SIZE and _is_cdc_boundary(sentence):
+            yield "".join(parts)
+            produced = True
+            parts, length = [], 0
+
+    if parts:
+        yield "".join(parts)
+    elif not produced:
+        yield ""
+
+
+def get_chunk_metadata(
+    chunks: list[str],
+    original_text: str,
+    original_to_kept: list[int] | None = None,
+    token_counts: list[int] | None = None,
+) -> dict:
+    """
+    Metadata stored alongside chunks for debugging and monitoring.
+
+    original_to_kept is the near-duplicate mapping from near_duplicates.py:
+    entry i is the stored chunk that stands for the i-th chunk of the text. It is
+    stored only when duplicates were removed (otherwise it is the identity), packed
+    as int32 bytes; read it back with get_original_to_kept.
+    token_counts are the per-chunk counts from the retrieval index (tokens.py).
+    """
+    cdc = CHUNKING_MODE == "cdc"
+    metadata = {
+        "mode":         "cdc" if cdc else "fixed",
+        "chunking":     CHUNKING_VERSION,
+        "count":        len(chunks),
+        "chunk_size":   CDC_MAX_SIZE if cdc else CHUNK_SIZE,
+        "overlap":      0 if cdc else CHUNK_OVERLAP,
+        "total_chars":  len(original_text),
+        "content_hash": content_fingerprint(chunks),
+    }
+    if original_to_kept is not None:
+        metadata["original_count"] = len(original_to_kept)
+        metadata["duplicates_removed"] = len(original_to_kept) - len(chunks)
+        if metadata["duplicates_removed"]:
+            metadata["original_to_kept"] = np.asarray(original_to_kept, dtype=np.int32).tobytes()
+    if token_counts is not None:
+        metadata["tokenizer"] = get_tokenizer_name()
+        metadata["total_tokens"] = int(sum(token_counts))
+        metadata["max_chunk_tokens"] = int(max(token_counts, default=0))
+    return metadata
 
-    return chunks if chunks else [text[:CHUNK_SIZE]]
 
+def is_chunking_current(metadata: dict | None) -> bool:
+    """True if stored chunks were cut by the current chunker (see CHUNKING_VERSION)."""
+    return bool(metadata) and metadata.get("chunking", 1) == CHUNKING_VERSION
+
+
+def get_original_to_kept(metadata: dict) -> np.ndarray:
+    """
+    The near-duplicate mapping of stored chunk metadata (see get_chunk_metadata):
+    the identity when nothing was removed; older documents store a plain list.
+    """
+    stored = metadata.get("original_to_kept")
+    if stored is None:
+        return np.arange(metadata.get("original_count", metadata.get("count", 0)), dtype=np.int32)
+    if isinstance(stored, bytes):
+        return np.frombuffer(stored, dtype=np.int32)
+    return np.asarray(stored, dtype=np.int32)
+
+
+# ─── RETRIEVAL INDEX — built ONCE at upload, stored alongside the content ─────
+
+def build_retrieval_index(chunks: list[str], artifacts=None) -> dict | None:
+    """
+    Build every registered backend's index section over the stored chunks.
+    Also ranks the chunks once for every static RETRIEVAL_QUERIES hint with that
+    feature's configured backend, so quiz / flashcards / summary / ppt requests
+    only slice a stored list.
+
+    artifacts: optional chunk_artifacts.ChunkArtifacts. Per-chunk rows (dense and
+    hashed vectors, token counts) are then read by chunk hash where already known
+    and only computed for new chunks.
+
+    Returns None when no backend could index the chunks (e.g. only stop words).
+    """
+    if not chunks:
+        return None
+
+    sections = {}
+    for name, retriever in RETRIEVERS.items():
+        if artifacts is not None and hasattr(retriever, "encode_chunks"):
+            rows = artifacts.get_or_compute(name, retriever.version, chunks, retriever.encode_chunks)
+            section = retriever.build_from_rows(rows)
+        else:
+            section = retriever.build(chunks)
+        if section:
+            sections[name] = section
+    if not sections:
+        return None
+
+    rankings: dict[str, bytes] = {}
+    for feature, query in RETRIEVAL_QUERIES.items():
+        if not query:
+            continue
+        backend = RETRIEVER_CONFIG.get(feature, "hashed")
+        while backend and backend not in sections:
+            backend = RETRIEVER_FALLBACK.get(backend)
+        if backend:
+            scores = RETRIEVERS[backend].score(sections[backend], [query])[0]
+            rankings[feature] = _rank_by_similarity(scores).astype(np.int32).tobytes()
+
+    if artifacts is not None:
+        token_rows = artifacts.get_or_compute(
+            "tokens",
+            get_tokenizer_name(),
+            chunks,
+            lambda missing: [np.int32(n).tobytes() for n in count_tokens_many(missing)],
+        )
+        token_counts = b"".join(token_rows)
+    else:
+        token_counts = np.array(count_tokens_many(chunks), dtype=np.int32).tobytes()
 
-def get_chunk_metadata(chunks: list[str], original_text: str) -> dict:
-    """Metadata stored alongside chunks for debugging and monitoring."""
     return {
-        "count":       len(chunks),
-        "chunk_size":  CHUNK_SIZE,
-        "overlap":     CHUNK_OVERLAP,
-        "total_chars": len(original_text),
+        "version":      RETRIEVAL_INDEX_VERSION,
+        "chunk_count":  len(chunks),
+        "content_hash": content_fingerprint(chunks),
+        **sections,
+        "rankings":     rankings,
+        "token_counts": token_counts,
+        "chunk_hashes": b"".join(bytes.fromhex(chunk_hash(chunk)) for chunk in chunks),
     }
 
 
+def _rank_by_similarity(similarities: np.ndarray) -> np.ndarray:
+    """Indices of relevant chunks (similarity > MIN_SIMILARITY), best first."""
+    order = np.argsort(-similarities, kind="stable")
+    return order[similarities[order] > MIN_SIMILARITY]
+
+
+def get_stored_ranking(index: dict | None, feature: str, chunk_count: int) -> np.ndarray | None:
+    """Precomputed ranked chunk indices for a static feature, or None if unavailable."""
+    if not is_index_current(index, chunk_count):
+        return None
+    ranking = index.get("rankings", {}).get(feature)
+    if ranking is None:
+        return None
+    return np.frombuffer(ranking, dtype=np.int32)
+
+
+def get_token_counts(index: dict | None, chunks: list[str]) -> np.ndarray:
+    """Per-chunk token counts stored in a current index; counted now only if unavailable."""
+    if is_index_current(index, len(chunks)) and index.get("token_counts"):
+        return np.frombuffer(index["token_counts"], dtype=np.int32)
+    return np.array(count_tokens_many(chunks), dtype=np.int32)
+
+
+def is_index_current(index: dict | None, chunk_count: int) -> bool:
+    """True if a stored index was built with the current parameters for these chunks."""
+    return bool(
+        index
+        and index.get("version") == RETRIEVAL_INDEX_VERSION
+        and index.get("chunk_count") == chunk_count
+    )
+
+
+def _score_stored(index: dict | None, backend: str, queries: list[str], chunk_count: int) -> np.ndarray | None:
+    """
+    Score queries against a stored backend section (no fit), following RETRIEVER_FALLBACK
+    when that section is missing. None if no usable section exists.
+    """
+    if not is_index_current(index, chunk_count):
+        return None
+    while backend:
+        section = index.get(backend)
+        if section and backend in RETRIEVERS:
+            return RETRIEVERS[backend].score(section, queries)
+        backend = RETRIEVER_FALLBACK.get(backend)
+    return None
+
+
 # ─── RETRIEVAL — called at runtime for every feature request ─────────────────
 
-def retrieve_top_k(chunks: list[str], query: str, top_k: int) -> list[str]:
+def retrieve_top_k(
+    chunks: list[str],
+    query: str,
+    top_k: int,
+    index: dict | None = None,
+    backend: str = "hashed",
+) -> list[str]:
     """
-    Retrieve the top_k most relevant pre-stored chunks using TF-IDF cosine similarity.
+    Retrieve the top_k most relevant pre-stored chunks.
 
     Args:
-        chunks: Pre-stored canonical chunks loaded from MongoDB content document.
-        query:  Search query — user's question (chatbot) or a semantic hint (other features).
-        top_k:  Number of chunks to return.
+        chunks:  Pre-stored canonical chunks loaded from MongoDB content document.
+        query:   Search query — user's question (chatbot) or a semantic hint (other features).
+        top_k:   Number of chunks to return.
+        index:   Stored retrieval index for these chunks. When current, the query is only
+                 scored against the backend's section; otherwise chunks are hashed on the
+                 fly and IDF-weighted with the global statistics (legacy path, no fit).
+        backend: Name of the retrieval backend in retrievers.RETRIEVERS.
     """
-    if not chunks:
-        return []
+    return [chunks[i] for i in _top_k_indices(chunks, query, top_k, index, backend)]
 
-    if not query or len(chunks) <= top_k:
-        return chunks[:top_k]
 
-    try:
-        vectorizer = TfidfVectorizer(
-            stop_words='english',
-            ngram_range=(1, 2),
-            max_features=5000,
-            sublinear_tf=True,
-        )
-        tfidf_matrix = vectorizer.fit_transform([query] + chunks)
-    except ValueError:
-        return chunks[:top_k]
+def _top_k_indices(
+    chunks: list[str],
+    query: str,
+    top_k: int,
+    index: dict | None,
+    backend: str,
+    chunk_range: tuple[int, int] | None = None,
+) -> list[int]:
+    """retrieve_top_k, returning positions in `chunks` instead of the chunk texts."""
+    lo, hi = chunk_range or (0, len(chunks))
+    fallback = list(range(lo, min(lo + top_k, hi)))
+    if not query or hi - lo <= top_k:
+        return fallback
+
+    stored = _score_stored(index, backend, [query], len(chunks))
+    if stored is not None:
+        similarities = stored[0][lo:hi]
+    else:
+        similarities = score_texts([chunks[i] for i in range(lo, hi)], [query])[0]
 
-    similarities = cosine_similarity(tfidf_matrix[0:1], tfidf_matrix[1:]).flatten()
     top_indices  = np.argsort(similarities)[-top_k:][::-1]
-    results      = [chunks[i] for i in top_indices if similarities[i] > 0.01]
-    return results if results else chunks[:top_k]
+    results      = [lo + int(i) for i in top_indices if similarities[i] > MIN_SIMILARITY]
+    return results if results else fallback
+
+
+def retrieve_top_k_many(
+    chunks: list[str],
+    queries: list[str],
+    top_k: int,
+    index: dict | None = None,
+    backend: str = "hashed",
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Score many queries against one content's chunks in a single matrix operation.
+
+    Args:
+        chunks:  Pre-stored canonical chunks loaded from MongoDB content document.
+        queries: Search queries, e.g. one per quiz question or study-pack topic.
+        top_k:   Number of chunks to return per query.
+        index:   Stored retrieval index for these chunks. Without a current index,
+                 the chunks are hashed once and shared by all queries.
+        backend: Name of the retrieval backend in retrievers.RETRIEVERS.
+
+    Returns:
+        (indices, scores) — both shaped (len(queries), min(top_k, len(chunks))),
+        best first per row. Indices point into `chunks`, so callers can dedupe
+        across queries; scores let them drop weak hits (<= MIN_SIMILARITY).
+    """
+    k = min(top_k, len(chunks))
+    if not queries or k <= 0:
+        empty = np.empty((len(queries), 0))
+        return empty.astype(np.int64), empty.astype(np.float32)
+
+    scores = _score_stored(index, backend, queries, len(chunks))
+    if scores is None:
+        scores = score_texts(list(chunks), queries)
+
+    if k < len(chunks):
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.tile(np.arange(len(chunks)), (len(queries), 1))
+
+    candidate_scores = np.take_along_axis(scores, candidates, axis=1)
+    order = np.argsort(-candidate_scores, axis=1, kind="stable")
+    indices = np.take_along_axis(candidates, order, axis=1)
+    return indices, np.take_along_axis(candidate_scores, order, axis=1)
 
 
 # ─── UNIFIED ENTRY POINT ─────────────────────────────────────────────────────
@@ -121,6 +538,8 @@ def get_chunks_for_feature(
     stored_chunks: list[str],
     feature: str,
     user_query: str | None = None,
+    index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
 ) -> list[str]:
     """
     Single entry point for all features to get relevant chunks.
@@ -130,10 +549,193 @@ def get_chunks_for_feature(
                        NOTE: This is a List[str], NOT a raw text string.
         feature:       One of: chatbot | quiz | flashcards | summary | ppt
         user_query:    Only for chatbot — the user's actual question.
+        index:         Stored retrieval index for stored_chunks, if available.
+                       Static features read their precomputed ranking from it and
+                       do no vectorization work at all; chatbot scores the question
+                       with the backend set in RETRIEVER_CONFIG.
+        chunk_range:   [start, end) of stored_chunks to choose from, e.g. one
+                       section (sections.py); None for the whole content.
+
+    Scored results are cached (retrieval_cache.py) per content fingerprint,
+    normalized query and top_k, so repeated questions skip scoring entirely.
+    """
+    indices = get_chunk_indices_for_feature(stored_chunks, feature, user_query, index, chunk_range)
+    return [stored_chunks[i] for i in indices]
+
+
+def _clamp_range(chunk_range: tuple[int, int] | None, chunk_count: int) -> tuple[int, int]:
+    """[start, end) of chunk_range within the stored chunks; empty when it lies past them (stale section)."""
+    lo, hi = chunk_range or (0, chunk_count)
+    return max(0, lo), max(0, min(hi, chunk_count))
+
+
+def get_chunk_indices_for_feature(
+    stored_chunks: list[str],
+    feature: str,
+    user_query: str | None = None,
+    index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
+    top_k: int | None = None,
+) -> list[int]:
+    """
+    get_chunks_for_feature, returning positions in stored_chunks, best first.
+    top_k overrides TOP_K_CONFIG (e.g. to rank every chunk).
     """
-    top_k = TOP_K_CONFIG.get(feature, 5)
+    top_k = top_k or TOP_K_CONFIG.get(feature, 5)
+    lo, hi = _clamp_range(chunk_range, len(stored_chunks))
+    if chunk_range is not None:
+        chunk_range = (lo, hi)
+    first = list(range(lo, min(lo + top_k, hi)))
+
+    if feature != "chatbot" and hi - lo > top_k:
+        ranking = get_stored_ranking(index, feature, len(stored_chunks))
+        if ranking is not None:
+            if chunk_range is not None:
+                ranking = ranking[(ranking >= lo) & (ranking < hi)]
+            selected = [int(i) for i in ranking[:top_k]]
+            return selected if selected else first
+
     query = user_query if feature == "chatbot" else RETRIEVAL_QUERIES.get(feature, "")
-    return retrieve_top_k(stored_chunks, query, top_k)
+    backend = RETRIEVER_CONFIG.get(feature, "hashed")
+    if not query or hi - lo <= top_k:
+        return first
+
+    if is_index_current(index, len(stored_chunks)) and index.get("content_hash"):
+        fingerprint, mode = index["content_hash"], backend
+    else:
+        # Legacy path: results come from hashing the chunks on the fly, not the stored backend.
+        fingerprint, mode = content_fingerprint(stored_chunks), "legacy"
+
+    key = (fingerprint, feature, mode, normalize_query(query), top_k, chunk_range)
+    indices = retrieval_cache.get(key)
+    if indices is None:
+        indices = _top_k_indices(stored_chunks, query, top_k, index, backend, chunk_range)
+        retrieval_cache.put(key, indices)
+    return indices
+
+
+def get_packed_chunks_for_feature(
+    stored_chunks: list[str],
+    feature: str,
+    budget: int,
+    user_query: str | None = None,
+    index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
+) -> list[str]:
+    """
+    The chunks get_chunks_for_feature selects, packed (tokens.pack_texts) into as
+    few prompt-sized texts of at most `budget` tokens as possible, best chunks first.
+    Token counts come from the stored index, so nothing is re-tokenized.
+    """
+    indices = get_chunk_indices_for_feature(stored_chunks, feature, user_query, index, chunk_range)
+    token_counts = get_token_counts(index, stored_chunks)
+    return pack_texts(
+        [stored_chunks[i] for i in indices],
+        [int(token_counts[i]) for i in indices],
+        budget,
+    )
+
+
+def get_document_chunk_groups(
+    stored_chunks: list[str],
+    feature: str,
+    budget: int,
+    max_groups: int,
+    index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
+) -> list[str]:
+    """
+    All chunks of a content (or of chunk_range) in document order, packed into at most
+    max_groups texts of at most `budget` tokens each — for features that cover the
+    whole document (map-reduce summary).
+
+    When the chunks do not all fit, the feature's best-ranked chunks that do fit are
+    kept, still in document order, so coverage thins out evenly instead of the end
+    of the document being cut off.
+    """
+    lo, hi = _clamp_range(chunk_range, len(stored_chunks))
+    if chunk_range is not None:
+        chunk_range = (lo, hi)
+    token_counts = get_token_counts(index, stored_chunks)
+    indices = list(range(lo, hi))
+    ranking: list[int] | None = None
+    capacity = max_groups * budget
+
+    while True:
+        groups = pack_texts(
+            [stored_chunks[i] for i in indices],
+            [int(token_counts[i]) for i in indices],
+            budget,
+        )
+        if len(groups) <= max_groups:
+            return groups
+        if ranking is None:
+            ranking = get_chunk_indices_for_feature(stored_chunks, feature, None, index, chunk_range, top_k=hi - lo)
+        # Groups are never perfectly full: shrink the capacity until the packing fits.
+        capacity = int(min(capacity, int(token_counts[indices].sum())) * 0.9)
+        cumulative = np.cumsum([int(token_counts[i]) for i in ranking])
+        indices = sorted(ranking[:max(1, int(np.searchsorted(cumulative, capacity, side="right")))])
+
+
+# ─── MULTI-CONTENT RETRIEVAL ─────────────────────────────────────────────────
+
+def retriever_sections(feature: str) -> list[str]:
+    """Index sections a feature's backend may read, in RETRIEVER_FALLBACK order."""
+    sections = []
+    backend = RETRIEVER_CONFIG.get(feature, "hashed")
+    while backend:
+        sections.append(backend)
+        backend = RETRIEVER_FALLBACK.get(backend)
+    return sections
+
+
+def get_chunks_across_contents(
+    indexes: dict[str, dict],
+    query: str,
+    feature: str = "chatbot",
+    top_k: int | None = None,
+) -> list[tuple[str, int, float]]:
+    """
+    Rank the chunks of several contents against one query and merge them.
+
+    Each content is scored against its own stored index (backend per RETRIEVER_CONFIG
+    for `feature`, so contents indexed with different fallbacks still mix). Scores are
+    normalized per content (z-score over that content's chunks) before merging, so one
+    backend's or one document's score scale does not crowd out the others; chunks at or
+    below MIN_SIMILARITY are dropped first.
+
+    Args:
+        indexes: {content_id: current stored retrieval index}. Only the sections in
+                 retriever_sections(feature) are read.
+        query:   The user's question.
+        feature: Feature whose backend is used.
+        top_k:   Chunks to return in total (default TOP_K_CONFIG["chat_multi"]).
+
+    Returns:
+        [(content_id, chunk_index, normalized_score), ...] best first.
+    """
+    top_k = top_k or TOP_K_CONFIG["chat_multi"]
+    backend = RETRIEVER_CONFIG.get(feature, "hashed")
+    candidates: list[tuple[float, str, int]] = []
+
+    for content_id, index in indexes.items():
+        chunk_count = (index or {}).get("chunk_count") or 0
+        scores = _score_stored(index, backend, [query], chunk_count)
+        if scores is None:
+            continue
+        scores = scores[0]
+        spread = float(scores.std())
+        normalized = (scores - scores.mean()) / spread if spread > 0 else np.zeros_like(scores)
+
+        # A content can contribute at most top_k chunks; only those are merged.
+        k = min(top_k, chunk_count)
+        best = np.argpartition(-scores, k - 1)[:k] if k < chunk_count else np.arange(chunk_count)
+        candidates.extend(
+            (float(normalized[i]), content_id, int(i)) for i in best if scores[i] > MIN_SIMILARITY
+        )
+
+    candidates.sort(key=lambda candidate: -candidate[0])
+    return [(content_id, i, score) for score, content_id, i in candidates[:top_k]]
 
 
 # ─── LEGACY HELPER — kept only for content_metadata.py ──────────────────────
@@ -9,8 +9,32 @@ The _get_youtube_title helper is defined here directly.
 """
 
 
+import numpy as np
 import requests
-from app.services.chunker import compute_chunks, get_chunk_metadata
+from app.models.content import (
+    get_content_by_id,
+    get_content_chunks,
+    get_retrieval_index,
+    get_retrieval_index_sections,
+    mark_chunk_offsets_unavailable,
+    pack_chunk_offsets,
+    replace_retrieval_index,
+    update_content_chunks,
+)
+from app.services.chunk_artifacts import ChunkArtifacts
+from app.services.chunker import (
+    CHUNKING_MODE,
+    build_retrieval_index,
+    compute_chunks,
+    get_chunk_metadata,
+    get_token_counts,
+    is_chunking_current,
+    is_index_current,
+)
+from app.services.library_search import remove_from_library
+from app.services.near_duplicates import MINHASH_VERSION, collapse_near_duplicates, minhash_signature
+from app.services.retrieval_cache import retrieval_cache
+from app.services.sections import build_sections, get_stored_headings
 
 
 def _get_youtube_title(youtube_url: str) -> str:
@@ -47,14 +71,147 @@ def build_content_title(
     return f"{input_type.capitalize()} Content"
 
 
-def build_content_chunk_data(normalized_text: str) -> tuple[list[str], dict]:
+def build_content_chunk_data(
+    normalized_text: str,
+    headings: list[dict] | None = None,
+) -> tuple[list[str], dict, dict | None]:
     """
-    Compute canonical chunks and metadata for a piece of normalized text.
+    Compute canonical chunks, metadata and the retrieval index for a piece of normalized text.
+    Near-duplicate chunks are collapsed first (near_duplicates.py); the mapping
+    is kept in the metadata, as is the section index (sections.py) built from
+    `headings` (PDF outline / Word headings) or, without them, from topic shifts.
     Called once at upload/processing time. Result stored in MongoDB.
 
     Returns:
-        (chunks, chunk_metadata) — both stored in the content document.
+        (chunks, chunk_metadata, retrieval_index) — chunks and metadata go in the
+        content document, the index in the retrieval_indexes collection.
     """
     chunks = compute_chunks(normalized_text)
-    metadata = get_chunk_metadata(chunks, normalized_text)
-    return chunks, metadata
+
+    # Content-defined chunks recur across re-uploads and users: reuse their per-chunk work.
+    artifacts = ChunkArtifacts(chunks) if CHUNKING_MODE == "cdc" else None
+    signatures = None
+    if artifacts is not None:
+        signatures = [
+            np.frombuffer(row, dtype=np.uint64)
+            for row in artifacts.get_or_compute(
+                "minhash",
+                MINHASH_VERSION,
+                chunks,
+                lambda missing: [minhash_signature(chunk).tobytes() for chunk in missing],
+            )
+        ]
+
+    chunks, original_to_kept = collapse_near_duplicates(chunks, signatures)
+    retrieval_index = build_retrieval_index(chunks, artifacts)
+    if artifacts is not None:
+        artifacts.save()
+    token_counts = get_token_counts(retrieval_index, chunks).tolist()
+    metadata = get_chunk_metadata(chunks, normalized_text, original_to_kept, token_counts)
+    sections, source = build_sections(normalized_text, chunks, headings, retrieval_index)
+    if sections:
+        metadata["sections"] = sections
+        metadata["sections_source"] = source
+    return chunks, metadata, retrieval_index
+
+
+def load_retrieval_index(content: dict) -> dict | None:
+    """
+    Return the stored retrieval index for a content document.
+    Missing or stale indexes (older version, different chunk count) are rebuilt
+    from the stored chunks and saved, so each content pays the fit cost once.
+    """
+    chunks = get_content_chunks(content)
+    if not chunks:
+        return None
+
+    content_id = str(content["_id"])
+    index = get_retrieval_index(content_id)
+    if is_index_current(index, len(chunks)):
+        return index
+
+    # The content may have been re-chunked; results cached for the old chunks are dead.
+    if index and index.get("content_hash"):
+        retrieval_cache.invalidate(index["content_hash"])
+    remove_from_library(content.get("user_id"), content_id)
+
+    index = build_retrieval_index(chunks)
+    if index:
+        replace_retrieval_index(content_id, index, content.get("user_id"))
+    return index
+
+
+def load_retrieval_indexes(contents: dict[str, dict], *sections: str) -> dict[str, dict]:
+    """
+    load_retrieval_index for several contents in one query, transferring only `sections`
+    of each index. contents need only "chunk_metadata.count"; a content whose index is
+    missing or stale is loaded in full once and its index rebuilt.
+    """
+    stored = get_retrieval_index_sections(list(contents), *sections)
+    indexes = {}
+    for content_id, content in contents.items():
+        index = stored.get(content_id)
+        if not is_index_current(index, (content.get("chunk_metadata") or {}).get("count", -1)):
+            full = get_content_by_id(content_id)
+            index = load_retrieval_index(ensure_content_chunks(full)) if full else None
+        if index:
+            indexes[content_id] = index
+    return indexes
+
+
+def backfill_content(content: dict) -> list[str]:
+    """
+    Bring one stored content document up to the current layout, in place and in MongoDB:
+      - no chunks, no chunk_metadata, or chunks cut by an older chunker (CHUNKING_VERSION):
+        re-chunk normalized_text (chunks, metadata, index), keeping heading sections,
+      - chunks stored as strings: store them as offsets when they are slices of the text,
+      - missing or stale retrieval index: rebuild it.
+    Used by worker/backfill.py, and by ensure_content_chunks for documents it has not reached yet.
+
+    Returns:
+        What was backfilled ("chunks", "chunk_offsets", "retrieval_index"); empty if nothing.
+    """
+    content_id = str(content["_id"])
+    text = content.get("normalized_text") or ""
+    chunks = get_content_chunks(content)
+    done: list[str] = []
+
+    if not chunks or not content.get("chunk_metadata") or (
+        text.strip() and not is_chunking_current(content["chunk_metadata"])
+    ):
+        if not text.strip():
+            return done
+        old_index = get_retrieval_index(content_id)
+        if old_index and old_index.get("content_hash"):
+            retrieval_cache.invalidate(old_index["content_hash"])
+        remove_from_library(content.get("user_id"), content_id)
+
+        headings = get_stored_headings(content.get("chunk_metadata"))
+        chunks, metadata, index = build_content_chunk_data(text, headings)
+        content.update(update_content_chunks(content_id, text, chunks, metadata))
+        replace_retrieval_index(content_id, index, content.get("user_id"))
+        return ["chunks", "retrieval_index"]
+
+    if content.get("chunk_offsets") is None and not content["chunk_metadata"].get("offsets_unavailable"):
+        if pack_chunk_offsets(text, list(chunks)) is not None:
+            content.update(update_content_chunks(content_id, text, list(chunks), content["chunk_metadata"]))
+            done.append("chunk_offsets")
+        else:
+            # Not slices of the text: keep the strings, and never try again
+            mark_chunk_offsets_unavailable(content_id)
+            content["chunk_metadata"]["offsets_unavailable"] = True
+
+    if not is_index_current(get_retrieval_index(content_id), len(chunks)):
+        load_retrieval_index(content)
+        done.append("retrieval_index")
+    return done
+
+
+def ensure_content_chunks(content: dict) -> dict:
+    """
+    The content document with stored chunks, backfilling them once if it predates
+    stored chunks. Requests never re-chunk normalized_text per call.
+    """
+    if not get_content_chunks(content) or not content.get("chunk_metadata"):
+        backfill_content(content)
+    return content
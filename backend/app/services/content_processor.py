@@ -1,7 +1,7 @@
 import asyncio
 import os
 import re
-from collections.abc import Awaitable, Callable
+from collections.abc import Awaitable, Callable, Iterable, Iterator
 from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
@@ -157,10 +157,8 @@ async def normalize_youtube(youtube_url: str, progress_callback: Callable[[str,
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"YouTube processing failed: {e!s}")
 
-async def normalize_pdf(file: UploadFile, progress_callback: Callable[[str, str, int], Awaitable[None]] | None = None) -> str:
+async def normalize_pdf(file: UploadFile, progress_callback: Callable[[str, str, int], Awaitable[None]] | None = None) -> tuple[str, list[dict]]:
     try:
-        from pypdf import PdfReader
-
         temp_dir = Path("temp")
         temp_dir.mkdir(exist_ok=True)
 
@@ -178,37 +176,26 @@ async def normalize_pdf(file: UploadFile, progress_callback: Callable[[str, str,
         if progress_callback:
             await progress_callback("extract", "Extracting text from PDF...", 40)
 
-        def extract_pdf_text():
-            text = ""
-            pdf_reader = PdfReader(file_path)
-            for page in pdf_reader.pages:
-                extracted = page.extract_text()
-                if extracted:
-                    text += extracted + "\n"
-            return text
-
-        text = await run_blocking(extract_pdf_text)
+        text, headings = await run_blocking(extract_pdf_text, file_path)
 
         # Cleanup
         if os.path.exists(file_path):
             await run_blocking(os.remove, file_path)
 
-        if not text.strip():
+        if not text:
             raise HTTPException(status_code=400, detail="No readable text found in PDF. It may be scanned or image-based.")
 
         if progress_callback:
             await progress_callback("finalize", "Finalizing content...", 90)
 
-        return clean_text(text)
+        return text, headings
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"PDF processing failed: {e!s}")
 
-async def normalize_word(file: UploadFile, progress_callback: Callable[[str, str, int], Awaitable[None]] | None = None) -> str:
+async def normalize_word(file: UploadFile, progress_callback: Callable[[str, str, int], Awaitable[None]] | None = None) -> tuple[str, list[dict]]:
     try:
-        from docx import Document
-
         temp_dir = Path("temp")
         temp_dir.mkdir(exist_ok=True)
 
@@ -226,33 +213,19 @@ async def normalize_word(file: UploadFile, progress_callback: Callable[[str, str
         if progress_callback:
             await progress_callback("extract", "Extracting text from document...", 40)
 
-        def extract_word_text():
-            text = ""
-            doc = Document(file_path)
-            for paragraph in doc.paragraphs:
-                if paragraph.text.strip():
-                    text += paragraph.text + "\n"
-            for table in doc.tables:
-                for row in table.rows:
-                    for cell in row.cells:
-                        if cell.text.strip():
-                            text += cell.text + " "
-                    text += "\n"
-            return text
-
-        text = await run_blocking(extract_word_text)
+        text, headings = await run_blocking(extract_word_text, file_path)
 
         # Cleanup
         if os.path.exists(file_path):
             await run_blocking(os.remove, file_path)
 
-        if not text.strip():
+        if not text:
             raise HTTPException(status_code=400, detail="No readable text found in Word document.")
 
         if progress_callback:
             await progress_callback("finalize", "Finalizing content...", 90)
 
-        return clean_text(text)
+        return text, headings
     except HTTPException:
         raise
     except Exception as e:
@@ -266,11 +239,127 @@ def clean_text(text: str) -> str:
     text = text.strip()
     return text
 
+def iter_clean_text(pieces: Iterable[str]) -> Iterator[str]:
+    """Streaming clean_text: collapses whitespace across piece boundaries without joining the raw text first."""
+    emitted = False
+    pending_space = False
+    for piece in pieces:
+        collapsed = re.sub(r'\s+', ' ', piece)
+        core = collapsed.strip()
+        if not core:
+            pending_space = pending_space or bool(collapsed)
+            continue
+        if emitted and (pending_space or collapsed[0] == ' '):
+            yield ' '
+        yield core
+        emitted = True
+        pending_space = collapsed[-1] == ' '
+
+def clean_text_with_headings(pieces: Iterable[str | dict]) -> tuple[str, list[dict]]:
+    """
+    clean_text over text pieces interleaved with heading markers ({"title", "level", "source"}).
+    Each marker is returned with the char_start, in the cleaned text, of the text after it.
+    """
+    headings: list[dict] = []
+    cleaned: list[str] = []
+    length = 0
+
+    def text_pieces() -> Iterator[str]:
+        # iter_clean_text is lazy: every earlier piece has been emitted when a marker is reached.
+        for piece in pieces:
+            if isinstance(piece, dict):
+                headings.append({**piece, "char_start": length})
+            else:
+                yield piece
+
+    for part in iter_clean_text(text_pieces()):
+        cleaned.append(part)
+        length += len(part)
+
+    text = "".join(cleaned)
+    for heading in headings:
+        # The separating space is emitted after the marker; point at the text itself.
+        if text[heading["char_start"]:heading["char_start"] + 1] == " ":
+            heading["char_start"] += 1
+    return text, headings
+
+def _pdf_outline_by_page(reader) -> dict[int, list[dict]]:
+    """PDF outline (bookmarks) entries grouped by the page they point to."""
+    by_page: dict[int, list[dict]] = {}
+
+    def walk(items, level: int):
+        for item in items:
+            if isinstance(item, list):
+                walk(item, level + 1)
+                continue
+            try:
+                page = reader.get_destination_page_number(item)
+            except Exception:
+                continue
+            title = clean_text(str(item.title or ""))
+            if page is not None and page >= 0 and title:
+                by_page.setdefault(page, []).append({"title": title, "level": level, "source": "outline"})
+
+    try:
+        walk(reader.outline, 1)
+    except Exception:
+        return {}
+    return by_page
+
+def extract_pdf_text(file_path) -> tuple[str, list[dict]]:
+    """Cleaned text of a PDF and its outline entries as headings (at the start of their page)."""
+    from pypdf import PdfReader
+
+    reader = PdfReader(file_path)
+    outline = _pdf_outline_by_page(reader)
+
+    def iter_pdf_pieces():
+        for page_number, page in enumerate(reader.pages):
+            yield from outline.get(page_number, [])
+            extracted = page.extract_text()
+            if extracted:
+                yield extracted
+                yield "\n"
+
+    return clean_text_with_headings(iter_pdf_pieces())
+
+def _docx_heading_level(paragraph) -> int | None:
+    """0 for "Title", n for "Heading n"; None for body paragraphs."""
+    name = (paragraph.style.name if paragraph.style is not None else "") or ""
+    if name == "Title":
+        return 0
+    match = re.fullmatch(r"Heading (\d)", name)
+    return int(match.group(1)) if match else None
+
+def extract_word_text(file_path) -> tuple[str, list[dict]]:
+    """Cleaned text of a Word document and its heading-styled paragraphs as headings."""
+    from docx import Document
+
+    doc = Document(file_path)
+
+    def iter_word_pieces():
+        for paragraph in doc.paragraphs:
+            if paragraph.text.strip():
+                level = _docx_heading_level(paragraph)
+                if level is not None:
+                    yield {"title": clean_text(paragraph.text)[:200], "level": level, "source": "headings"}
+                yield paragraph.text
+                yield "\n"
+        for table in doc.tables:
+            for row in table.rows:
+                for cell in row.cells:
+                    if cell.text.strip():
+                        yield cell.text
+                        yield " "
+                yield "\n"
+
+    return clean_text_with_headings(iter_word_pieces())
+
 async def process_content(
     file: UploadFile | None = None,
     youtube_url: str | None = None,
     text: str | None = None
-) -> tuple[str, str]:
+) -> tuple[str, str, list[dict]]:
     input_count = sum([file is not None, youtube_url is not None, text is not None])
 
     if input_count == 0:
@@ -279,6 +368,9 @@ async def process_content(
     if input_count > 1:
         raise HTTPException(status_code=400, detail="Only one input type allowed")
 
+    # Section headings found in the document structure (PDF outline, Word heading styles)
+    headings: list[dict] = []
+
     if file:
         file_ext = Path(file.filename).suffix.lower()
 
@@ -290,10 +382,10 @@ async def process_content(
             normalized_text = await normalize_video(file)
             input_type = "video"
         elif file_ext in pdf_extensions:
-            normalized_text = await normalize_pdf(file)
+            normalized_text, headings = await normalize_pdf(file)
             input_type = "pdf"
         elif file_ext in word_extensions:
-            normalized_text = await normalize_word(file)
+            normalized_text, headings = await normalize_word(file)
             input_type = "word"
         else:
             raise HTTPException(status_code=400, detail="Unsupported file format")
@@ -306,14 +398,14 @@ async def process_content(
         normalized_text = normalize_text(text)
         input_type = "text"
 
-    return input_type, normalized_text
+    return input_type, normalized_text, headings
 
 async def process_content_with_progress(
     file: UploadFile | None = None,
     youtube_url: str | None = None,
     text: str | None = None,
     progress_callback: Callable[[str, str, int], Awaitable[None]] | None = None
-) -> tuple[str, str]:
+) -> tuple[str, str, list[dict]]:
     """Process content with real-time progress updates"""
 
     input_count = sum([file is not None, youtube_url is not None, text is not None])
@@ -324,6 +416,9 @@ async def process_content_with_progress(
     if input_count > 1:
         raise HTTPException(status_code=400, detail="Only one input type allowed")
 
+    # Section headings found in the document structure (PDF outline, Word heading styles)
+    headings: list[dict] = []
+
     if progress_callback:
         await progress_callback("start", "Starting content processing...", 5)
 
@@ -338,10 +433,10 @@ async def process_content_with_progress(
             normalized_text = await normalize_video(file, progress_callback)
             input_type = "video"
         elif file_ext in pdf_extensions:
-            normalized_text = await normalize_pdf(file, progress_callback)
+            normalized_text, headings = await normalize_pdf(file, progress_callback)
             input_type = "pdf"
         elif file_ext in word_extensions:
-            normalized_text = await normalize_word(file, progress_callback)
+            normalized_text, headings = await normalize_word(file, progress_callback)
             input_type = "word"
         else:
             raise HTTPException(status_code=400, detail="Unsupported file format")
@@ -358,4 +453,4 @@ async def process_content_with_progress(
         normalized_text = normalize_text(text)
         input_type = "text"
 
-    return input_type, normalized_text
+    return input_type, normalized_text, headings
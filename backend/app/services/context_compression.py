@@ -0,0 +1,228 @@
+"""
+context_compression.py — Extractive, sentence-level compression of LLM context.
+
+Retrieval picks whole chunks, but usually only a few sentences of each matter.
+Before a context is sent to Groq, its sentences are scored and only the best
+ones are kept, up to a per-feature share of the original tokens, in their
+original order. Fewer prompt tokens = lower latency and cost on every call.
+
+Scoring is vectorized over all sentences of a context at once:
+  - relevance:  IDF-weighted hashed cosine of each sentence with the query
+                (chat question or feature hint; retrievers.score_hashed),
+  - centrality: cosine with the centroid of all the context's sentences, so
+                sentences carrying the context's main content survive when the
+                query is generic (summary).
+Repeated sentences and fragments repeated by chunk overlap are dropped first;
+fragments cut by chunk boundaries score lower.
+
+Compression ratios (tokens kept / tokens in) are counted per feature and
+exposed through GET /metrics.
+
+Environment:
+    CONTEXT_COMPRESSION — "off" disables compression (default "on").
+"""
+
+import math
+import os
+import threading
+
+import numpy as np
+from app.services.chunker import iter_sentences
+from app.services.global_idf import get_global_idf
+from app.services.retrievers import hash_texts, score_hashed
+from app.services.tokens import count_tokens_many, truncate_to_tokens
+
+COMPRESSION_ENABLED = os.getenv("CONTEXT_COMPRESSION", "on").lower() != "off"
+
+# Share of a context's tokens each feature keeps. Features not listed are not compressed.
+CONTEXT_KEEP_RATIO: dict[str, float] = {
+    "chatbot":    0.5,
+    "chat_multi": 0.5,
+    "quiz":       0.7,
+    "flashcards": 0.7,
+    "summary":    0.6,
+}
+
+# Contexts at or under this many tokens are sent as they are.
+MIN_CONTEXT_TOKENS = 150
+
+# Weight of query relevance against centrality when there is a query.
+QUERY_WEIGHT = 0.7
+
+# Leading sentences this long that the previous passage contains are overlap, not content.
+MIN_OVERLAP_CHARS = 20
+
+# Sentences scoring under this share of the best sentence are never kept, budget or not.
+MIN_SCORE_SHARE = 0.25
+
+# Score multiplier for fragments cut by chunk boundaries (no capital start / no end mark).
+FRAGMENT_PENALTY = 0.5
+
+_PASSAGE_SEPARATOR = "\n\n"
+
+
+class CompressionStats:
+    """Thread-safe per-feature counters of tokens before and after compression."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._features: dict[str, dict[str, int]] = {}
+
+    def record(self, feature: str, tokens_in: int, tokens_out: int) -> None:
+        with self._lock:
+            counters = self._features.setdefault(feature, {"contexts": 0, "tokens_in": 0, "tokens_out": 0})
+            counters["contexts"] += 1
+            counters["tokens_in"] += tokens_in
+            counters["tokens_out"] += tokens_out
+
+    def stats(self) -> dict:
+        with self._lock:
+            features = {
+                feature: {
+                    **counters,
+                    "ratio": round(counters["tokens_out"] / counters["tokens_in"], 4) if counters["tokens_in"] else 1.0,
+                }
+                for feature, counters in self._features.items()
+            }
+        tokens_in = sum(f["tokens_in"] for f in features.values())
+        tokens_out = sum(f["tokens_out"] for f in features.values())
+        return {
+            "enabled":    COMPRESSION_ENABLED,
+            "tokens_in":  tokens_in,
+            "tokens_out": tokens_out,
+            "ratio":      round(tokens_out / tokens_in, 4) if tokens_in else 1.0,
+            "features":   features,
+        }
+
+
+compression_stats = CompressionStats()
+
+
+def packing_budget(feature: str, budget: int) -> int:
+    """
+    Tokens of retrieved text to pack per prompt so that, once compressed, it fills
+    `budget` (pass budget to compress_context as the hard cap).
+    """
+    ratio = CONTEXT_KEEP_RATIO.get(feature)
+    if not COMPRESSION_ENABLED or not ratio:
+        return budget
+    return int(budget / ratio)
+
+
+def _is_fragment(sentence: str) -> bool:
+    """Whether a sentence was cut by a chunk boundary (no capital start or no end mark)."""
+    return not (sentence[0].isupper() or sentence[0].isdigit()) or sentence[-1] not in ".!?\"')"
+
+
+def _split_sentences(passages: list[str]) -> tuple[list[str], list[int]]:
+    """
+    Sentences of all passages and the passage each belongs to. Sentences seen before,
+    leading sentences of a passage that the previous passage already contains (chunk
+    overlap), and fragments too short to carry anything are dropped.
+    """
+    sentences: list[str] = []
+    owners: list[int] = []
+    seen: set[str] = set()
+    previous = ""
+    for number, passage in enumerate(passages):
+        parts = [part.strip() for part in iter_sentences([passage]) if part.strip()]
+        while parts and previous and len(parts[0]) >= MIN_OVERLAP_CHARS and parts[0] in previous:
+            parts = parts[1:]
+        for part in parts:
+            if part not in seen and (len(part) >= MIN_OVERLAP_CHARS or not _is_fragment(part)):
+                seen.add(part)
+                sentences.append(part)
+                owners.append(number)
+        previous = passage
+    return sentences, owners
+
+
+def score_sentences(sentences: list[str], query: str | None = None) -> np.ndarray:
+    """Value of every sentence: query relevance blended with centrality (see module docstring)."""
+    vectors = hash_texts(sentences)
+    centroid = np.asarray(vectors.sum(axis=0)).ravel()
+    norm = np.linalg.norm(centroid)
+    centrality = vectors @ (centroid / norm) if norm else np.zeros(len(sentences))
+    centrality = np.asarray(centrality).ravel()
+
+    scores = centrality
+    if query:
+        relevance = score_hashed(vectors, [query], get_global_idf())[0]
+        scores = QUERY_WEIGHT * relevance + (1 - QUERY_WEIGHT) * centrality
+
+    fragments = np.array([_is_fragment(sentence) for sentence in sentences])
+    return np.where(fragments, scores * FRAGMENT_PENALTY, scores)
+
+
+def compress_passages(
+    passages: list[str],
+    feature: str,
+    query: str | None = None,
+    budget: int | None = None,
+) -> list[str]:
+    """
+    Keep the highest-value sentences across passages, each passage in its original order.
+
+    Args:
+        passages: Retrieved texts (chunks, packed groups) in the order they are sent.
+        feature:  Feature name; sets the share of tokens kept (CONTEXT_KEEP_RATIO).
+        query:    User question or the feature's hint query; None scores centrality only.
+        budget:   Hard token cap for all passages together, if any.
+
+    Returns:
+        One entry per passage: its kept sentences, or "" when none were kept. Passages
+        come back unchanged when compression is off, the feature is not configured,
+        or they are already small enough.
+    """
+    ratio = CONTEXT_KEEP_RATIO.get(feature)
+    if not COMPRESSION_ENABLED or ratio is None or not any(p.strip() for p in passages):
+        return list(passages)
+
+    sentences, owners = _split_sentences(passages)
+    if not sentences:
+        return list(passages)
+    token_counts = np.array(count_tokens_many(sentences))
+    total = sum(count_tokens_many(passages))
+    target = max(MIN_CONTEXT_TOKENS, math.ceil(ratio * total))
+    if budget is not None:
+        target = min(target, budget)
+    if total <= target:
+        compression_stats.record(feature, total, total)
+        return list(passages)
+
+    scores = score_sentences(sentences, query)
+    floor = MIN_SCORE_SHARE * scores.max()
+    keep = np.zeros(len(sentences), dtype=bool)
+    used = 0
+    for i in np.argsort(-scores, kind="stable"):
+        if scores[i] < floor:
+            break
+        if used + token_counts[i] <= target:
+            keep[i] = True
+            used += int(token_counts[i])
+
+    kept: list[list[str]] = [[] for _ in passages]
+    if keep.any():
+        for i in np.flatnonzero(keep):
+            kept[owners[i]].append(sentences[i])
+    else:
+        # Even the best sentence is over budget: send it cut to size.
+        best = int(np.argmax(scores))
+        kept[owners[best]].append(truncate_to_tokens(sentences[best], target))
+        used = target
+    compression_stats.record(feature, total, used)
+    return [" ".join(parts) for parts in kept]
+
+
+def compress_context(
+    context: str,
+    feature: str,
+    query: str | None = None,
+    budget: int | None = None,
+) -> str:
+    """
+    compress_passages over one context whose passages are separated by blank lines
+    (as built by tokens.pack_texts). Returns the kept passages joined the same way.
+    """
+    passages = compress_passages(context.split(_PASSAGE_SEPARATOR), feature, query, budget)
+    return _PASSAGE_SEPARATOR.join(p for p in passages if p)
@@ -1,18 +1,40 @@
 """
 flashcards.py — Flashcards generation service.
 
-Supports pre-stored chunks (MongoDB content['chunks']) and raw normalized_text fallback.
+Reads the content's stored chunks; raw text passed in directly is chunked the same way.
+
+Cards are generated by several concurrent calls, each over its own share of the
+relevant chunks. iter_flashcard_batches yields every call's cards as soon as they
+are parsed (near-duplicates of earlier cards removed), so the streaming endpoint
+can show the first cards after a single round trip; generate_flashcards collects
+the whole deck.
 """
 
 import json
+import math
 import os
-
-from app.services.chunker import get_chunks_for_feature
+from collections.abc import Iterator, Sequence
+
+import numpy as np
+from app.services.chunker import (
+    RETRIEVAL_QUERIES,
+    TOP_K_CONFIG,
+    compute_chunks,
+    get_chunk_indices_for_feature,
+    get_token_counts,
+)
+from app.services.context_compression import compress_context, packing_budget
+from app.services.generation_cache import prompt_version
+from app.services.llm_gateway import chat_completion, iter_concurrently
+from app.services.retrievers import hash_texts
+from app.services.tokens import pack_texts, prompt_budget
 from dotenv import load_dotenv
-from groq import Groq
 
 load_dotenv()
 
+FLASHCARD_MODEL = "llama-3.1-8b-instant"
+FLASHCARD_SYSTEM_PROMPT = "You output only raw JSON. No preamble, no explanation, no markdown."
+
 FLASHCARD_PROMPT = """Create EXACTLY {num_cards} flashcards. Type: {flashcard_type}
 
 {content}
@@ -20,6 +42,19 @@ FLASHCARD_PROMPT = """Create EXACTLY {num_cards} flashcards. Type: {flashcard_ty
 Return ONLY JSON:
 {{"flashcards": [{{"front": "...", "back": "..."}}]}}"""
 
+# Completion tokens reserved per requested card (front + back as JSON).
+FLASHCARD_TOKENS_PER_CARD = 80
+FLASHCARD_MAX_TOKENS = 2000   # per call; more cards are spread over more calls
+MAX_FLASHCARD_CALLS = 8
+FLASHCARD_CARDS_PER_CALL = 5   # smaller calls finish sooner; they all run at once
+FLASHCARD_DUPLICATE_SIMILARITY = 0.8
+
+# Cache key part of generated decks (generation_cache).
+FLASHCARD_PROMPT_VERSION = prompt_version(
+    "flashcards", 1, FLASHCARD_SYSTEM_PROMPT, FLASHCARD_PROMPT, FLASHCARD_TOKENS_PER_CARD,
+    FLASHCARD_CARDS_PER_CALL, FLASHCARD_DUPLICATE_SIMILARITY,
+)
+
 
 def clean_json_response(text: str) -> str:
     """Extract JSON object from markdown code blocks."""
@@ -55,69 +90,132 @@ def generate_flashcards(
     text_input: str | None = None,
     flashcard_type: str = "Concept → Definition",
     num_cards: int = 10,
-    stored_chunks: list[str] | None = None,
-    normalized_text: str | None = None,
+    stored_chunks: Sequence[str] | None = None,
+    retrieval_index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
 ) -> dict:
     """
     Generate flashcards from stored_chunks or raw text.
 
     Args:
-        text_input: Positional fallback parameter.
+        text_input: Raw text, used only when there are no stored chunks.
         flashcard_type: E.g., "Concept → Definition", "Question → Answer".
         num_cards: Total flashcards requested.
         stored_chunks: Pre-computed chunks list from MongoDB.
-        normalized_text: Raw text fallback.
+        retrieval_index: Stored retrieval index; supplies the precomputed ranking for stored_chunks.
+        chunk_range: [start, end) of stored_chunks to read, e.g. one section; None for all.
     """
-    api_key = os.getenv("GROQ_API_KEY")
-    if not api_key:
-        raise ValueError("GROQ_API_KEY not set")
-
-    client = Groq(api_key=api_key)
-
-    content_raw = text_input or normalized_text or ""
-    if stored_chunks and isinstance(stored_chunks, list) and len(stored_chunks) > 0:
-        chunks = stored_chunks
-    elif content_raw:
-        chunks = get_chunks_for_feature(content_raw, "flashcards")
-    else:
+    if not stored_chunks and not text_input:
         return {"flashcards": [], "error": "No content available"}
 
-    chunks_to_use = min(len(chunks), 4)
-    cards_per_chunk = max(2, num_cards // chunks_to_use)
-
     all_flashcards: list[dict] = []
+    for cards in iter_flashcard_batches(
+        text_input, flashcard_type, num_cards, stored_chunks, retrieval_index, chunk_range
+    ):
+        all_flashcards.extend(cards)
+    return {"flashcards": all_flashcards}
 
-    for i in range(chunks_to_use):
-        if len(all_flashcards) >= num_cards:
-            break
 
-        needed = num_cards - len(all_flashcards)
-        num = min(cards_per_chunk, needed)
+def iter_flashcard_batches(
+    text_input: str | None = None,
+    flashcard_type: str = "Concept → Definition",
+    num_cards: int = 10,
+    stored_chunks: Sequence[str] | None = None,
+    retrieval_index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
+) -> Iterator[list[dict]]:
+    """
+    generate_flashcards, yielding each call's new cards as soon as they are parsed,
+    in completion order; num_cards in total at most. Arguments as for generate_flashcards.
+    """
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY not set")
 
-        prompt = FLASHCARD_PROMPT.format(
-            num_cards=num,
-            flashcard_type=flashcard_type,
-            content=chunks[i],
+    # Stored content always has chunks (legacy documents are backfilled: worker/backfill.py)
+    if not stored_chunks and text_input:
+        stored_chunks = compute_chunks(text_input)
+    if not stored_chunks:
+        return
+
+    # Small concurrent calls, each capped at what FLASHCARD_MAX_TOKENS can hold
+    per_call_cap = FLASHCARD_MAX_TOKENS // FLASHCARD_TOKENS_PER_CARD
+    calls = min(MAX_FLASHCARD_CALLS, max(1, math.ceil(num_cards / FLASHCARD_CARDS_PER_CALL)))
+    counts = [min(per_call_cap, num_cards // calls + (1 if i < num_cards % calls else 0)) for i in range(calls)]
+
+    # Each call reads its own share of the relevant chunks (round-robin by rank);
+    # only sentences matching the hint query are sent
+    budget = prompt_budget(
+        FLASHCARD_MODEL,
+        FLASHCARD_MAX_TOKENS,
+        FLASHCARD_SYSTEM_PROMPT,
+        FLASHCARD_PROMPT.format(num_cards=per_call_cap, flashcard_type=flashcard_type, content=""),
+    )
+    indices = get_chunk_indices_for_feature(
+        stored_chunks, "flashcards", None, retrieval_index, chunk_range,
+        top_k=max(TOP_K_CONFIG["flashcards"], 2 * calls),
+    )
+    if not indices:
+        # e.g. a section range left stale by a re-chunk
+        return
+    token_counts = get_token_counts(retrieval_index, stored_chunks)
+    jobs = []
+    for call, count in enumerate(counts):
+        if count <= 0:
+            continue
+        share = sorted(indices[call::calls]) or [indices[call % len(indices)]]
+        packed = pack_texts(
+            [stored_chunks[i] for i in share], [int(token_counts[i]) for i in share], packing_budget("flashcards", budget)
         )
-
-        try:
-            response = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": "You output only raw JSON. No preamble, no explanation, no markdown."},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.7,
-                max_tokens=400,
-            )
-            raw = response.choices[0].message.content
-            if raw and raw.strip():
-                cleaned = clean_json_response(raw)
-                data = json.loads(cleaned)
-                cards = data.get("flashcards", [])
-                all_flashcards.extend(cards[:num])
-        except Exception as exc:
-            print(f"[FLASHCARDS] Chunk {i} error: {exc}")
+        jobs.append((compress_context(packed[0], "flashcards", RETRIEVAL_QUERIES["flashcards"], budget=budget), count))
+
+    kept_fronts: list[str] = []
+    for _, cards in iter_concurrently(
+        lambda job: _request_cards(job[0], job[1], flashcard_type), jobs, MAX_FLASHCARD_CALLS
+    ):
+        new_cards = _new_cards(cards or [], kept_fronts)[:num_cards - len(kept_fronts)]
+        if not new_cards:
             continue
-
-    return {"flashcards": all_flashcards[:num_cards]}
+        kept_fronts.extend(card["front"] for card in new_cards)
+        yield new_cards
+        if len(kept_fronts) >= num_cards:
+            return
+
+
+def _request_cards(content: str, num: int, flashcard_type: str) -> list[dict] | None:
+    """One generation call for `num` cards; None when it fails."""
+    prompt = FLASHCARD_PROMPT.format(num_cards=num, flashcard_type=flashcard_type, content=content)
+    try:
+        response = chat_completion(
+            model=FLASHCARD_MODEL,
+            messages=[
+                {"role": "system", "content": FLASHCARD_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.7,
+            max_tokens=min(FLASHCARD_MAX_TOKENS, num * FLASHCARD_TOKENS_PER_CARD + 100),
+        )
+        raw = response.choices[0].message.content
+        if not raw or not raw.strip():
+            return None
+        cards = json.loads(clean_json_response(raw)).get("flashcards", [])
+        return [
+            card for card in cards
+            if isinstance(card, dict) and str(card.get("front") or "").strip() and str(card.get("back") or "").strip()
+        ][:num]
+    except Exception as exc:
+        print(f"[FLASHCARDS] Generation error: {exc}")
+        return None
+
+
+def _new_cards(cards: list[dict], kept_fronts: list[str]) -> list[dict]:
+    """Cards whose front is not near-identical (hashed cosine) to a kept card or an earlier card of the batch."""
+    if not cards:
+        return []
+    vectors = hash_texts([str(card["front"]) for card in cards] + kept_fronts)
+    similarities = (vectors[:len(cards)] @ vectors.T).toarray()
+    keep = np.zeros(len(cards), dtype=bool)
+    for i in range(len(cards)):
+        earlier = np.concatenate([similarities[i, :i][keep[:i]], similarities[i, len(cards):]])
+        keep[i] = not (earlier >= FLASHCARD_DUPLICATE_SIMILARITY).any()
+    return [card for card, kept in zip(cards, keep) if kept]
@@ -0,0 +1,168 @@
+"""
+generation_cache.py — Content-addressed cache of generated outputs.
+
+Summary, quiz and flashcard requests that would produce the same output are
+served from MongoDB (generation_cache collection) instead of calling Groq again.
+
+Keys are a hash of:
+  - the content hash (chunk_metadata["content_hash"]: fingerprint of the stored
+    chunks), identical for everyone who uploaded the same document, so entries
+    are shared across users and re-uploads,
+  - the feature and its normalized options (sorted keys, strings trimmed and
+    lowercased, unset options dropped; sections by chunk range, not number),
+  - the prompt version (prompt_version: hash of the service's prompt templates
+    and generation parameters), so editing a prompt never serves old outputs,
+  - the model.
+
+Entries expire GENERATION_CACHE_TTL_DAYS after they were last used; beyond
+GENERATION_CACHE_MAX_ENTRIES the least recently used are evicted. Endpoints take
+regenerate=true to skip the lookup; the fresh output replaces the entry.
+The cache never fails a request: database errors count as misses.
+
+Counters are per process and exposed through GET /metrics.
+
+Environment:
+    GENERATION_CACHE_MAX_ENTRIES — maximum entries (default 20000, 0 disables the cache).
+    GENERATION_CACHE_TTL_DAYS    — days an unused entry is kept (default 30).
+"""
+
+import hashlib
+import json
+import os
+import threading
+from collections.abc import Sequence
+from datetime import timedelta
+
+from app.models.generation_cache import evict_cached_generations, get_cached_generation, save_cached_generation
+from app.services.retrieval_cache import content_fingerprint
+
+DEFAULT_MAX_ENTRIES = 20000
+DEFAULT_TTL_DAYS = 30
+
+MAX_ENTRIES = int(os.getenv("GENERATION_CACHE_MAX_ENTRIES", DEFAULT_MAX_ENTRIES))
+RETENTION = timedelta(days=float(os.getenv("GENERATION_CACHE_TTL_DAYS", DEFAULT_TTL_DAYS)))
+
+
+class GenerationCacheStats:
+    """Thread-safe per-feature hit / miss counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._features: dict[str, dict[str, int]] = {}
+        self.evictions = 0
+
+    def record(self, feature: str, event: str) -> None:
+        with self._lock:
+            counters = self._features.setdefault(
+                feature, {"hits": 0, "misses": 0, "bypassed": 0, "stored": 0, "errors": 0}
+            )
+            counters[event] += 1
+
+    def record_evictions(self, count: int) -> None:
+        with self._lock:
+            self.evictions += count
+
+    def stats(self) -> dict:
+        with self._lock:
+            features = {}
+            for feature, counters in self._features.items():
+                lookups = counters["hits"] + counters["misses"]
+                features[feature] = {
+                    **counters,
+                    "hit_rate": round(counters["hits"] / lookups, 4) if lookups else 0.0,
+                }
+            hits = sum(f["hits"] for f in features.values())
+            lookups = hits + sum(f["misses"] for f in features.values())
+            return {
+                "enabled":     MAX_ENTRIES > 0,
+                "max_entries": MAX_ENTRIES,
+                "ttl_days":    RETENTION.days,
+                "hits":        hits,
+                "lookups":     lookups,
+                "hit_rate":    round(hits / lookups, 4) if lookups else 0.0,
+                "evictions":   self.evictions,
+                "features":    features,
+            }
+
+
+generation_cache_stats = GenerationCacheStats()
+
+
+def prompt_version(feature: str, revision: int, *parts) -> str:
+    """
+    Version tag of a feature's prompts: a hash of its templates and generation
+    parameters. Bump `revision` for prompt changes the parts do not capture.
+    """
+    digest = hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()[:8]
+    return f"{feature}-{revision}-{digest}"
+
+
+def _normalize_options(options: dict) -> dict:
+    return {
+        key: value.strip().lower() if isinstance(value, str) else value
+        for key, value in sorted(options.items())
+        if value is not None
+    }
+
+
+def generation_key(
+    content: dict,
+    stored_chunks: Sequence[str],
+    feature: str,
+    options: dict,
+    version: str,
+    model: str,
+) -> tuple[str, dict]:
+    """
+    Cache key of a generation request, and the parts it was built from (stored
+    with the entry for inspection).
+
+    Args:
+        content:       Content document (its chunk_metadata carries the content hash).
+        stored_chunks: The content's chunks; hashed only for documents without a stored hash.
+        feature:       summary | quiz | flashcards.
+        options:       Options that change the output (sections as chunk ranges).
+        version:       The feature's prompt_version.
+        model:         Model that generates the output.
+    """
+    content_hash = (content.get("chunk_metadata") or {}).get("content_hash") or content_fingerprint(stored_chunks)
+    parts = {
+        "content_hash":   content_hash,
+        "feature":        feature,
+        "options":        _normalize_options(options),
+        "prompt_version": version,
+        "model":          model,
+    }
+    key = hashlib.sha256(json.dumps(parts, sort_keys=True).encode()).hexdigest()
+    return key, parts
+
+
+def get_cached_output(key: str, feature: str, regenerate: bool = False) -> dict | None:
+    """Cached output for a key; None on a miss, with regenerate, or when the cache is off."""
+    if MAX_ENTRIES <= 0:
+        return None
+    if regenerate:
+        generation_cache_stats.record(feature, "bypassed")
+        return None
+    try:
+        output = get_cached_generation(key, RETENTION)
+    except Exception as exc:
+        print(f"[GENERATION CACHE] Lookup error: {exc}")
+        generation_cache_stats.record(feature, "errors")
+        output = None
+    generation_cache_stats.record(feature, "hits" if output is not None else "misses")
+    return output
+
+
+def store_output(key: str, parts: dict, output: dict) -> None:
+    """Cache a freshly generated output and evict beyond MAX_ENTRIES."""
+    if MAX_ENTRIES <= 0:
+        return
+    try:
+        if not save_cached_generation(key, parts, output, RETENTION):
+            return
+        generation_cache_stats.record(parts["feature"], "stored")
+        generation_cache_stats.record_evictions(evict_cached_generations(MAX_ENTRIES))
+    except Exception as exc:
+        print(f"[GENERATION CACHE] Store error: {exc}")
+        generation_cache_stats.record(parts["feature"], "errors")
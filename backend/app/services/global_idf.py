@@ -0,0 +1,156 @@
+"""
+global_idf.py — Corpus-wide IDF weights for the hashed retrieval space.
+
+Document frequencies over ALL ingested chunks are kept in MongoDB
+(models/term_stats.py) and updated incrementally: create_content adds a new
+content's hashed chunk vectors, deleting its retrieval index subtracts them.
+The hashed backend (retrievers.score_hashed) applies these IDFs to both the
+query and the chunk vectors, at scoring time: stored chunk rows are plain
+sublinear-TF counts, and the chunk-side weights are folded into the query and
+the row norms. So retrieval on any content needs no per-content fit, IDF updates
+never invalidate stored rows, and short contents get the statistics of the
+whole corpus instead of a handful of chunks.
+
+Where the weights come from, in order:
+  1. a pinned array (set_global_idf; benchmarks, tests),
+  2. a snapshot file (TERM_IDF_PATH), memory-mapped and shared by every API
+     process; re-mapped when the file is replaced,
+  3. the live statistics in MongoDB, re-read every IDF_REFRESH_SECONDS.
+With no statistics at all (empty corpus), vectors stay unweighted.
+
+Snapshot / rebuild (offline):
+    python -m app.services.global_idf snapshot --out data/term_idf.npy
+    python -m app.services.global_idf rebuild
+
+Environment:
+    TERM_IDF_PATH — snapshot file (default: data/term_idf.npy). Optional.
+"""
+
+import argparse
+import os
+import time
+from pathlib import Path
+
+import numpy as np
+
+DEFAULT_IDF_PATH = "data/term_idf.npy"
+IDF_REFRESH_SECONDS = 300
+
+_pinned: np.ndarray | None = None
+_pinned_set = False
+_snapshot: tuple[float, np.ndarray] | None = None   # (mtime, mmap)
+_live: tuple[float, np.ndarray | None] | None = None  # (loaded_at, idf)
+
+
+def compute_idf(df: np.ndarray, chunk_count: int) -> np.ndarray:
+    """Smoothed IDF (as scikit-learn's TfidfTransformer): ln((1 + n) / (1 + df)) + 1."""
+    return (np.log((1.0 + chunk_count) / (1.0 + df)) + 1.0).astype(np.float32)
+
+
+def idf_from_texts(texts: list[str]) -> np.ndarray:
+    """IDF over a given set of chunks (benchmarks, offline evaluation)."""
+    from app.services.retrievers import hash_texts
+
+    matrix = hash_texts(texts)
+    return compute_idf(np.bincount(matrix.indices, minlength=matrix.shape[1]), len(texts))
+
+
+def set_global_idf(idf: np.ndarray | None) -> None:
+    """Use these weights instead of the snapshot / MongoDB statistics (None = unweighted)."""
+    global _pinned, _pinned_set
+    _pinned, _pinned_set = idf, True
+
+
+def _n_features() -> int:
+    from app.services.retrievers import HASHED_PARAMS
+
+    return HASHED_PARAMS["n_features"]
+
+
+def _load_snapshot(path: Path) -> np.ndarray | None:
+    global _snapshot
+    try:
+        mtime = path.stat().st_mtime
+    except OSError:
+        return None
+    if _snapshot is None or _snapshot[0] != mtime:
+        idf = np.load(path, mmap_mode="r")
+        if idf.shape != (_n_features(),):
+            print(f"[IDF] Ignoring {path}: shape {idf.shape} does not match the hashed feature space")
+            return None
+        _snapshot = (mtime, idf)
+    return _snapshot[1]
+
+
+def _load_live() -> np.ndarray | None:
+    global _live
+    now = time.monotonic()
+    if _live is None or now - _live[0] > IDF_REFRESH_SECONDS:
+        from app.models.term_stats import get_term_stats
+
+        try:
+            df, chunk_count, _ = get_term_stats(_n_features())
+            idf = compute_idf(df, chunk_count) if chunk_count else None
+        except Exception as e:
+            print(f"[IDF] Could not load term statistics: {e}")
+            idf = _live[1] if _live else None
+        _live = (now, idf)
+    return _live[1]
+
+
+def get_global_idf() -> np.ndarray | None:
+    """IDF per hashed feature (float32, shape (n_features,)), or None when unavailable."""
+    if _pinned_set:
+        return _pinned
+    snapshot = _load_snapshot(Path(os.getenv("TERM_IDF_PATH", DEFAULT_IDF_PATH)))
+    if snapshot is not None:
+        return snapshot
+    return _load_live()
+
+
+def snapshot_global_idf(out: str) -> int:
+    """Write the current MongoDB statistics as an IDF .npy file. Returns the chunk count."""
+    from app.models.term_stats import get_term_stats
+
+    df, chunk_count, _ = get_term_stats(_n_features())
+    path = Path(out)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Write then rename, so processes mapping the old file never see a partial one.
+    tmp = path.with_suffix(".tmp.npy")
+    np.save(tmp, compute_idf(df, chunk_count))
+    os.replace(tmp, path)
+    return chunk_count
+
+
+def rebuild_term_stats() -> int:
+    """Recount the statistics from every stored retrieval index. Returns contents counted."""
+    from app.database.connection import get_database
+    from app.models.blob_storage import unpack_value
+    from app.models.term_stats import add_term_stats, reset_term_stats
+    from app.services.retrievers import HASHED_SPACE_VERSION
+
+    reset_term_stats(HASHED_SPACE_VERSION)
+    counted = 0
+    for doc in get_database().retrieval_indexes.find({}, {"index.hashed": 1}):
+        if add_term_stats(unpack_value((doc.get("index") or {}).get("hashed"))):
+            counted += 1
+    return counted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline tools for the global IDF statistics.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    snapshot = sub.add_parser("snapshot", help="Write the IDF weights to a .npy file for memory-mapping.")
+    snapshot.add_argument("--out", default=DEFAULT_IDF_PATH)
+    sub.add_parser("rebuild", help="Recount document frequencies from all stored retrieval indexes.")
+    args = parser.parse_args()
+
+    if args.command == "snapshot":
+        chunk_count = snapshot_global_idf(args.out)
+        print(f"Saved IDF over {chunk_count} chunks to {args.out}")
+    else:
+        print(f"Recounted term statistics from {rebuild_term_stats()} contents")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""
+library_search.py — Semantic search across ALL of a user's contents.
+
+Every content's retrieval index carries a `hashed` section (retrievers.py):
+chunk vectors in one fixed hashed feature space, so scores from different
+contents are directly comparable. Each process keeps one LibraryIndex per
+user that stacks those sections into a single sparse matrix — a search is
+one sparse product plus a partial sort. Query and chunk vectors are weighted
+by the corpus-wide IDF (global_idf.py, retrievers.score_hashed); the weighted
+chunk norms are cached until the IDF is refreshed.
+
+Keeping it in sync:
+  - add_to_library / remove_from_library are called when content is created,
+    deleted or re-indexed in this process (no rebuild, no MongoDB round trip).
+  - Every search diffs the user's contents (ids, chunk counts and content
+    hashes only) against the cached library, so contents added, deleted or
+    re-chunked by the worker or other processes are picked up by loading just
+    the hashed sections that changed.
+  - Searches never rebuild an index. Contents without a current one are left
+    out (and remembered: one small query per search) until a feature request or the
+    backfill worker (worker/backfill.py) rebuilds it.
+  - The cached libraries of a process together stay under MAX_CACHED_LIBRARY_BYTES;
+    the least recently searched are dropped first.
+"""
+
+import os
+
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from app.models.content import (
+    get_chunk_texts,
+    get_contents_by_ids,
+    get_retrieval_index_sections,
+    get_user_content,
+)
+from app.services.chunker import MIN_SIMILARITY, is_index_current
+from app.services.global_idf import get_global_idf
+from app.services.retrievers import hashed_row_norms, load_hashed_matrix, score_hashed
+from scipy import sparse
+
+# Memory for cached libraries per process; least recently searched users are dropped first.
+MAX_CACHED_LIBRARY_BYTES = int(os.getenv("LIBRARY_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+DEFAULT_SEARCH_TOP_K = 10
+MAX_SEARCH_TOP_K = 50
+
+
+class LibraryIndex:
+    """Hashed chunk vectors of one user's contents, stacked lazily for search."""
+
+    def __init__(self):
+        self._parts: dict[str, sparse.csr_matrix] = {}
+        # (chunk count, content hash) each content was loaded for (_signature)
+        self.signatures: dict[str, tuple] = {}
+        # Contents without a current hashed section, by the signature they had then
+        self.unindexed: dict[str, tuple] = {}
+        self._matrix: sparse.csr_matrix | None = None
+        # IDF-weighted row norms of _matrix, and the IDF array they were computed with
+        self._norms: np.ndarray | None = None
+        self._norms_idf: np.ndarray | None = None
+        self._owners: list[str] = []
+        self._owner_ids = np.zeros(0, dtype=np.int32)
+        self._chunk_ids = np.zeros(0, dtype=np.int32)
+
+    @property
+    def content_ids(self) -> set[str]:
+        return set(self._parts)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory held by the chunk matrices (parts, and the stacked copy once searched)."""
+        matrices = [*self._parts.values(), *([self._matrix] if self._matrix is not None else [])]
+        arrays = sum(m.data.nbytes + m.indices.nbytes + m.indptr.nbytes for m in matrices)
+        norms = self._norms.nbytes if self._norms is not None else 0
+        return arrays + norms + self._owner_ids.nbytes + self._chunk_ids.nbytes
+
+    def add(self, content_id: str, matrix: sparse.csr_matrix, signature: tuple) -> None:
+        self._parts[content_id] = matrix
+        self.signatures[content_id] = signature
+        self.unindexed.pop(content_id, None)
+        self._matrix = None
+
+    def remove(self, content_id: str) -> None:
+        self.signatures.pop(content_id, None)
+        self.unindexed.pop(content_id, None)
+        if self._parts.pop(content_id, None) is not None:
+            self._matrix = None
+
+    def _stack(self) -> None:
+        """Re-stack after adds/removes; one vstack, amortized over every later search."""
+        self._owners = list(self._parts)
+        parts = [self._parts[cid] for cid in self._owners]
+        sizes = [part.shape[0] for part in parts]
+        self._matrix = sparse.vstack(parts, format="csr")
+        self._norms = None
+        self._owner_ids = np.repeat(np.arange(len(parts), dtype=np.int32), sizes)
+        self._chunk_ids = np.concatenate([np.arange(size, dtype=np.int32) for size in sizes])
+
+    def search(self, query: str, idf: np.ndarray | None, top_k: int) -> list[tuple[str, int, float]]:
+        """Top-k (content_id, chunk_index, score) across the whole library."""
+        if not self._parts:
+            return []
+        if self._matrix is None:
+            self._stack()
+        if self._norms is None or self._norms_idf is not idf:
+            self._norms = hashed_row_norms(self._matrix, idf)
+            self._norms_idf = idf
+
+        scores = score_hashed(self._matrix, [query], idf, self._norms)[0]
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind="stable")]
+
+        return [
+            (self._owners[self._owner_ids[row]], int(self._chunk_ids[row]), float(scores[row]))
+            for row in top
+            if scores[row] > MIN_SIMILARITY
+        ]
+
+
+_libraries: "OrderedDict[str, LibraryIndex]" = OrderedDict()
+_lock = threading.Lock()
+
+
+def _get_library(user_id: str) -> LibraryIndex:
+    with _lock:
+        library = _libraries.get(user_id)
+        if library is None:
+            library = _libraries[user_id] = LibraryIndex()
+        else:
+            _libraries.move_to_end(user_id)
+        return library
+
+
+def _evict_libraries(user_id: str) -> None:
+    """Drop least recently searched libraries until the cache fits MAX_CACHED_LIBRARY_BYTES."""
+    with _lock:
+        sizes = {uid: library.nbytes for uid, library in _libraries.items()}
+        total = sum(sizes.values())
+        for uid in list(_libraries):
+            if total <= MAX_CACHED_LIBRARY_BYTES:
+                break
+            # The library being searched goes last (only if it alone is over budget).
+            if uid != user_id or len(_libraries) == 1:
+                del _libraries[uid]
+                total -= sizes[uid]
+
+
+def _hashed_matrix(index: dict | None) -> sparse.csr_matrix | None:
+    section = (index or {}).get("hashed")
+    return load_hashed_matrix(section) if section else None
+
+
+def _signature(chunk_count: int | None, content_hash: str | None) -> tuple:
+    """What a cached part must still match: the content's chunk count and chunk fingerprint."""
+    return chunk_count, content_hash
+
+
+def add_to_library(user_id: str, content_id: str, index: dict | None) -> None:
+    """Add one content's chunks to the user's cached library, if it is loaded."""
+    with _lock:
+        library = _libraries.get(user_id)
+    matrix = _hashed_matrix(index)
+    if library is not None and matrix is not None:
+        library.add(content_id, matrix, _signature(index.get("chunk_count"), index.get("content_hash")))
+
+
+def remove_from_library(user_id: str, content_id: str) -> None:
+    """Drop one content's chunks from the user's cached library, if it is loaded."""
+    with _lock:
+        library = _libraries.get(user_id)
+    if library is not None:
+        library.remove(content_id)
+
+
+def _sync_library(user_id: str, library: LibraryIndex) -> None:
+    """Bring the cached library in line with the user's contents in MongoDB."""
+    docs = get_user_content(user_id, projection={"_id": 1, "chunk_metadata.count": 1, "chunk_metadata.content_hash": 1})
+    current = {
+        str(doc["_id"]): _signature(
+            (doc.get("chunk_metadata") or {}).get("count"),
+            (doc.get("chunk_metadata") or {}).get("content_hash"),
+        )
+        for doc in docs
+    }
+
+    # Deleted, or re-chunked since it was loaded (its chunk indices point elsewhere now)
+    for content_id in library.content_ids | set(library.unindexed):
+        known = library.signatures.get(content_id) or library.unindexed.get(content_id)
+        if current.get(content_id) != known:
+            library.remove(content_id)
+
+    missing = [cid for cid in current if cid not in library.signatures and cid not in library.unindexed]
+    # Contents skipped before: a light query (no sections) tells whether they were indexed since
+    if library.unindexed:
+        stored = get_retrieval_index_sections(list(library.unindexed))
+        missing += [
+            cid for cid, (chunk_count, _) in library.unindexed.items()
+            if is_index_current(stored.get(cid), chunk_count)
+        ]
+    if not missing:
+        return
+
+    stored = get_retrieval_index_sections(missing, "hashed", "content_hash")
+    for content_id in missing:
+        chunk_count, content_hash = current[content_id]
+        index = stored.get(content_id)
+        stale = not is_index_current(index, chunk_count) or (
+            content_hash and index.get("content_hash") not in (None, content_hash)
+        )
+        matrix = None if stale else _hashed_matrix(index)
+        if matrix is None:
+            # Never rebuilt here: the next feature request or the backfill worker does it
+            library.unindexed[content_id] = current[content_id]
+        else:
+            library.add(content_id, matrix, current[content_id])
+
+
+def search_library(user_id: str, query: str, top_k: int = DEFAULT_SEARCH_TOP_K) -> list[dict]:
+    """
+    Rank chunks from every content the user owns against one query.
+
+    Returns:
+        [{"content_id", "title", "input_type", "chunk_index", "chunk", "score"}, ...]
+        best first, at most top_k entries.
+    """
+    library = _get_library(user_id)
+    _sync_library(user_id, library)
+
+    hits = library.search(query, get_global_idf(), top_k)
+    _evict_libraries(user_id)
+    if not hits:
+        return []
+
+    # Only the chunks that were hit are fetched, never whole texts.
+    selection: dict[str, list[int]] = {}
+    for content_id, chunk_index, _ in hits:
+        selection.setdefault(content_id, []).append(chunk_index)
+    contents = get_contents_by_ids(list(selection), {"title": 1, "input_type": 1})
+    texts = get_chunk_texts(selection)
+
+    results = []
+    for content_id, chunk_index, score in hits:
+        content = contents.get(content_id)
+        chunk = texts.get(content_id, {}).get(chunk_index)
+        if content is None or chunk is None:
+            continue
+        results.append({
+            "content_id":  content_id,
+            "title":       content.get("title"),
+            "input_type":  content.get("input_type"),
+            "chunk_index": chunk_index,
+            "chunk":       chunk,
+            "score":       round(score, 4),
+        })
+    return results
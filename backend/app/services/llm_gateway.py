@@ -0,0 +1,451 @@
+"""
+llm_gateway.py — The one way services talk to Groq.
+
+Every chat completion and transcription in the backend goes through here:
+  - Clients:     one Groq client per process over a pooled keep-alive HTTP
+                 connection pool, shared by all threads (httpx is thread-safe).
+  - Concurrency: at most LLM_MAX_CONCURRENCY calls in flight per process;
+                 further callers queue (up to LLM_QUEUE_TIMEOUT seconds).
+  - Throttling:  per-model token buckets for requests and tokens per minute, so
+                 bursts are smoothed to the account's Groq limits instead of
+                 being answered with 429s. A call reserves its estimated prompt
+                 tokens + max_tokens; what the response did not use is refunded.
+                 A 429's retry-after pauses that model's buckets for everyone.
+                 Both limits are off by default: Groq's limits depend on the
+                 plan and model, and a made-up default would throttle the
+                 summary / quiz / flashcard fan-out for no reason. Without
+                 them, 429s are absorbed by the retries and retry-after pauses.
+  - Retries:     429, 5xx, timeouts and connection errors are retried up to
+                 LLM_MAX_RETRIES times with full-jitter exponential backoff
+                 (at least retry-after when Groq sends one). Other errors
+                 (bad request, auth) are raised at once.
+  - Streaming:   stream_chat_completion yields the answer as it is generated.
+                 Streams are paced by the client reading them, so they hold
+                 one of LLM_MAX_STREAMS separate slots until they end and
+                 never take the slots of other calls. Failures before the
+                 first token are retried like any call.
+  - Metrics:     per-model calls, errors, retries, throttle waits, latency and
+                 time-to-first-token percentiles and token usage, exposed
+                 through GET /metrics.
+
+Environment:
+    GROQ_API_KEY             — required.
+    LLM_MAX_CONCURRENCY      — calls in flight per process (default 8).
+    LLM_MAX_STREAMS          — streamed calls in flight per process, on top (default 8).
+    LLM_REQUESTS_PER_MINUTE  — per model (default 0 = unlimited; set to your Groq plan's limit).
+    LLM_TOKENS_PER_MINUTE    — per model, prompt + completion (default 0 = unlimited).
+    LLM_MAX_RETRIES          — retries after the first attempt (default 3).
+    LLM_TIMEOUT              — seconds per HTTP request (default 60).
+    LLM_QUEUE_TIMEOUT        — seconds a call may wait for a slot / budget (default 120).
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from collections.abc import Callable, Iterator, Sequence
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+
+import groq
+import httpx
+from app.services.tokens import count_tokens_many
+from dotenv import load_dotenv
+
+load_dotenv()
+
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+MAX_STREAMS = int(os.getenv("LLM_MAX_STREAMS", "8"))
+REQUESTS_PER_MINUTE = float(os.getenv("LLM_REQUESTS_PER_MINUTE", "0"))
+TOKENS_PER_MINUTE = float(os.getenv("LLM_TOKENS_PER_MINUTE", "0"))
+MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "3"))
+REQUEST_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "120"))
+
+# Backoff before retry n (0-based): uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**n)) seconds.
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 10.0
+
+# Keep-alive pool shared by all calls of the process.
+CONNECTION_LIMITS = httpx.Limits(
+    max_connections=(MAX_CONCURRENCY + MAX_STREAMS) * 2,
+    max_keepalive_connections=MAX_CONCURRENCY + MAX_STREAMS,
+    keepalive_expiry=30.0,
+)
+
+# Latencies (and stream times-to-first-token) kept per model for the percentiles in /metrics.
+LATENCY_WINDOW = 500
+
+_RETRYABLE = (groq.RateLimitError, groq.InternalServerError, groq.APITimeoutError, groq.APIConnectionError)
+
+
+# ─── THROTTLING ──────────────────────────────────────────────────────────────
+
+class TokenBucket:
+    """Thread-safe token bucket refilled continuously at `per_minute` / 60 per second."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.rate = per_minute / 60.0
+        self._available = per_minute
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float) -> None:
+        self._available = min(self.capacity, self._available + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def acquire(self, amount: float, deadline: float) -> float:
+        """Take `amount` (capped at capacity), waiting as needed. Returns seconds waited."""
+        if self.capacity <= 0:
+            return 0.0
+        amount = min(amount, self.capacity)
+        started = time.monotonic()
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self._paused_until and self._available >= amount:
+                    self._available -= amount
+                    return now - started
+                wait = max(self._paused_until - now, (amount - self._available) / self.rate)
+            if now + wait > deadline:
+                raise TimeoutError("LLM rate limit budget exhausted; try again shortly.")
+            time.sleep(min(wait, 1.0))
+
+    def release(self, amount: float) -> None:
+        """Give back reserved tokens that were not used."""
+        if self.capacity <= 0 or amount <= 0:
+            return
+        with self._lock:
+            self._available = min(self.capacity, self._available + amount)
+
+    def pause(self, seconds: float) -> None:
+        """Hand out nothing for `seconds` (the API asked us to back off)."""
+        with self._lock:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+
+
+class _ModelLimits:
+    def __init__(self):
+        self.requests = TokenBucket(REQUESTS_PER_MINUTE)
+        self.tokens = TokenBucket(TOKENS_PER_MINUTE)
+
+
+_limits: dict[str, _ModelLimits] = {}
+_limits_lock = threading.Lock()
+_slots = threading.BoundedSemaphore(MAX_CONCURRENCY)
+_stream_slots = threading.BoundedSemaphore(MAX_STREAMS)
+
+
+def _model_limits(model: str) -> _ModelLimits:
+    with _limits_lock:
+        if model not in _limits:
+            _limits[model] = _ModelLimits()
+        return _limits[model]
+
+
+# ─── METRICS ─────────────────────────────────────────────────────────────────
+
+class LLMStats:
+    """Thread-safe per-model counters, latencies and token usage."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._models: dict[str, dict] = {}
+        self._latencies: dict[str, deque] = {}
+        self._first_tokens: dict[str, deque] = {}
+        self.in_flight = 0
+
+    def _model(self, model: str) -> dict:
+        if model not in self._models:
+            self._models[model] = {
+                "calls":             0,
+                "streams":           0,
+                "errors":            0,
+                "retries":           0,
+                "throttle_wait_s":   0.0,
+                "prompt_tokens":     0,
+                "completion_tokens": 0,
+            }
+            self._latencies[model] = deque(maxlen=LATENCY_WINDOW)
+            self._first_tokens[model] = deque(maxlen=LATENCY_WINDOW)
+        return self._models[model]
+
+    def started(self) -> None:
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def record_call(self, model: str, latency: float, prompt_tokens: int, completion_tokens: int) -> None:
+        with self._lock:
+            counters = self._model(model)
+            counters["calls"] += 1
+            counters["prompt_tokens"] += prompt_tokens
+            counters["completion_tokens"] += completion_tokens
+            self._latencies[model].append(latency)
+
+    def record_first_token(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._model(model)["streams"] += 1
+            self._first_tokens[model].append(seconds)
+
+    def record_error(self, model: str) -> None:
+        with self._lock:
+            self._model(model)["errors"] += 1
+
+    def record_retry(self, model: str) -> None:
+        with self._lock:
+            self._model(model)["retries"] += 1
+
+    def record_wait(self, model: str, seconds: float) -> None:
+        with self._lock:
+            self._model(model)["throttle_wait_s"] += seconds
+
+    def stats(self) -> dict:
+        with self._lock:
+            models = {}
+            for model, counters in self._models.items():
+                latencies = sorted(self._latencies[model])
+                first_tokens = sorted(self._first_tokens[model])
+                models[model] = {
+                    **counters,
+                    "throttle_wait_s": round(counters["throttle_wait_s"], 3),
+                    "latency_p50_s":   round(latencies[len(latencies) // 2], 3) if latencies else None,
+                    "latency_p95_s":   round(latencies[int(len(latencies) * 0.95)], 3) if latencies else None,
+                    "ttft_p50_s":      round(first_tokens[len(first_tokens) // 2], 3) if first_tokens else None,
+                    "ttft_p95_s":      round(first_tokens[int(len(first_tokens) * 0.95)], 3) if first_tokens else None,
+                }
+            return {
+                "in_flight":       self.in_flight,
+                "max_concurrency": MAX_CONCURRENCY,
+                "max_streams":     MAX_STREAMS,
+                "models":          models,
+            }
+
+
+llm_stats = LLMStats()
+
+
+# ─── CLIENT ──────────────────────────────────────────────────────────────────
+_client: groq.Groq | None = None
+_client_key: str | None = None
+_client_lock = threading.Lock()
+
+
+def get_client() -> groq.Groq:
+    """The process-wide Groq client (rebuilt only if GROQ_API_KEY changes)."""
+    global _client, _client_key
+    api_key = os.getenv("GROQ_API_KEY")
+    if not api_key:
+        raise ValueError("GROQ_API_KEY not set")
+    with _client_lock:
+        if _client is None or _client_key != api_key:
+            _client = groq.Groq(
+                api_key=api_key,
+                max_retries=0,  # retries are ours, so they share the throttle and the metrics
+                timeout=REQUEST_TIMEOUT,
+                http_client=groq.DefaultHttpxClient(limits=CONNECTION_LIMITS),
+            )
+            _client_key = api_key
+        return _client
+
+
+# ─── CALLS ───────────────────────────────────────────────────────────────────
+
+def _retry_after(exc: Exception) -> float | None:
+    """Seconds the API asked us to wait, from a 429 / 503 response's headers."""
+    response = getattr(exc, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+@contextmanager
+def _slot(model: str, slots: threading.BoundedSemaphore = _slots):
+    """Hold one of the places for calls in flight (_slots, or _stream_slots), queueing for it."""
+    if not slots.acquire(timeout=QUEUE_TIMEOUT):
+        llm_stats.record_error(model)
+        raise TimeoutError("Too many LLM calls in flight; try again shortly.")
+    llm_stats.started()
+    try:
+        yield
+    finally:
+        llm_stats.finished()
+        slots.release()
+
+
+def _send(model: str, reserved_tokens: int, deadline: float, request):
+    """
+    Run request(client) under the model's buckets, retrying transient failures.
+    Returns (response, latency of the successful attempt). The caller holds a _slot.
+    """
+    limits = _model_limits(model)
+    client = get_client()
+    for attempt in range(MAX_RETRIES + 1):
+        waited = limits.requests.acquire(1, deadline) + limits.tokens.acquire(reserved_tokens, deadline)
+        if waited:
+            llm_stats.record_wait(model, waited)
+        began = time.monotonic()
+        try:
+            return request(client), time.monotonic() - began
+        except _RETRYABLE as exc:
+            limits.tokens.release(reserved_tokens)  # a failed call uses no quota
+            if attempt == MAX_RETRIES:
+                llm_stats.record_error(model)
+                raise
+            retry_after = _retry_after(exc)
+            if retry_after:
+                limits.requests.pause(retry_after)
+                limits.tokens.pause(retry_after)
+            backoff = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt))
+            delay = max(backoff, retry_after or 0.0)
+            if time.monotonic() + delay > deadline:
+                llm_stats.record_error(model)
+                raise
+            print(f"[LLM] {model} attempt {attempt + 1} failed ({type(exc).__name__}); retrying in {delay:.1f}s")
+            llm_stats.record_retry(model)
+            time.sleep(delay)
+        except Exception:
+            limits.tokens.release(reserved_tokens)
+            llm_stats.record_error(model)
+            raise
+
+
+def _call(model: str, reserved_tokens: int, request):
+    """_send under the concurrency cap. Returns (response, latency of the successful attempt)."""
+    deadline = time.monotonic() + QUEUE_TIMEOUT
+    with _slot(model):
+        return _send(model, reserved_tokens, deadline, request)
+
+
+def _estimate_tokens(messages: list[dict], max_tokens: int) -> int:
+    """Tokens a chat call reserves: its prompt plus the whole completion cap."""
+    return sum(count_tokens_many([m.get("content") or "" for m in messages])) + max_tokens
+
+
+def _settle_usage(model: str, reserved_tokens: int, usage) -> tuple[int, int]:
+    """Refund what a call reserved but did not use. Returns (prompt, completion) tokens."""
+    prompt_tokens = getattr(usage, "prompt_tokens", 0) or 0
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    if usage is not None:
+        _model_limits(model).tokens.release(reserved_tokens - prompt_tokens - completion_tokens)
+    return prompt_tokens, completion_tokens
+
+
+def chat_completion(model: str, messages: list[dict], max_tokens: int, **kwargs):
+    """
+    Chat completion through the gateway (same arguments and response as the Groq SDK's
+    client.chat.completions.create).
+
+    Args:
+        model:      Groq model name.
+        messages:   Chat messages.
+        max_tokens: Completion cap; reserved up front against the token bucket.
+        **kwargs:   Passed through (temperature, response_format, ...).
+    """
+    estimate = _estimate_tokens(messages, max_tokens)
+    response, latency = _call(
+        model,
+        estimate,
+        lambda client: client.chat.completions.create(model=model, messages=messages, max_tokens=max_tokens, **kwargs),
+    )
+
+    prompt_tokens, completion_tokens = _settle_usage(model, estimate, getattr(response, "usage", None))
+    llm_stats.record_call(model, latency, prompt_tokens, completion_tokens)
+    return response
+
+
+def stream_chat_completion(model: str, messages: list[dict], max_tokens: int, **kwargs) -> Iterator[str]:
+    """
+    chat_completion, yielding the completion text piece by piece as Groq generates it.
+
+    The call keeps a stream slot (LLM_MAX_STREAMS) until the stream is exhausted or
+    closed. Opening the stream is retried like any call; a failure after text was
+    yielded is raised to the caller. Time to first token is recorded per model.
+    """
+    estimate = _estimate_tokens(messages, max_tokens)
+    deadline = time.monotonic() + QUEUE_TIMEOUT
+    with _slot(model, _stream_slots):
+        began = time.monotonic()
+        stream, _ = _send(
+            model,
+            estimate,
+            deadline,
+            lambda client: client.chat.completions.create(
+                model=model, messages=messages, max_tokens=max_tokens, stream=True, **kwargs
+            ),
+        )
+        first_token = None
+        usage = None
+        pieces = 0
+        completed = False
+        try:
+            for chunk in stream:
+                # Groq reports the usage of a stream on its last chunk
+                usage = getattr(getattr(chunk, "x_groq", None), "usage", None) or usage
+                text = chunk.choices[0].delta.content if chunk.choices else None
+                if text:
+                    if first_token is None:
+                        first_token = time.monotonic() - began
+                        llm_stats.record_first_token(model, first_token)
+                    pieces += 1
+                    yield text
+            completed = True
+        except Exception:
+            llm_stats.record_error(model)
+            raise
+        finally:
+            # Also runs when the client goes away mid-stream (GeneratorExit)
+            stream.close()
+            if completed:
+                prompt_tokens, completion_tokens = _settle_usage(model, estimate, usage)
+                llm_stats.record_call(model, time.monotonic() - began, prompt_tokens, completion_tokens)
+            else:
+                # No usage report: give back the completion tokens that were never generated
+                # (a streamed piece is about one token)
+                _model_limits(model).tokens.release(max_tokens - pieces)
+
+
+def transcribe(model: str, audio_path: str, **kwargs):
+    """Audio transcription through the gateway; the file is re-read on every attempt."""
+
+    def request(client):
+        with open(audio_path, "rb") as audio_file:
+            return client.audio.transcriptions.create(model=model, file=audio_file, **kwargs)
+
+    response, latency = _call(model, 0, request)
+    llm_stats.record_call(model, latency, 0, 0)
+    return response
+
+
+def run_concurrently(call: Callable, items: Sequence, max_workers: int) -> list:
+    """
+    call(item) for every item, up to max_workers at a time (all calls still share the
+    gateway's concurrency cap and rate limits). Results come back in input order.
+    """
+    if len(items) <= 1 or max_workers <= 1:
+        return [call(item) for item in items]
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        return list(executor.map(call, items))
+
+
+def iter_concurrently(call: Callable, items: Sequence, max_workers: int) -> Iterator[tuple[int, object]]:
+    """
+    run_concurrently, yielding (position in items, result) as each call finishes.
+    Calls not started yet are cancelled when the caller stops iterating early.
+    """
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items))))
+    try:
+        futures = {executor.submit(call, item): position for position, item in enumerate(items)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+"""
+lsa_model.py — CPU-only latent semantic model for dense retrieval.
+
+Text is hashed (no fitted vocabulary), TF-IDF weighted with IDF learned
+offline, then projected to a small dense space with a truncated SVD trained
+offline. The trained weights ship as one .npz file; nothing is fitted at
+upload or request time.
+
+Train (offline, once):
+    python -m app.services.lsa_model train --out data/lsa_model.npz
+    python -m app.services.lsa_model train --corpus-dir ./texts --out data/lsa_model.npz
+
+Environment:
+    LSA_MODEL_PATH — path of the trained model (default: data/lsa_model.npz).
+                     When the file is missing, dense retrieval is disabled.
+"""
+
+import argparse
+import hashlib
+import os
+import sys
+from pathlib import Path
+
+import numpy as np
+from scipy import sparse
+from sklearn.decomposition import TruncatedSVD
+from sklearn.feature_extraction.text import HashingVectorizer, TfidfTransformer
+from sklearn.preprocessing import normalize
+
+DEFAULT_MODEL_PATH = "data/lsa_model.npz"
+
+HASHING_PARAMS: dict = {
+    "n_features":     2 ** 16,
+    "ngram_range":    (1, 2),
+    "stop_words":     "english",
+    "alternate_sign": False,
+    "norm":           None,
+}
+
+DEFAULT_DIMS = 128
+
+_hasher = HashingVectorizer(**HASHING_PARAMS)
+
+
+class LsaModel:
+    """Hashing + TF-IDF + SVD projection loaded from a trained .npz file."""
+
+    def __init__(self, idf: np.ndarray, projection: np.ndarray, fingerprint: str):
+        self.idf = idf.astype(np.float32)
+        # (n_features, dims), C-contiguous so sparse @ dense reads whole rows.
+        self.projection = np.ascontiguousarray(projection, dtype=np.float32)
+        self.fingerprint = fingerprint
+
+    @property
+    def dims(self) -> int:
+        return self.projection.shape[1]
+
+    def embed(self, texts: list[str]) -> np.ndarray:
+        """L2-normalized dense vectors, shape (len(texts), dims), float32."""
+        counts = _hasher.transform(texts).tocsr().astype(np.float32)
+        counts.data = 1.0 + np.log(counts.data)
+        weighted = normalize(counts @ sparse.diags(self.idf))
+        return normalize(np.asarray(weighted @ self.projection, dtype=np.float32))
+
+
+_model: LsaModel | None = None
+_model_loaded = False
+
+
+def get_lsa_model() -> LsaModel | None:
+    """Load the trained model once per process. None if no model file is deployed."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        _model_loaded = True
+        path = Path(os.getenv("LSA_MODEL_PATH", DEFAULT_MODEL_PATH))
+        if path.exists():
+            raw = path.read_bytes()
+            with np.load(path) as data:
+                _model = LsaModel(
+                    idf=data["idf"],
+                    projection=data["projection"],
+                    fingerprint=hashlib.sha1(raw).hexdigest()[:8],
+                )
+    return _model
+
+
+def train_lsa_model(texts: list[str], dims: int = DEFAULT_DIMS) -> tuple[np.ndarray, np.ndarray]:
+    """Fit IDF and the SVD projection on a training corpus. Returns (idf, projection)."""
+    counts = _hasher.transform(texts)
+    transformer = TfidfTransformer(sublinear_tf=True).fit(counts)
+    weighted = transformer.transform(counts)
+
+    svd = TruncatedSVD(n_components=dims, algorithm="randomized", random_state=42)
+    svd.fit(weighted)
+    return transformer.idf_.astype(np.float32), svd.components_.T.astype(np.float16)
+
+
+def _load_training_texts(corpus_dir: str | None, limit: int) -> list[str]:
+    """Chunks from *.txt files in corpus_dir, or from stored content in MongoDB."""
+    if corpus_dir:
+        from app.services.chunker import compute_chunks
+
+        texts: list[str] = []
+        for path in sorted(Path(corpus_dir).rglob("*.txt")):
+            texts.extend(compute_chunks(path.read_text(encoding="utf-8", errors="ignore")))
+            if len(texts) >= limit:
+                break
+        return texts[:limit]
+
+    from app.database.connection import get_database
+    from app.models.blob_storage import stored_document
+    from app.models.content import get_content_chunks
+
+    texts = []
+    projection = {"chunks": 1, "chunk_offsets": 1, "normalized_text": 1}
+    for doc in get_database().content.find({}, projection):
+        texts.extend(get_content_chunks(stored_document(doc)))
+        if len(texts) >= limit:
+            break
+    return texts[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline tools for the LSA dense retrieval model.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    train = sub.add_parser("train", help="Train and save a model file.")
+    train.add_argument("--corpus-dir", help="Directory of .txt files (default: stored content in MongoDB).")
+    train.add_argument("--out", default=DEFAULT_MODEL_PATH)
+    train.add_argument("--dims", type=int, default=DEFAULT_DIMS)
+    train.add_argument("--limit", type=int, default=200_000, help="Maximum training chunks.")
+    args = parser.parse_args()
+
+    texts = _load_training_texts(args.corpus_dir, args.limit)
+    if len(texts) <= args.dims:
+        sys.exit(f"Need more than {args.dims} training chunks, found {len(texts)}.")
+
+    idf, projection = train_lsa_model(texts, args.dims)
+    Path(args.out).parent.mkdir(parents=True, exist_ok=True)
+    with open(args.out, "wb") as f:
+        np.savez(f, idf=idf, projection=projection)
+    print(f"Saved {args.dims}-dim model trained on {len(texts)} chunks to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
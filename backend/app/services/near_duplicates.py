@@ -0,0 +1,103 @@
+"""
+near_duplicates.py — Near-duplicate chunk detection with MinHash + LSH.
+
+Lecture transcripts, captions and slide decks repeat the same passages
+(intros, recaps, repeated slides, page headers). Every repeat would take a
+retrieval slot and LLM tokens, so build_content_chunk_data collapses
+near-identical chunks ONCE at upload, before anything is stored or indexed.
+
+How:
+  - Each chunk becomes the set of its lowercase word 3-grams (shingles).
+  - A MinHash signature of NUM_PERMUTATIONS values estimates Jaccard similarity.
+  - LSH (LSH_BANDS bands of rows) only compares chunks sharing a band bucket,
+    so the pass stays linear in the number of chunks.
+  - A chunk whose estimated similarity to an earlier KEPT chunk reaches
+    NEAR_DUPLICATE_THRESHOLD is dropped and mapped to that chunk.
+
+The first occurrence is always the one kept, and original_to_kept records
+where every original chunk went, so provenance survives the collapse.
+"""
+
+import re
+import zlib
+
+import numpy as np
+
+# ─── PARAMETERS ──────────────────────────────────────────────────────────────
+NEAR_DUPLICATE_THRESHOLD = 0.8   # estimated Jaccard of word 3-grams
+SHINGLE_SIZE = 3                 # words per shingle
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 8                    # 8 bands x 8 rows: candidates from ~0.77 Jaccard up
+_SEED = 20240601
+
+# Identifies the signature function, for signatures reused by chunk hash (chunk_artifacts.py).
+MINHASH_VERSION = f"minhash-1-{NUM_PERMUTATIONS}-{SHINGLE_SIZE}-{_SEED}"
+
+# Universal hashing (a * x + b) mod p over 32-bit shingle hashes; a < 2**32
+# keeps a * x inside uint64.
+_PRIME = np.uint64(4294967311)
+_rng = np.random.default_rng(_SEED)
+_A = _rng.integers(1, 2 ** 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+_B = _rng.integers(0, 2 ** 32, size=NUM_PERMUTATIONS, dtype=np.uint64)
+
+_WORD = re.compile(r"\w+")
+
+
+def _shingles(text: str) -> np.ndarray:
+    """Distinct 32-bit hashes of the chunk's word 3-grams."""
+    words = _WORD.findall(text.lower())
+    if len(words) < SHINGLE_SIZE:
+        grams = [" ".join(words)] if words else [text]
+    else:
+        grams = [" ".join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)]
+    return np.unique(np.fromiter((zlib.crc32(g.encode()) for g in grams), dtype=np.uint64))
+
+
+def minhash_signature(text: str) -> np.ndarray:
+    """NUM_PERMUTATIONS minimum hash values of the text's shingle set."""
+    shingles = _shingles(text)
+    hashed = (_A[:, None] * shingles[None, :]) % _PRIME
+    return ((hashed + _B[:, None]) % _PRIME).min(axis=1)
+
+
+def collapse_near_duplicates(
+    chunks: list[str],
+    signatures: list[np.ndarray] | None = None,
+) -> tuple[list[str], list[int]]:
+    """
+    Drop chunks that are near-duplicates of an earlier chunk.
+
+    Args:
+        chunks:     Chunks in text order.
+        signatures: Precomputed minhash_signature of every chunk, if already known.
+
+    Returns:
+        (kept_chunks, original_to_kept) — original_to_kept[i] is the position in
+        kept_chunks that now stands for original chunk i.
+    """
+    rows = NUM_PERMUTATIONS // LSH_BANDS
+    buckets: list[dict[bytes, list[int]]] = [{} for _ in range(LSH_BANDS)]
+    kept: list[str] = []
+    kept_signatures: list[np.ndarray] = []
+    original_to_kept: list[int] = []
+
+    for position, chunk in enumerate(chunks):
+        signature = signatures[position] if signatures is not None else minhash_signature(chunk)
+        band_keys = [signature[b * rows:(b + 1) * rows].tobytes() for b in range(LSH_BANDS)]
+
+        candidates = {k for band, key in enumerate(band_keys) for k in buckets[band].get(key, ())}
+        match = None
+        for k in sorted(candidates):
+            if np.mean(kept_signatures[k] == signature) >= NEAR_DUPLICATE_THRESHOLD:
+                match = k
+                break
+
+        if match is None:
+            match = len(kept)
+            kept.append(chunk)
+            kept_signatures.append(signature)
+            for band, key in enumerate(band_keys):
+                buckets[band].setdefault(key, []).append(match)
+        original_to_kept.append(match)
+
+    return kept, original_to_kept
@@ -5,8 +5,8 @@ from io import BytesIO
 from pathlib import Path
 
 import requests
+from app.services.llm_gateway import chat_completion
 from dotenv import load_dotenv
-from groq import Groq
 from PIL import Image
 from pptx import Presentation
 from pptx.dml.color import RGBColor
@@ -77,16 +77,36 @@ def clean_json_response(text: str) -> str:
 
     return text
 
-def analyze_content_for_slides(normalized_text: str, slide_count: int = 10) -> dict:
-    """Use Groq to structure content into slides with visual suggestions."""
+# Characters of source text the slide prompt carries for long content.
+SLIDE_SAMPLE_CHARS = 10400
+
+def _sample_sections(normalized_text: str, sections: list[dict]) -> str:
+    """The opening of every section under its title, sharing SLIDE_SAMPLE_CHARS."""
+    per_section = SLIDE_SAMPLE_CHARS // len(sections)
+    parts = []
+    for section in sections:
+        body = normalized_text[section["char_start"]:section["char_end"]]
+        parts.append(f"## {section['title']}\n{body[:per_section]}")
+    return "\n\n".join(parts)
+
+def analyze_content_for_slides(
+    normalized_text: str,
+    slide_count: int = 10,
+    sections: list[dict] | None = None,
+) -> dict:
+    """
+    Use Groq to structure content into slides with visual suggestions.
+    Long content with a section index (sections.py) is sampled section by section;
+    without one, fixed windows across the text are used.
+    """
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise ValueError("GROQ_API_KEY not set")
 
-    client = Groq(api_key=api_key)
-
     # Smart content extraction - preserve richer context for deeper slides
-    if len(normalized_text) > 9000:
+    if len(normalized_text) > 9000 and sections and len(sections) > 1:
+        text_sample = _sample_sections(normalized_text, sections)
+    elif len(normalized_text) > 9000:
         beginning = normalized_text[:2200]
         quarter_start = max(0, len(normalized_text) // 4 - 1000)
         quarter = normalized_text[quarter_start:quarter_start + 2000]
@@ -179,7 +199,7 @@ Return ONLY valid JSON:
 }}"""
 
     try:
-        response = client.chat.completions.create(
+        response = chat_completion(
             model="llama-3.3-70b-versatile",
             messages=[
                 {"role": "system", "content": "You output only raw JSON. No preamble, no explanation, no markdown, no text before or after the JSON object."},
@@ -227,7 +247,7 @@ Create {slide_count} slides with STRICT design rules:
 
 Return ONLY valid JSON using the same schema as before."""
 
-                    response = client.chat.completions.create(
+                    response = chat_completion(
                         model="llama-3.3-70b-versatile",
                         messages=[
                             {"role": "system", "content": "You output only raw JSON. No preamble, no explanation, no markdown, no text before or after the JSON object."},
@@ -641,12 +661,16 @@ def generate_presentation(
     normalized_text: str,
     slide_count: int = 10,
     theme: str = "modern",
-    include_images: bool = True
+    include_images: bool = True,
+    sections: list[dict] | None = None,
 ) -> str:
-    """Generate complete presentation and return file path."""
+    """
+    Generate complete presentation and return file path.
+    sections: the content's section index, used to sample long content by section.
+    """
 
     # Analyze content and create slide structure
-    structure = analyze_content_for_slides(normalized_text, slide_count)
+    structure = analyze_content_for_slides(normalized_text, slide_count, sections)
 
     # Get theme
     theme_config = THEMES.get(theme, THEMES["modern"])
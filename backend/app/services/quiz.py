@@ -1,18 +1,67 @@
 """
 quiz.py — Quiz generation service.
 
-Supports pre-stored chunks (MongoDB content['chunks']) and raw normalized_text fallback.
+Reads the content's stored chunks; raw text passed in directly is chunked the same way.
+
+Questions are generated by several concurrent calls, each over its own share of
+the relevant chunks, asking for a few more questions than requested in total
+(QUIZ_OVERPROVISION). Malformed questions are dropped and near-duplicates removed
+(cosine of hashed question vectors); if the quiz is still short, top-up calls ask
+for exactly the missing count, listing the questions already kept. The quiz takes
+about as long as one call, plus one more only when a top-up is needed.
 """
 
 import json
+import math
 import os
-
-from app.services.chunker import get_chunks_for_feature
+from collections.abc import Sequence
+
+import numpy as np
+from app.services.chunker import (
+    RETRIEVAL_QUERIES,
+    TOP_K_CONFIG,
+    compute_chunks,
+    get_chunk_indices_for_feature,
+    get_token_counts,
+)
+from app.services.context_compression import compress_context, packing_budget
+from app.services.generation_cache import prompt_version
+from app.services.llm_gateway import chat_completion, run_concurrently
+from app.services.retrievers import hash_texts
+from app.services.tokens import pack_texts, prompt_budget, truncate_to_tokens
 from dotenv import load_dotenv
-from groq import Groq
 
 load_dotenv()
 
+QUIZ_MODEL = "llama-3.1-8b-instant"
+QUIZ_SYSTEM_PROMPT = "You output only raw JSON. No preamble, no explanation, no markdown."
+QUIZ_PROMPT = """Create EXACTLY {num} MCQs. Difficulty: {difficulty_level}.
+
+{content}
+
+Add a brief, clear explanation for each correct answer. Return ONLY JSON:
+{{"quiz": [{{"id": 1, "question": "...", "options": {{"A": "...", "B": "...", "C": "...", "D": "..."}}, "correct_answer": "A", "explanation": "..."}}]}}"""
+
+# Completion tokens reserved per requested question (JSON question, 4 options, explanation).
+QUIZ_TOKENS_PER_QUESTION = 160
+QUIZ_MAX_TOKENS = 2400   # per call; more questions are spread over more calls
+MAX_QUIZ_CALLS = 8
+QUIZ_QUESTIONS_PER_CALL = 5   # smaller calls finish sooner; they all run at once
+QUIZ_OVERPROVISION = 1.2      # questions asked for per question requested
+QUIZ_DUPLICATE_SIMILARITY = 0.8
+QUIZ_TOPUP_ROUNDS = 2
+QUIZ_TOPUP_AVOID_TOKENS = 600  # existing questions listed in a top-up prompt
+QUIZ_TOPUP_SUFFIX = """
+
+These questions already exist. Do NOT repeat or rephrase them; ask about other facts:
+{existing}"""
+
+# Cache key part of generated quizzes (generation_cache).
+QUIZ_PROMPT_VERSION = prompt_version(
+    "quiz", 1, QUIZ_SYSTEM_PROMPT, QUIZ_PROMPT, QUIZ_TOPUP_SUFFIX, QUIZ_TOKENS_PER_QUESTION,
+    QUIZ_QUESTIONS_PER_CALL, QUIZ_OVERPROVISION, QUIZ_DUPLICATE_SIMILARITY, QUIZ_TOPUP_ROUNDS,
+)
+
 
 def clean_json_response(text: str) -> str:
     """Extract JSON object from markdown code blocks."""
@@ -49,75 +98,142 @@ def generate_quiz(
     max_questions: int = 10,
     difficulty_level: str = "Medium",
     quiz_mode: str = "Practice",
-    stored_chunks: list[str] | None = None,
-    normalized_text: str | None = None,
+    stored_chunks: Sequence[str] | None = None,
+    retrieval_index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
 ) -> dict:
     """
     Generate MCQ quiz questions from stored_chunks or raw text.
 
     Args:
-        text_input: Positional fallback parameter.
+        text_input: Raw text, used only when there are no stored chunks.
         max_questions: Total questions requested.
         difficulty_level: Easy | Medium | Hard
         quiz_mode: Practice | Exam
         stored_chunks: Pre-computed chunks list from MongoDB.
-        normalized_text: Raw text fallback.
+        retrieval_index: Stored retrieval index; supplies the precomputed ranking for stored_chunks.
+        chunk_range: [start, end) of stored_chunks to read, e.g. one section; None for all.
     """
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise ValueError("GROQ_API_KEY not set")
 
-    client = Groq(api_key=api_key)
-
-    content_raw = text_input or normalized_text or ""
-    if stored_chunks and isinstance(stored_chunks, list) and len(stored_chunks) > 0:
-        chunks = stored_chunks
-    elif content_raw:
-        chunks = get_chunks_for_feature(content_raw, "quiz")
-    else:
+    # Stored content always has chunks (legacy documents are backfilled: worker/backfill.py)
+    if not stored_chunks and text_input:
+        stored_chunks = compute_chunks(text_input)
+    if not stored_chunks:
         return {"quiz": [], "error": "No content available"}
 
-    chunks_to_use = min(len(chunks), 4)
-    questions_per_chunk = max(2, max_questions // chunks_to_use)
-
-    all_questions: list[dict] = []
-
-    for i in range(chunks_to_use):
-        if len(all_questions) >= max_questions:
+    # Over-provisioned questions, spread over concurrent calls
+    per_call_cap = QUIZ_MAX_TOKENS // QUIZ_TOKENS_PER_QUESTION
+    wanted = math.ceil(max_questions * QUIZ_OVERPROVISION)
+    calls = min(MAX_QUIZ_CALLS, max(1, math.ceil(wanted / QUIZ_QUESTIONS_PER_CALL)))
+    per_call = min(per_call_cap, math.ceil(wanted / calls))
+
+    # Each call reads its own share of the relevant chunks (round-robin by rank), so the
+    # calls ask about different material; only sentences matching the hint query are sent
+    budget = prompt_budget(
+        QUIZ_MODEL,
+        QUIZ_MAX_TOKENS,
+        QUIZ_SYSTEM_PROMPT,
+        QUIZ_PROMPT.format(num=per_call_cap, difficulty_level=difficulty_level, content=""),
+    ) - QUIZ_TOPUP_AVOID_TOKENS
+    indices = get_chunk_indices_for_feature(
+        stored_chunks, "quiz", None, retrieval_index, chunk_range, top_k=max(TOP_K_CONFIG["quiz"], 2 * calls)
+    )
+    if not indices:
+        # e.g. a section range left stale by a re-chunk
+        return {"quiz": [], "error": "No content available"}
+    token_counts = get_token_counts(retrieval_index, stored_chunks)
+    contexts = []
+    for call in range(calls):
+        share = sorted(indices[call::calls]) or [indices[call % len(indices)]]
+        packed = pack_texts(
+            [stored_chunks[i] for i in share], [int(token_counts[i]) for i in share], packing_budget("quiz", budget)
+        )
+        contexts.append(compress_context(packed[0], "quiz", RETRIEVAL_QUERIES["quiz"], budget=budget))
+
+    batches = run_concurrently(
+        lambda context: _request_questions(context, per_call, difficulty_level),
+        contexts,
+        MAX_QUIZ_CALLS,
+    )
+    all_questions = _dedupe_questions([q for batch in batches if batch for q in batch])
+
+    # Top-up: exactly the missing count, from the shares whose calls failed first
+    order = sorted(range(calls), key=lambda i: bool(batches[i]))
+    for _ in range(QUIZ_TOPUP_ROUNDS):
+        missing = max_questions - len(all_questions)
+        if missing <= 0:
             break
-
-        needed = max_questions - len(all_questions)
-        num = min(questions_per_chunk, needed)
-
-        prompt = f"""Create EXACTLY {num} MCQs. Difficulty: {difficulty_level}.
-
-{chunks[i]}
-
-Add a brief, clear explanation for each correct answer. Return ONLY JSON:
-{{"quiz": [{{"id": 1, "question": "...", "options": {{"A": "...", "B": "...", "C": "...", "D": "..."}}, "correct_answer": "A", "explanation": "..."}}]}}"""
-
-        try:
-            response = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": "You output only raw JSON. No preamble, no explanation, no markdown."},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.7,
-                max_tokens=600,
-            )
-            raw = response.choices[0].message.content
-            if raw and raw.strip():
-                cleaned = clean_json_response(raw)
-                chunk_data = json.loads(cleaned)
-                questions = chunk_data.get("quiz", [])
-                all_questions.extend(questions[:num])
-        except Exception as exc:
-            print(f"[QUIZ] Chunk {i} error: {exc}")
-            continue
+        topup_calls = min(MAX_QUIZ_CALLS, math.ceil(missing / QUIZ_QUESTIONS_PER_CALL))
+        counts = [missing // topup_calls + (1 if i < missing % topup_calls else 0) for i in range(topup_calls)]
+        existing = truncate_to_tokens(
+            "\n".join(f"- {q['question']}" for q in all_questions), QUIZ_TOPUP_AVOID_TOKENS
+        )
+        print(f"[QUIZ] Top-up for {missing} missing question(s)")
+        topups = run_concurrently(
+            lambda job: _request_questions(job[0], job[1], difficulty_level, existing),
+            [(contexts[order[i % calls]], count) for i, count in enumerate(counts)],
+            MAX_QUIZ_CALLS,
+        )
+        all_questions = _dedupe_questions(all_questions + [q for batch in topups if batch for q in batch])
 
     all_questions = all_questions[:max_questions]
     for idx, q in enumerate(all_questions, 1):
         q["id"] = idx
 
     return {"quiz": all_questions}
+
+
+def _is_valid_question(question) -> bool:
+    """A question with text, at least two options and a correct answer among them."""
+    if not isinstance(question, dict):
+        return False
+    text, options = question.get("question"), question.get("options")
+    return (
+        isinstance(text, str)
+        and bool(text.strip())
+        and isinstance(options, dict)
+        and len(options) >= 2
+        and question.get("correct_answer") in options
+    )
+
+
+def _request_questions(content: str, num: int, difficulty_level: str, existing: str | None = None) -> list[dict] | None:
+    """One generation call for `num` questions; None when it fails or returns no usable question."""
+    prompt = QUIZ_PROMPT.format(num=num, difficulty_level=difficulty_level, content=content)
+    if existing:
+        prompt += QUIZ_TOPUP_SUFFIX.format(existing=existing)
+    try:
+        response = chat_completion(
+            model=QUIZ_MODEL,
+            messages=[
+                {"role": "system", "content": QUIZ_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.7,
+            max_tokens=min(QUIZ_MAX_TOKENS, num * QUIZ_TOKENS_PER_QUESTION + 100),
+        )
+        raw = response.choices[0].message.content
+        if not raw or not raw.strip():
+            return None
+        questions = json.loads(clean_json_response(raw)).get("quiz", [])
+        valid = [q for q in questions if _is_valid_question(q)][:num]
+        return valid or None
+    except Exception as exc:
+        print(f"[QUIZ] Generation error: {exc}")
+        return None
+
+
+def _dedupe_questions(questions: list[dict]) -> list[dict]:
+    """Drop questions whose text is near-identical (hashed cosine) to an earlier one."""
+    if len(questions) < 2:
+        return questions
+    vectors = hash_texts([q["question"] for q in questions])
+    similarities = (vectors @ vectors.T).toarray()
+    # A question is kept unless it is too similar to an earlier question that was itself kept
+    keep = np.ones(len(questions), dtype=bool)
+    for i in range(1, len(questions)):
+        keep[i] = not (similarities[i, :i][keep[:i]] >= QUIZ_DUPLICATE_SIMILARITY).any()
+    return [q for q, kept in zip(questions, keep) if kept]
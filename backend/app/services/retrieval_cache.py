@@ -0,0 +1,130 @@
+"""
+retrieval_cache.py — In-process LRU cache in front of chunk retrieval.
+
+Chat users re-ask near-identical questions, and the static features always
+use the same hint queries, so get_chunks_for_feature (chunker.py) looks
+results up here before scoring anything.
+
+Keys are (content fingerprint, feature, backend, normalized query, top_k).
+The fingerprint is a hash of the stored chunks, so re-chunked content gets new
+keys and can never be served stale results. Entries are also dropped
+explicitly when content is renamed, deleted or re-chunked (invalidate), and
+evicted by size (LRU) and age (TTL).
+
+The cache is per process; counters are exposed through GET /metrics.
+
+Environment:
+    RETRIEVAL_CACHE_SIZE — maximum entries (default 4096, 0 disables the cache).
+    RETRIEVAL_CACHE_TTL  — seconds an entry stays valid (default 600).
+"""
+
+import hashlib
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+DEFAULT_CACHE_SIZE = 4096
+DEFAULT_CACHE_TTL = 600
+
+# All retrieval backends tokenize lowercased \w runs, so queries that differ
+# only in case, punctuation or spacing score identically and share an entry.
+_QUERY_TOKEN = re.compile(r"\w+")
+
+
+def content_fingerprint(chunks: list[str]) -> str:
+    """Stable hash of a content's stored chunks (and their boundaries)."""
+    digest = hashlib.sha256()
+    for chunk in chunks:
+        digest.update(chunk.encode("utf-8"))
+        digest.update(b"\x00")
+    return digest.hexdigest()
+
+
+def normalize_query(query: str | None) -> str:
+    return " ".join(_QUERY_TOKEN.findall((query or "").lower()))
+
+
+class RetrievalCache:
+    """Thread-safe LRU cache with a TTL, storing ranked chunk indices."""
+
+    def __init__(self, max_entries: int, ttl_seconds: float):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[tuple, tuple[float, list[int]]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key: tuple) -> list[int] | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, indices = entry
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return indices
+
+    def put(self, key: tuple, indices: list[int]) -> None:
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), indices)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, fingerprint: str) -> int:
+        """Drop every entry for one content fingerprint. Returns how many were dropped."""
+        with self._lock:
+            stale = [key for key in self._entries if key[0] == fingerprint]
+            for key in stale:
+                del self._entries[key]
+            self.invalidations += len(stale)
+            return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries":       len(self._entries),
+                "max_entries":   self.max_entries,
+                "ttl_seconds":   self.ttl_seconds,
+                "hits":          self.hits,
+                "misses":        self.misses,
+                "hit_rate":      round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions":     self.evictions,
+                "expirations":   self.expirations,
+                "invalidations": self.invalidations,
+            }
+
+
+retrieval_cache = RetrievalCache(
+    max_entries=int(os.getenv("RETRIEVAL_CACHE_SIZE", DEFAULT_CACHE_SIZE)),
+    ttl_seconds=float(os.getenv("RETRIEVAL_CACHE_TTL", DEFAULT_CACHE_TTL)),
+)
+
+
+def invalidate_content(content: dict | None) -> None:
+    """Drop cached retrieval results for a content document (rename, delete, re-chunk)."""
+    fingerprint = ((content or {}).get("chunk_metadata") or {}).get("content_hash")
+    if not fingerprint and (content or {}).get("chunks"):
+        fingerprint = content_fingerprint(content["chunks"])
+    if fingerprint:
+        retrieval_cache.invalidate(fingerprint)
@@ -0,0 +1,366 @@
+"""
+retrievers.py — Pluggable retrieval backends behind one Retriever interface.
+
+Each backend builds a compact, BSON-friendly index section ONCE at upload
+(stored under its name in the content's retrieval index) and scores queries
+against that section at runtime without refitting anything.
+
+Backends:
+  - bm25:  inverted index with postings in flat arrays (term hashes, pointers,
+           doc ids, term frequencies). A query only touches its own postings.
+  - dense: int8-quantized LSA chunk vectors (lsa_model.py, trained offline).
+           A query is embedded and scored with one matmul. Disabled when no
+           model file is deployed.
+  - hashed: sublinear-TF vectors in a fixed hashed feature space; query and
+           chunk vectors are weighted by corpus-wide IDF (global_idf.py) at
+           scoring time, so nothing is fitted per content and stored rows never
+           depend on the statistics. Scores are comparable ACROSS contents, which
+           library-wide search relies on. Stored as term counts with
+           gap-encoded column indices (utils/sparse_codec.py).
+
+Backends whose section is one independent row per chunk (dense, hashed) also
+expose encode_chunks / build_from_rows, so rows can be reused by chunk hash
+(chunk_artifacts.py) instead of being recomputed.
+
+chunker.py owns which backend each feature uses (RETRIEVER_CONFIG).
+This module must NOT import from chunker.py.
+"""
+
+import hashlib
+import json
+from collections import Counter
+from typing import Protocol
+
+import numpy as np
+from app.services.global_idf import get_global_idf
+from app.services.lsa_model import get_lsa_model
+from app.utils.sparse_codec import pack_row_indices, unpack_row_indices
+from scipy import sparse
+from sklearn.feature_extraction.text import CountVectorizer, HashingVectorizer
+from sklearn.preprocessing import normalize
+
+
+def _params_version(prefix: str, params: dict) -> str:
+    """Version string that changes whenever the backend parameters change."""
+    digest = hashlib.sha1(json.dumps(params, sort_keys=True).encode()).hexdigest()[:8]
+    return f"{prefix}-{digest}"
+
+
+class Retriever(Protocol):
+    """Interface every retrieval backend implements."""
+
+    name: str
+    version: str
+
+    def build(self, chunks: list[str]) -> dict | None:
+        """Build the serialized index section for these chunks, or None if unusable."""
+        ...
+
+    def score(self, section: dict, queries: list[str]) -> np.ndarray:
+        """Relevance of every chunk for every query, shape (len(queries), n_chunks)."""
+        ...
+
+
+# ─── BM25 ────────────────────────────────────────────────────────────────────
+
+BM25_PARAMS: dict = {
+    "k1":         1.5,
+    "b":          0.75,
+    "stop_words": "english",
+}
+
+# Same tokenization as the hashed unigrams: lowercase, 2+ word chars, no stop words.
+_bm25_analyzer = CountVectorizer(stop_words=BM25_PARAMS["stop_words"]).build_analyzer()
+
+
+def _term_hash(term: str) -> int:
+    """Stable 64-bit term id. Stored sorted, so lookups need no vocabulary dict."""
+    return int.from_bytes(hashlib.blake2b(term.encode(), digest_size=8).digest(), "little")
+
+
+class Bm25Retriever:
+    """
+    Okapi BM25 over a compact inverted index.
+
+    Postings are stored as flat arrays sorted by term hash:
+        terms[t]                    — 64-bit hash of the t-th term
+        docs[ptr[t]:ptr[t + 1]]     — chunks containing term t
+        tf[ptr[t]:ptr[t + 1]]       — its frequency in each of those chunks
+    A query hashes its terms, binary-searches `terms` and reads only those slices.
+    """
+
+    name = "bm25"
+    version = _params_version("bm25-1", BM25_PARAMS)
+
+    def build(self, chunks: list[str]) -> dict | None:
+        hashes: list[int] = []
+        docs: list[int] = []
+        freqs: list[int] = []
+        doc_len = np.zeros(len(chunks), dtype=np.int32)
+
+        for doc_id, chunk in enumerate(chunks):
+            counts = Counter(_bm25_analyzer(chunk))
+            doc_len[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                hashes.append(_term_hash(term))
+                docs.append(doc_id)
+                freqs.append(tf)
+
+        if not hashes:
+            return None
+
+        hash_arr = np.array(hashes, dtype=np.uint64)
+        doc_arr = np.array(docs, dtype=np.int32)
+        order = np.lexsort((doc_arr, hash_arr))
+        hash_arr, doc_arr = hash_arr[order], doc_arr[order]
+        tf_arr = np.minimum(np.array(freqs, dtype=np.int64)[order], np.iinfo(np.uint16).max)
+
+        terms, starts = np.unique(hash_arr, return_index=True)
+        ptr = np.append(starts, len(hash_arr)).astype(np.int32)
+
+        return {
+            "version": self.version,
+            "terms":   terms.tobytes(),
+            "ptr":     ptr.tobytes(),
+            "docs":    doc_arr.tobytes(),
+            "tf":      tf_arr.astype(np.uint16).tobytes(),
+            "doc_len": doc_len.tobytes(),
+            "avgdl":   float(doc_len.mean()) or 1.0,
+        }
+
+    def score(self, section: dict, queries: list[str]) -> np.ndarray:
+        terms = np.frombuffer(section["terms"], dtype=np.uint64)
+        ptr = np.frombuffer(section["ptr"], dtype=np.int32)
+        docs = np.frombuffer(section["docs"], dtype=np.int32)
+        tf = np.frombuffer(section["tf"], dtype=np.uint16)
+        doc_len = np.frombuffer(section["doc_len"], dtype=np.int32)
+
+        k1, b = BM25_PARAMS["k1"], BM25_PARAMS["b"]
+        n_docs = len(doc_len)
+        scores = np.zeros((len(queries), n_docs), dtype=np.float32)
+
+        for row, query in enumerate(queries):
+            query_hashes = np.array(
+                sorted({_term_hash(term) for term in _bm25_analyzer(query)}),
+                dtype=np.uint64,
+            )
+            if not len(query_hashes):
+                continue
+            positions = np.searchsorted(terms, query_hashes)
+            positions = positions[positions < len(terms)]
+            positions = positions[np.isin(terms[positions], query_hashes)]
+
+            for t in positions:
+                start, end = ptr[t], ptr[t + 1]
+                hit_docs = docs[start:end]
+                hit_tf = tf[start:end].astype(np.float32)
+                idf = np.log1p((n_docs - (end - start) + 0.5) / ((end - start) + 0.5))
+                norm = k1 * (1.0 - b + b * doc_len[hit_docs] / section["avgdl"])
+                scores[row, hit_docs] += idf * hit_tf * (k1 + 1.0) / (hit_tf + norm)
+
+        return scores
+
+
+# ─── DENSE (LSA) ─────────────────────────────────────────────────────────────
+
+# Unit vectors are stored as round(v * 127) in int8: 4x smaller than float32,
+# and cosine error stays well below what changes a top-k ranking.
+_INT8_SCALE = 127.0
+
+
+class DenseRetriever:
+    """Cosine similarity between LSA embeddings of the query and int8 chunk vectors."""
+
+    name = "dense"
+
+    def __init__(self):
+        model = get_lsa_model()
+        self.version = f"lsa-1-{model.fingerprint}" if model else "lsa-1-none"
+
+    def build(self, chunks: list[str]) -> dict | None:
+        if get_lsa_model() is None:
+            return None
+        return self.build_from_rows(self.encode_chunks(chunks))
+
+    def encode_chunks(self, chunks: list[str]) -> list[bytes]:
+        """One int8 vector per chunk, as bytes."""
+        model = get_lsa_model()
+        if model is None or not chunks:
+            return [b"" for _ in chunks]
+        quantized = np.round(model.embed(chunks) * _INT8_SCALE).astype(np.int8)
+        return [row.tobytes() for row in quantized]
+
+    def build_from_rows(self, rows: list[bytes]) -> dict | None:
+        model = get_lsa_model()
+        if model is None or any(len(row) != model.dims for row in rows):
+            return None
+        return {
+            "version": self.version,
+            "dims":    model.dims,
+            "vectors": b"".join(rows),
+        }
+
+    def score(self, section: dict, queries: list[str]) -> np.ndarray:
+        vectors = np.frombuffer(section["vectors"], dtype=np.int8).reshape(-1, section["dims"])
+        model = get_lsa_model()
+        if model is None or model.dims != section["dims"]:
+            return np.zeros((len(queries), len(vectors)), dtype=np.float32)
+
+        query_vectors = model.embed(queries)
+        return (query_vectors @ vectors.T.astype(np.float32)) / _INT8_SCALE
+
+
+# ─── HASHED (cross-content) ──────────────────────────────────────────────────
+
+HASHED_PARAMS: dict = {
+    "n_features":     2 ** 18,
+    "ngram_range":    (1, 2),
+    "stop_words":     "english",
+    "alternate_sign": False,
+    "norm":           None,
+}
+
+# The feature space the term statistics (models/term_stats.py) are counted in. The
+# section format is versioned on top of it, so a new format keeps the statistics.
+HASHED_SPACE_VERSION = _params_version("hashed-1", HASHED_PARAMS)
+
+_hashed_vectorizer = HashingVectorizer(**HASHED_PARAMS)
+
+
+def _hash_counts(texts: list[str]) -> sparse.csr_matrix:
+    """Term counts in the shared hashed feature space, column indices sorted per row."""
+    counts = _hashed_vectorizer.transform(texts).tocsr().astype(np.float32)
+    counts.sort_indices()
+    return counts
+
+
+def hash_texts(texts: list[str]) -> sparse.csr_matrix:
+    """L2-normalized sublinear-TF vectors in the shared hashed feature space."""
+    counts = _hash_counts(texts)
+    counts.data = 1.0 + np.log(counts.data)
+    return normalize(counts)
+
+
+def weight_queries(queries: list[str], idf: np.ndarray | None) -> sparse.csr_matrix:
+    """
+    Hashed query vectors weighted by IDF (global_idf.py) and re-normalized; plain
+    hash_texts when idf is None. score_hashed weights the chunk side as well.
+    """
+    matrix = hash_texts(queries)
+    if idf is None or not matrix.nnz:
+        return matrix
+    data = matrix.data * idf[matrix.indices]
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    norms = np.sqrt(np.bincount(rows, weights=data * data, minlength=matrix.shape[0]))
+    matrix.data = (data / norms[rows]).astype(np.float32)
+    return matrix
+
+
+def hashed_row_norms(matrix: sparse.csr_matrix, idf: np.ndarray | None) -> np.ndarray:
+    """L2 norm of every IDF-weighted row (1 for empty rows), as one sparse mat-vec."""
+    weights = idf.astype(np.float32) ** 2 if idf is not None else np.ones(matrix.shape[1], dtype=np.float32)
+    squares = sparse.csr_matrix((matrix.data ** 2, matrix.indices, matrix.indptr), shape=matrix.shape)
+    norms = np.sqrt(squares @ weights)
+    norms[norms == 0] = 1.0
+    return norms
+
+
+def score_hashed(
+    matrix: sparse.csr_matrix,
+    queries: list[str],
+    idf: np.ndarray | None,
+    norms: np.ndarray | None = None,
+) -> np.ndarray:
+    """
+    Cosine of IDF-weighted query vectors and IDF-weighted rows of `matrix` (sublinear-TF
+    rows at any scale), shape (len(queries), n_rows).
+
+    The rows are never reweighted: (row * idf) . q == row . (q * idf), and dividing by
+    the weighted row norms (hashed_row_norms; pass them in when cached) is one mat-vec.
+    Multiplying the CSR matrix (not its transpose) avoids converting it.
+    """
+    query_matrix = weight_queries(queries, idf)
+    if idf is not None:
+        query_matrix.data *= idf[query_matrix.indices]
+    if norms is None:
+        norms = hashed_row_norms(matrix, idf)
+    return (matrix @ query_matrix.T).toarray().T / norms
+
+
+def score_texts(chunks: list[str], queries: list[str]) -> np.ndarray:
+    """
+    IDF-weighted hashed scores of every query against chunks that have no stored
+    index, shape (len(queries), len(chunks)). Nothing is fitted.
+    """
+    return score_hashed(hash_texts(chunks), queries, get_global_idf())
+
+
+def _load_sublinear(section: dict) -> sparse.csr_matrix:
+    """Sublinear-TF chunk rows (1 + ln tf) of a stored hashed section, not yet normalized."""
+    indptr = np.frombuffer(section["indptr"], dtype=np.int32)
+    return sparse.csr_matrix(
+        (
+            1.0 + np.log(np.frombuffer(section["tf"], dtype=np.uint16).astype(np.float32)),
+            unpack_row_indices(section["indices"], indptr),
+            indptr,
+        ),
+        shape=(len(indptr) - 1, HASHED_PARAMS["n_features"]),
+    )
+
+
+def load_hashed_matrix(section: dict) -> sparse.csr_matrix:
+    """Deserialize the chunk matrix of a stored hashed section (unit sublinear-TF rows)."""
+    return normalize(_load_sublinear(section))
+
+
+class HashedRetriever:
+    """
+    Similarity between IDF-weighted queries and IDF-weighted chunk vectors in a fixed
+    hashed feature space — nothing fitted per content, and IDF updates never invalidate rows.
+    """
+
+    name = "hashed"
+    version = _params_version("hashed-2", HASHED_PARAMS)
+
+    def build(self, chunks: list[str]) -> dict | None:
+        return self.build_from_rows(self.encode_chunks(chunks))
+
+    def encode_chunks(self, chunks: list[str]) -> list[bytes]:
+        """One sparse row per chunk: sorted int32 column indices followed by uint16 term counts."""
+        if not chunks:
+            return []
+        counts = _hash_counts(chunks)
+        tf = np.minimum(counts.data, np.iinfo(np.uint16).max).astype(np.uint16)
+        rows = []
+        for i in range(counts.shape[0]):
+            start, end = counts.indptr[i], counts.indptr[i + 1]
+            rows.append(counts.indices[start:end].astype(np.int32).tobytes() + tf[start:end].tobytes())
+        return rows
+
+    def build_from_rows(self, rows: list[bytes]) -> dict | None:
+        nnz = np.array([len(row) // 6 for row in rows], dtype=np.int64)
+        if not nnz.sum():
+            return None
+
+        indptr = np.concatenate([[0], np.cumsum(nnz)]).astype(np.int32)
+        indices = np.frombuffer(b"".join(row[:4 * n] for row, n in zip(rows, nnz)), dtype=np.int32)
+        tf = b"".join(row[4 * n:] for row, n in zip(rows, nnz))
+        return {
+            "version": self.version,
+            "space":   HASHED_SPACE_VERSION,
+            "indices": pack_row_indices(indices, indptr),
+            "tf":      tf,
+            "indptr":  indptr.tobytes(),
+        }
+
+    def score(self, section: dict, queries: list[str]) -> np.ndarray:
+        return score_hashed(_load_sublinear(section), queries, get_global_idf())
+
+
+# ─── REGISTRY ────────────────────────────────────────────────────────────────
+
+RETRIEVERS: dict[str, Retriever] = {
+    Bm25Retriever.name:   Bm25Retriever(),
+    DenseRetriever.name:  DenseRetriever(),
+    HashedRetriever.name: HashedRetriever(),
+}
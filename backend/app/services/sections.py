@@ -0,0 +1,234 @@
+"""
+sections.py — Section / chapter index over a content's stored chunks.
+
+Built once at ingest (content_metadata.build_content_chunk_data) and stored in
+chunk_metadata["sections"]: one entry per section with its title and the
+[start, end) range of stored chunks it covers, plus the matching character
+range of normalized_text. Features asked for one section only read that range.
+
+Where the boundaries come from, first that applies:
+  - "outline":  PDF outline (bookmarks), each entry at the start of its page,
+  - "headings": Word paragraphs styled Title / Heading n,
+  - "topics":   topic shifts between adjacent chunks (TextTiling) — transcripts,
+                plain text, and documents without structure.
+"""
+
+import bisect
+import re
+
+import numpy as np
+from app.services.retrievers import hash_texts, load_hashed_matrix
+from scipy import sparse
+
+# ─── PARAMETERS ──────────────────────────────────────────────────────────────
+MAX_SECTIONS = 40
+MAX_TITLE_CHARS = 80
+
+# Topic shifts: similarity of TOPIC_WINDOW chunks either side of every gap; a gap
+# is a boundary when its depth (drop below the neighbouring peaks) is above
+# mean + std / 2 of all depths. Sections hold at least TOPIC_MIN_CHUNKS chunks.
+TOPIC_WINDOW = 3
+TOPIC_MIN_CHUNKS = 4
+
+# Text before the first heading becomes its own section when it spans a whole chunk.
+FRONT_MATTER_TITLE = "Front matter"
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?])\s+')
+
+
+# ─── BUILD — called ONCE at ingest ───────────────────────────────────────────
+
+def _chunk_starts(text: str, chunks: list[str]) -> list[int]:
+    """Character offset of every chunk in text (chunks are in text order)."""
+    starts = []
+    cursor = 0
+    for chunk in chunks:
+        start = text.find(chunk[:64], cursor) if chunk else -1
+        if start < 0:
+            start = cursor
+        starts.append(start)
+        cursor = start
+    return starts
+
+
+def _title_from_chunk(text: str, start: int, chunk: str) -> str:
+    """First sentence starting in a chunk (chunk at `start` in text), shortened to a section title."""
+    sentences = _SENTENCE_BOUNDARY.split(chunk.strip())
+    mid_sentence = start > 0 and not re.search(r'[.!?]\s*$', text[max(0, start - 3):start])
+    sentence = sentences[1] if mid_sentence and len(sentences) > 1 else sentences[0]
+    if len(sentence) <= MAX_TITLE_CHARS:
+        return sentence
+    return sentence[:MAX_TITLE_CHARS].rsplit(" ", 1)[0] + "…"
+
+
+def _heading_boundaries(headings: list[dict], starts: list[int]) -> list[tuple[int, str, int, int]]:
+    """(first chunk, title, level, char_start) per heading, at the shallowest level that splits the content."""
+    levels = sorted({heading["level"] for heading in headings})
+    for level in levels:
+        selected = [h for h in headings if h["level"] <= level]
+        if len(selected) >= 2:
+            break
+
+    boundaries: list[tuple[int, str, int, int]] = []
+    for heading in selected:
+        # A section starts with the chunk holding its heading.
+        chunk = max(bisect.bisect_right(starts, heading["char_start"]) - 1, 0)
+        if boundaries and chunk <= boundaries[-1][0]:
+            boundaries.pop()  # nothing between two headings (e.g. title, then chapter 1): keep the later
+        boundaries.append((chunk, heading["title"][:MAX_TITLE_CHARS], heading["level"], heading["char_start"]))
+    return boundaries
+
+
+def _depth_scores(similarities: np.ndarray) -> np.ndarray:
+    """TextTiling depth of every gap: climb to the peak on each side, add both drops."""
+    depths = np.zeros_like(similarities)
+    for gap, value in enumerate(similarities):
+        left = value
+        for i in range(gap - 1, -1, -1):
+            if similarities[i] < left:
+                break
+            left = similarities[i]
+        right = value
+        for i in range(gap + 1, len(similarities)):
+            if similarities[i] < right:
+                break
+            right = similarities[i]
+        depths[gap] = (left - value) + (right - value)
+    return depths
+
+
+def _window_matrix(columns: np.ndarray, n: int) -> sparse.csr_matrix:
+    """0/1 matrix with a 1 at (row, column) for every in-range column of each row."""
+    rows = np.repeat(np.arange(columns.shape[0]), columns.shape[1])
+    cols = columns.ravel()
+    keep = (cols >= 0) & (cols < n)
+    return sparse.csr_matrix(
+        (np.ones(keep.sum()), (rows[keep], cols[keep])),
+        shape=(columns.shape[0], n),
+    )
+
+
+def detect_topic_boundaries(chunks: list[str], retrieval_index: dict | None = None) -> list[int]:
+    """
+    Chunk positions where a new topic starts (TextTiling over chunk term vectors).
+    Uses the stored hashed vectors of the retrieval index when present.
+    """
+    n = len(chunks)
+    if n < 2 * TOPIC_MIN_CHUNKS:
+        return []
+
+    section = (retrieval_index or {}).get("hashed")
+    matrix = load_hashed_matrix(section) if section else hash_texts(list(chunks))
+
+    # Row g-1 of left / right sums the TOPIC_WINDOW chunk vectors before / after gap g.
+    gaps = np.arange(1, n)
+    offsets = np.arange(TOPIC_WINDOW)
+    left_cols = gaps[:, None] - 1 - offsets
+    right_cols = gaps[:, None] + offsets
+    left = _window_matrix(left_cols, n) @ matrix
+    right = _window_matrix(right_cols, n) @ matrix
+
+    dots = np.asarray(left.multiply(right).sum(axis=1)).ravel()
+    norms = np.sqrt(
+        np.asarray(left.multiply(left).sum(axis=1)).ravel()
+        * np.asarray(right.multiply(right).sum(axis=1)).ravel()
+    )
+    similarities = np.divide(dots, norms, out=np.zeros_like(dots), where=norms > 0)
+
+    depths = _depth_scores(similarities)
+    threshold = depths.mean() + depths.std() / 2
+
+    boundaries: list[int] = []
+    for gap in np.argsort(-depths, kind="stable"):
+        chunk = int(gap) + 1
+        if depths[gap] <= threshold or len(boundaries) >= MAX_SECTIONS - 1:
+            break
+        if chunk < TOPIC_MIN_CHUNKS or n - chunk < TOPIC_MIN_CHUNKS:
+            continue
+        if all(abs(chunk - b) >= TOPIC_MIN_CHUNKS for b in boundaries):
+            boundaries.append(chunk)
+    return sorted(boundaries)
+
+
+def build_sections(
+    normalized_text: str,
+    chunks: list[str],
+    headings: list[dict] | None = None,
+    retrieval_index: dict | None = None,
+) -> tuple[list[dict], str | None]:
+    """
+    Section index over stored chunks.
+
+    Args:
+        normalized_text: The content's text.
+        chunks:          Stored chunks (after near-duplicate collapsing).
+        headings:        {"title", "level", "source", "char_start"} from the document structure
+                         (content_processor.extract_pdf_text / extract_word_text).
+        retrieval_index: Stored index of the chunks; its hashed vectors feed topic detection.
+
+    Returns:
+        (sections, source) — sections in order, each
+        {"title", "level", "start", "end", "char_start", "char_end"} with chunk
+        range [start, end); source is "outline" / "headings" / "topics", or
+        (None) with an empty list when the content does not split.
+    """
+    if not chunks:
+        return [], None
+    starts = _chunk_starts(normalized_text, chunks)
+
+    boundaries: list[tuple[int, str, int, int]] = []
+    source = None
+    if headings:
+        boundaries = _heading_boundaries(headings, starts)
+        source = headings[0].get("source", "headings")
+    if len(boundaries) < 2:
+        boundaries = [(chunk, _title_from_chunk(normalized_text, starts[chunk], chunks[chunk]), 1, starts[chunk])
+                      for chunk in [0, *detect_topic_boundaries(chunks, retrieval_index)]]
+        source = "topics"
+    if len(boundaries) < 2:
+        return [], None
+
+    if boundaries[0][0] > 0:
+        boundaries.insert(0, (0, FRONT_MATTER_TITLE, boundaries[0][2], 0))
+    boundaries = boundaries[:MAX_SECTIONS]
+
+    sections = []
+    for i, (start, title, level, char_start) in enumerate(boundaries):
+        last = i + 1 == len(boundaries)
+        sections.append({
+            "title":      title,
+            "level":      level,
+            "start":      start,
+            "end":        len(chunks) if last else boundaries[i + 1][0],
+            "char_start": 0 if i == 0 else char_start,
+            "char_end":   len(normalized_text) if last else boundaries[i + 1][3],
+        })
+    return sections, source
+
+
+# ─── LOOKUP — called at runtime ──────────────────────────────────────────────
+
+def get_content_sections(content: dict) -> list[dict]:
+    """Stored sections of a content document (empty for content without any)."""
+    return (content.get("chunk_metadata") or {}).get("sections") or []
+
+
+def get_stored_headings(metadata: dict | None) -> list[dict] | None:
+    """
+    Headings behind stored outline / heading sections, so content re-chunked without
+    its source file (worker/backfill.py) keeps them. None for topic sections.
+    """
+    metadata = metadata or {}
+    if metadata.get("sections_source") in (None, "topics"):
+        return None
+    return [
+        {"title": s["title"], "level": s["level"], "source": metadata["sections_source"], "char_start": s["char_start"]}
+        for i, s in enumerate(metadata.get("sections") or [])
+        if not (i == 0 and s["title"] == FRONT_MATTER_TITLE)
+    ] or None
+
+
+def get_section(content: dict, section: int) -> dict | None:
+    """Section number `section` (0-based, as listed by get_content_sections), or None."""
+    sections = get_content_sections(content)
+    return sections[section] if 0 <= section < len(sections) else None
@@ -1,48 +1,75 @@
 """
-summary.py — Summary generation service.
+summary.py — Summary generation service (map-reduce).
 
-Supports both pre-stored chunks (MongoDB content['chunks']) and raw normalized_text fallback.
+Reads the content's stored chunks; raw text passed in directly is chunked the same way.
+
+The whole content (or the requested section) is covered in document order:
+  - map:    chunk groups of one prompt each are summarized concurrently into notes,
+  - reduce: the notes are combined into the final summary in the requested style;
+            notes too long for one prompt are first combined group-wise
+            (concurrently) until they fit.
+Wall-clock time is about one map call plus one reduce call; content that fits one
+prompt is summarized in a single call.
 """
 
 import os
+from collections.abc import Sequence
 
-from app.services.chunker import get_chunks_for_feature
+from app.services.chunker import compute_chunks, get_document_chunk_groups
+from app.services.context_compression import compress_context, packing_budget
+from app.services.generation_cache import prompt_version
+from app.services.llm_gateway import chat_completion, run_concurrently
+from app.services.tokens import count_tokens_many, pack_texts, prompt_budget, truncate_to_tokens
 from dotenv import load_dotenv
-from groq import Groq
 
 load_dotenv()
 
+SUMMARY_MODEL = "llama-3.1-8b-instant"
+SUMMARY_MAX_TOKENS = 700   # completion tokens of the final summary
+NOTES_MAX_TOKENS = 400     # completion tokens of each map / intermediate reduce call
+MAX_MAP_CALLS = 24         # longer content keeps its best-ranked chunks (chunker.get_document_chunk_groups)
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "8"))  # map / reduce calls in flight per summary
+
+SUMMARY_SYSTEM_PROMPT = (
+    "You are a concise educational summarizer. "
+    "Never start your response with phrases like 'Here is', 'Here are', 'This is a summary', "
+    "or any other preamble. Output only the summary content directly."
+)
+NOTES_INSTRUCTION = (
+    "Output only notes with no preamble. Summarize this part of a longer document as dense notes: "
+    "every key point, definition, formula and fact, in the order they appear."
+)
+REDUCE_PREFIX = "The notes below cover consecutive parts of one document, in order."
+
+# Cache key part of generated summaries (generation_cache). The per-type instructions
+# live in generate_summary: bump the revision when editing them.
+SUMMARY_PROMPT_VERSION = prompt_version(
+    "summary", 1, SUMMARY_SYSTEM_PROMPT, NOTES_INSTRUCTION, REDUCE_PREFIX,
+    SUMMARY_MAX_TOKENS, NOTES_MAX_TOKENS, MAX_MAP_CALLS,
+)
+
 
 def generate_summary(
     text: str | None = None,
     prompt_suffix: str = "Provide a comprehensive and detailed summary.",
-    stored_chunks: list[str] | None = None,
-    normalized_text: str | None = None,
+    stored_chunks: Sequence[str] | None = None,
+    retrieval_index: dict | None = None,
+    chunk_range: tuple[int, int] | None = None,
 ) -> str:
     """
     Generate summary using Groq API (fast and free).
 
     Args:
-        text: Positional fallback for raw text content.
+        text: Raw text, used only when there are no stored chunks.
         prompt_suffix: Summary style instruction.
         stored_chunks: Pre-computed chunks list from MongoDB content document.
-        normalized_text: Raw text string fallback.
+        retrieval_index: Stored retrieval index; supplies the precomputed ranking for stored_chunks.
+        chunk_range: [start, end) of stored_chunks to read, e.g. one section; None for all.
     """
     api_key = os.getenv("GROQ_API_KEY")
     if not api_key:
         raise ValueError("GROQ_API_KEY not set")
 
-    client = Groq(api_key=api_key)
-
-    # Resolve input source
-    content_text = text or normalized_text or ""
-    if stored_chunks and isinstance(stored_chunks, list) and len(stored_chunks) > 0:
-        chunks = stored_chunks
-    elif content_text:
-        chunks = get_chunks_for_feature(content_text, "summary")
-    else:
-        raise ValueError("No content provided for summary generation.")
-
     # Determine instructions based on type
     suffix_lower = prompt_suffix.lower()
     if "brief" in suffix_lower or "short" in suffix_lower:
@@ -56,45 +83,95 @@ def generate_summary(
     else:
         instruction = "Output only the summary text with no preamble or meta-commentary. Cover the key points clearly."
 
-    system_msg = (
-        "You are a concise educational summarizer. "
-        "Never start your response with phrases like 'Here is', 'Here are', 'This is a summary', "
-        "or any other preamble. Output only the summary content directly."
+    # Stored content always has chunks (legacy documents are backfilled: worker/backfill.py)
+    if not stored_chunks and text:
+        stored_chunks = compute_chunks(text)
+    if not stored_chunks:
+        raise ValueError("No content provided for summary generation.")
+
+    # The whole content in document order, packed into map-sized prompts
+    notes_budget = prompt_budget(SUMMARY_MODEL, NOTES_MAX_TOKENS, SUMMARY_SYSTEM_PROMPT, f"{NOTES_INSTRUCTION}\n\nContent:\n")
+    groups = get_document_chunk_groups(
+        stored_chunks, "summary", packing_budget("summary", notes_budget), MAX_MAP_CALLS,
+        index=retrieval_index, chunk_range=chunk_range,
     )
+    if not groups:
+        # e.g. a section range left stale by a re-chunk
+        raise ValueError("No content provided for summary generation.")
 
-    # Summarize top chunks
-    chunk_summaries: list[str] = []
-    for chunk in chunks[:4]:  # process up to 4 relevant chunks
-        prompt = f"{instruction}\n\nContent:\n{chunk}"
-        try:
-            response = client.chat.completions.create(
-                model="llama-3.1-8b-instant",
-                messages=[
-                    {"role": "system", "content": system_msg},
-                    {"role": "user", "content": prompt},
-                ],
-                temperature=0.3,
-                max_tokens=350,
-            )
-            res_text = response.choices[0].message.content
-            if res_text and res_text.strip():
-                chunk_summaries.append(res_text.strip())
-        except Exception as exc:
-            print(f"[SUMMARY] Chunk error: {exc}")
-            continue
-
-    if chunk_summaries:
-        return "\n\n".join(chunk_summaries)
-
-    # Direct fallback if chunk loop yields nothing
-    fallback_text = content_text[:3000] if content_text else " ".join(chunks[:3])
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
+    # Content that fits one prompt is summarized directly
+    final_budget = prompt_budget(SUMMARY_MODEL, SUMMARY_MAX_TOKENS, SUMMARY_SYSTEM_PROMPT, f"{instruction}\n\nContent:\n")
+    if len(groups) == 1:
+        content = compress_context(groups[0], "summary", budget=final_budget)
+        summary = _summarize(f"{instruction}\n\nContent:\n{content}", SUMMARY_MAX_TOKENS)
+        if summary:
+            return summary
+    else:
+        # Map: every group to notes, concurrently; only each group's most central sentences are sent
+        notes = run_concurrently(
+            lambda content: _summarize(f"{NOTES_INSTRUCTION}\n\nContent:\n{content}", NOTES_MAX_TOKENS),
+            [compress_context(group, "summary", budget=notes_budget) for group in groups],
+            SUMMARY_CONCURRENCY,
+        )
+        notes = [note for note in notes if note]
+        if notes:
+            return _reduce(notes, instruction)
+
+    # Direct fallback if the calls yield nothing
+    fallback_text = text[:3000] if text else groups[0][:3000]
+    response = chat_completion(
+        model=SUMMARY_MODEL,
         messages=[
-            {"role": "system", "content": system_msg},
+            {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
             {"role": "user", "content": f"{instruction}\n\nContent:\n{fallback_text}"},
         ],
         temperature=0.3,
         max_tokens=400,
     )
     return response.choices[0].message.content.strip()
+
+
+def _summarize(prompt: str, max_tokens: int) -> str | None:
+    """One summary call; None when it fails or comes back empty."""
+    try:
+        response = chat_completion(
+            model=SUMMARY_MODEL,
+            messages=[
+                {"role": "system", "content": SUMMARY_SYSTEM_PROMPT},
+                {"role": "user", "content": prompt},
+            ],
+            temperature=0.3,
+            max_tokens=max_tokens,
+        )
+        res_text = response.choices[0].message.content
+        return res_text.strip() if res_text and res_text.strip() else None
+    except Exception as exc:
+        print(f"[SUMMARY] Call error: {exc}")
+        return None
+
+
+def _reduce(notes: list[str], instruction: str) -> str:
+    """
+    Combine ordered notes into the final summary. Notes that do not fit one prompt
+    are combined group-wise first (hierarchical reduce), level by level.
+    """
+    final_prefix = f"{REDUCE_PREFIX} Combine them into one summary of the whole document. {instruction}\n\nNotes:\n"
+    notes_prefix = f"{REDUCE_PREFIX} {NOTES_INSTRUCTION}\n\nNotes:\n"
+    final_budget = prompt_budget(SUMMARY_MODEL, SUMMARY_MAX_TOKENS, SUMMARY_SYSTEM_PROMPT, final_prefix)
+    notes_budget = prompt_budget(SUMMARY_MODEL, NOTES_MAX_TOKENS, SUMMARY_SYSTEM_PROMPT, notes_prefix)
+
+    token_counts = count_tokens_many(notes)
+    while len(notes) > 1 and sum(token_counts) > final_budget:
+        groups = pack_texts(notes, token_counts, notes_budget)
+        if len(groups) == len(notes):
+            break  # every note fills a prompt on its own: no level can shrink them
+        combined = run_concurrently(
+            lambda content: _summarize(f"{notes_prefix}{content}", NOTES_MAX_TOKENS), groups, SUMMARY_CONCURRENCY
+        )
+        combined = [note for note in combined if note]
+        if not combined:
+            break
+        notes, token_counts = combined, count_tokens_many(combined)
+
+    content = truncate_to_tokens("\n\n".join(notes), final_budget)
+    return _summarize(f"{final_prefix}{content}", SUMMARY_MAX_TOKENS) or "\n\n".join(notes)
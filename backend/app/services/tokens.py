@@ -0,0 +1,151 @@
+"""
+tokens.py — Token counting, per-model token budgets and prompt packing.
+
+Stored chunks are sized in characters (chunker.CHUNK_SIZE), but LLM limits are
+in tokens. This module:
+  - counts tokens offline, with the served model family's tokenizer when one
+    is deployed, otherwise with a heuristic that errs on the high side;
+  - holds the per-request token budget of every Groq model we call;
+  - packs retrieved chunks into as few prompts as fit a budget, so features
+    make fewer, fuller calls and never overrun a model's limit.
+
+Per-chunk counts are computed once at upload and stored in the retrieval index
+(chunker.build_retrieval_index), so packing at request time re-tokenizes nothing.
+
+Environment:
+    LLM_TOKENIZER_PATH — tokenizer.json of the Llama 3 family (needs the optional
+                         `tokenizers` package). Without it the heuristic is used.
+"""
+
+import hashlib
+import math
+import os
+import re
+from pathlib import Path
+
+try:
+    from tokenizers import Tokenizer
+except ImportError:  # optional dependency: heuristic counts are used instead
+    Tokenizer = None
+
+# ─── MODEL BUDGETS ───────────────────────────────────────────────────────────
+# Tokens one request may use (prompt + max_tokens) per model. Far below the
+# 128k context windows; sized to Groq's per-minute token limits so a single
+# call never exhausts them.
+MODEL_TOKEN_BUDGETS: dict[str, int] = {
+    "llama-3.1-8b-instant":    6000,
+    "llama-3.3-70b-versatile": 12000,
+}
+DEFAULT_TOKEN_BUDGET = 4000
+
+# Chat formatting overhead per message (role header and separators).
+MESSAGE_OVERHEAD_TOKENS = 8
+
+# ─── COUNTING ────────────────────────────────────────────────────────────────
+# Llama 3 averages ~4 characters per token on English prose; each word or
+# punctuation mark is at least one token. Taking the larger estimate keeps
+# the heuristic on the safe (high) side.
+_HEURISTIC_CHARS_PER_TOKEN = 3.8
+_TOKEN_PIECE = re.compile(r"\w+|[^\w\s]")
+
+_tokenizer = None
+_tokenizer_name: str | None = None
+
+
+def _load_tokenizer() -> None:
+    global _tokenizer, _tokenizer_name
+    if _tokenizer_name is not None:
+        return
+    path = os.getenv("LLM_TOKENIZER_PATH")
+    if Tokenizer is not None and path and Path(path).exists():
+        _tokenizer = Tokenizer.from_file(path)
+        digest = hashlib.sha1(Path(path).read_bytes()).hexdigest()[:8]
+        _tokenizer_name = f"tokenizer-{digest}"
+    else:
+        _tokenizer_name = "heuristic-1"
+
+
+def get_tokenizer_name() -> str:
+    """Identifies how counts are made; stored with the counts so they can be re-made if it changes."""
+    _load_tokenizer()
+    return _tokenizer_name
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(math.ceil(len(text) / _HEURISTIC_CHARS_PER_TOKEN), len(_TOKEN_PIECE.findall(text)))
+
+
+def count_tokens(text: str) -> int:
+    _load_tokenizer()
+    if _tokenizer is not None:
+        return len(_tokenizer.encode(text, add_special_tokens=False).ids)
+    return _estimate_tokens(text)
+
+
+def count_tokens_many(texts: list[str]) -> list[int]:
+    """count_tokens for a batch; the real tokenizer encodes the batch in parallel."""
+    _load_tokenizer()
+    if _tokenizer is not None:
+        return [len(e.ids) for e in _tokenizer.encode_batch(texts, add_special_tokens=False)]
+    return [_estimate_tokens(text) for text in texts]
+
+
+# ─── BUDGETING AND PACKING ───────────────────────────────────────────────────
+
+def prompt_budget(model: str, max_tokens: int, *fixed_texts: str) -> int:
+    """
+    Tokens left for retrieved content in one request to `model`, after the
+    completion (max_tokens) and the fixed parts of the prompt (system message,
+    instructions, question, history) are accounted for.
+    """
+    budget = MODEL_TOKEN_BUDGETS.get(model, DEFAULT_TOKEN_BUDGET)
+    fixed = sum(count_tokens(text) + MESSAGE_OVERHEAD_TOKENS for text in fixed_texts)
+    return max(0, budget - max_tokens - fixed)
+
+
+def truncate_to_tokens(text: str, budget: int) -> str:
+    """Longest word-boundary prefix of text that fits in `budget` tokens."""
+    if count_tokens(text) <= budget:
+        return text
+    low, high = 0, len(text)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            low = mid
+        else:
+            high = mid - 1
+    cut = text.rfind(" ", 0, low)
+    return text[:cut if cut > 0 else low].rstrip()
+
+
+def pack_texts(
+    texts: list[str],
+    token_counts: list[int],
+    budget: int,
+    separator: str = "\n\n",
+) -> list[str]:
+    """
+    Greedily pack texts, in order, into as few groups as possible of at most
+    `budget` tokens each. A single text over budget is truncated to fit.
+
+    Returns the groups joined by `separator`.
+    """
+    separator_tokens = count_tokens(separator) if separator.strip() else 1
+    groups: list[str] = []
+    current: list[str] = []
+    used = 0
+
+    for text, tokens in zip(texts, token_counts):
+        if tokens > budget:
+            text, tokens = truncate_to_tokens(text, budget), budget
+        cost = tokens + (separator_tokens if current else 0)
+        if current and used + cost > budget:
+            groups.append(separator.join(current))
+            current, used = [], 0
+            cost = tokens
+        current.append(text)
+        used += cost
+
+    if current:
+        groups.append(separator.join(current))
+    return groups
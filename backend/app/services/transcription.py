@@ -1,5 +1,7 @@
 import os
 
+from app.services.llm_gateway import transcribe
+
 # ---------------------------------------------------------------------------
 # Transcription via Groq's Whisper API (cloud, free tier, no GPU required)
 # Falls back to local faster-whisper only if GROQ_API_KEY is not set.
@@ -11,23 +13,18 @@ def transcribe_audio(audio_path: str) -> str:
     api_key = os.getenv("GROQ_API_KEY")
 
     if api_key:
-        return _transcribe_with_groq(audio_path, api_key)
+        return _transcribe_with_groq(audio_path)
     else:
         return _transcribe_local(audio_path)
 
 
-def _transcribe_with_groq(audio_path: str, api_key: str) -> str:
+def _transcribe_with_groq(audio_path: str) -> str:
     """Use Groq's hosted Whisper large-v3-turbo — fast, free-tier, no GPU needed."""
-    from groq import Groq
-
-    client = Groq(api_key=api_key)
-
-    with open(audio_path, "rb") as audio_file:
-        transcription = client.audio.transcriptions.create(
-            model="whisper-large-v3-turbo",   # Groq free tier: fast + accurate
-            file=audio_file,
-            response_format="text",
-        )
+    transcription = transcribe(
+        "whisper-large-v3-turbo",   # Groq free tier: fast + accurate
+        audio_path,
+        response_format="text",
+    )
 
     # Groq returns the text directly when response_format="text"
     return transcription if isinstance(transcription, str) else transcription.text
@@ -0,0 +1,42 @@
+"""
+sparse_codec.py — Compact byte layout for the column indices of sparse rows.
+
+Column indices within a CSR row are sorted, so each one is stored as the gap to
+the previous one in its row (the first one as is), and the bytes of the gaps are
+split into planes: all lowest bytes, then all second bytes, and so on. Gaps are
+small, so the high planes are long runs of zeros that compress to almost nothing
+(models/blob_storage.py).
+
+Shared by the hashed retrieval sections (services/retrievers.py) and the term
+statistics counted from them (models/term_stats.py).
+"""
+
+import numpy as np
+
+
+def pack_row_indices(indices: np.ndarray, indptr: np.ndarray) -> bytes:
+    """Per-row sorted column indices as gap-encoded byte planes."""
+    indices = np.asarray(indices, dtype="<u4")
+    gaps = indices.copy()
+    gaps[1:] -= indices[:-1]  # wraps across row starts; those are overwritten next
+    starts = indptr[:-1][np.diff(indptr) > 0]
+    gaps[starts] = indices[starts]
+    return gaps.view(np.uint8).reshape(-1, 4).T.tobytes()
+
+
+def unpack_row_indices(data: bytes, indptr: np.ndarray) -> np.ndarray:
+    """Inverse of pack_row_indices: int32 column indices, row by row."""
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(4, -1)
+    gaps = planes[0].astype(np.uint32)
+    for shift, plane in ((8, planes[1]), (16, planes[2]), (24, planes[3])):
+        if plane.any():
+            gaps |= plane.astype(np.uint32) << shift
+
+    # Undo the running sum at every row start. uint32 arithmetic wraps, and the
+    # differences (the indices themselves) are exact whatever the running sum reached.
+    totals = np.cumsum(gaps, dtype=np.uint32)
+    sizes = np.diff(indptr)
+    before = np.zeros(len(sizes), dtype=np.uint32)
+    later = indptr[:-1] > 0
+    before[later] = totals[indptr[:-1][later] - 1]
+    return (totals - np.repeat(before, sizes)).view(np.int32)
@@ -0,0 +1,235 @@
+"""
+worker/backfill.py — Resumable, throttled backfill of legacy content documents.
+
+Content uploaded before chunks were stored (or under older storage formats)
+is brought up to the current layout by content_metadata.backfill_content:
+  - no chunks or no chunk_metadata  -> re-chunk normalized_text, store chunks,
+                                       metadata and the retrieval index,
+  - chunks cut by an older chunker   -> the same, keeping heading sections
+    (chunker.CHUNKING_VERSION)
+  - chunks stored as strings         -> store them as offsets (or, when they are
+                                       not slices of the text, record that in
+                                       chunk_metadata.offsets_unavailable),
+  - missing / stale retrieval index  -> rebuild it.
+
+Requests never fall back to re-chunking per call: a document the backfill has
+not reached yet is migrated once, on its first feature request
+(content_metadata.ensure_content_chunks). This job gets everything else done
+in the background, so that path is rarely taken.
+
+How it runs:
+  - Documents are scanned in _id order, BATCH_SIZE at a time, reading only the
+    fields needed to decide (never normalized_text).
+  - The last scanned _id and progress counters are checkpointed in the
+    `migrations` collection after every batch; a restart resumes there. The
+    checkpoint is tied to the retrieval index version, so a new version
+    automatically starts a fresh pass.
+  - At most --rate documents per second are migrated, so the job can run next
+    to the API without starving MongoDB or the CPU. Documents that needed no
+    change after all are neither throttled nor counted against --limit.
+  - SIGTERM / SIGINT stop it after the current document; progress is kept.
+
+Usage (from backend/):
+    python -m app.worker.backfill run [--batch-size 50] [--rate 2] [--limit N] [--dry-run]
+    python -m app.worker.backfill status
+    python -m app.worker.backfill reset
+"""
+
+import argparse
+import logging
+import signal
+import sys
+import time
+from datetime import datetime
+
+from app.database.connection import get_database
+from app.models.content import get_content_by_id
+from app.models.migration import get_migration_state, reset_migration_state, save_migration_state
+from app.services.chunker import RETRIEVAL_INDEX_VERSION, is_chunking_current
+from app.services.content_metadata import backfill_content
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='{"time": "%(asctime)s", "level": "%(levelname)s", "logger": "%(name)s", "message": "%(message)s"}',
+    stream=sys.stdout,
+)
+logger = logging.getLogger("edugen.backfill")
+
+MIGRATION_NAME = "content_backfill"
+BATCH_SIZE = 50
+DEFAULT_RATE = 2.0           # documents migrated per second
+MAX_RECORDED_FAILURES = 100  # failed content ids kept in the checkpoint
+
+# Everything needed to decide whether a document needs work; normalized_text stays in MongoDB.
+_SCAN_PROJECTION = {
+    "chunk_metadata.count": 1,
+    "chunk_metadata.chunking": 1,
+    "chunk_metadata.offsets_unavailable": 1,
+    "chunk_offsets": 1,
+}
+
+# ─── GRACEFUL SHUTDOWN ────────────────────────────────────────────────────────
+_shutdown_requested = False
+
+
+def _handle_sigterm(signum, frame):
+    global _shutdown_requested
+    logger.info("Stop requested — backfill will stop after the current document.")
+    _shutdown_requested = True
+
+
+# ─── SCAN ────────────────────────────────────────────────────────────────────
+
+def needs_backfill(doc: dict, index: dict | None) -> bool:
+    """Whether a scanned document (see _SCAN_PROJECTION) is behind the current layout."""
+    metadata = doc.get("chunk_metadata") or {}
+    if not metadata:
+        return True  # no chunks at all
+    if not is_chunking_current(metadata):
+        return True  # chunked by an older chunker
+    if doc.get("chunk_offsets") is None and not metadata.get("offsets_unavailable"):
+        return True  # chunks still stored as strings that may fit as offsets
+    return not (
+        index
+        and index.get("version") == RETRIEVAL_INDEX_VERSION
+        and index.get("chunk_count") == metadata.get("count")
+    )
+
+
+def _scan_batch(after_id, batch_size: int) -> tuple[list[dict], dict[str, dict]]:
+    """The next batch of documents after after_id, and their stored index headers."""
+    db = get_database()
+    query = {"_id": {"$gt": after_id}} if after_id is not None else {}
+    docs = list(db.content.find(query, _SCAN_PROJECTION).sort("_id", 1).limit(batch_size))
+
+    ids = [str(doc["_id"]) for doc in docs]
+    headers = db.retrieval_indexes.find(
+        {"content_id": {"$in": ids}},
+        {"content_id": 1, "index.version": 1, "index.chunk_count": 1},
+    )
+    return docs, {h["content_id"]: h.get("index") or {} for h in headers}
+
+
+# ─── RUN ─────────────────────────────────────────────────────────────────────
+
+def _new_state(total: int) -> dict:
+    return {
+        "index_version": RETRIEVAL_INDEX_VERSION,
+        "last_id":       None,
+        "total":         total,
+        "scanned":       0,
+        "migrated":      0,
+        "failed":        0,
+        "failed_ids":    [],
+        "started_at":    datetime.utcnow(),
+        "finished_at":   None,
+    }
+
+
+def _log_progress(state: dict, migrated_this_run: int, started: float) -> None:
+    total = max(state["total"], state["scanned"], 1)
+    elapsed = time.monotonic() - started
+    rate = migrated_this_run / elapsed if elapsed else 0.0
+    logger.info(
+        f"scanned {state['scanned']}/{total} ({100 * state['scanned'] / total:.1f}%) "
+        f"migrated={state['migrated']} failed={state['failed']} rate={rate:.2f}/s"
+    )
+
+
+def run_backfill(
+    batch_size: int = BATCH_SIZE,
+    rate: float = DEFAULT_RATE,
+    limit: int | None = None,
+    dry_run: bool = False,
+) -> dict:
+    """
+    Migrate legacy content documents until none are left (or limit / stop request).
+
+    Args:
+        batch_size: Documents scanned per batch (one checkpoint per batch).
+        rate:       Maximum documents migrated per second (<= 0: unthrottled).
+        limit:      Stop after migrating this many documents in this run.
+        dry_run:    Only count what would be migrated; nothing is written.
+
+    Returns:
+        The final migration state (checkpoint and counters).
+    """
+    state = get_migration_state(MIGRATION_NAME)
+    if not state or state.get("index_version") != RETRIEVAL_INDEX_VERSION or state.get("finished_at"):
+        state = _new_state(get_database().content.estimated_document_count())
+    logger.info(f"Backfill {'dry run ' if dry_run else ''}starting after _id={state['last_id']}")
+
+    interval = 1.0 / rate if rate > 0 else 0.0
+    started = time.monotonic()
+    migrated_this_run = 0
+
+    while not _shutdown_requested and (limit is None or migrated_this_run < limit):
+        docs, headers = _scan_batch(state["last_id"], batch_size)
+        if not docs:
+            state["finished_at"] = datetime.utcnow()
+            break
+
+        for doc in docs:
+            if _shutdown_requested or (limit is not None and migrated_this_run >= limit):
+                break
+            content_id = str(doc["_id"])
+
+            if needs_backfill(doc, headers.get(content_id)):
+                began = time.monotonic()
+                migrated = dry_run
+                if not dry_run:
+                    try:
+                        content = get_content_by_id(content_id)
+                        migrated = bool(content is not None and backfill_content(content))
+                    except Exception as exc:
+                        logger.error(f"[CONTENT {content_id}] Backfill failed: {exc}")
+                        state["failed"] += 1
+                        state["failed_ids"] = (state["failed_ids"] + [content_id])[-MAX_RECORDED_FAILURES:]
+                if migrated:
+                    state["migrated"] += 1
+                    migrated_this_run += 1
+                    if not dry_run:
+                        time.sleep(max(0.0, interval - (time.monotonic() - began)))
+
+            state["last_id"] = doc["_id"]
+            state["scanned"] += 1
+
+        if not dry_run:
+            save_migration_state(MIGRATION_NAME, state)
+        _log_progress(state, migrated_this_run, started)
+
+    if not dry_run:
+        save_migration_state(MIGRATION_NAME, state)
+    logger.info(
+        f"Backfill {'finished' if state['finished_at'] else 'paused'}: "
+        f"migrated={state['migrated']} failed={state['failed']}"
+    )
+    return state
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backfill chunks, metadata and retrieval indexes of legacy content.")
+    sub = parser.add_subparsers(dest="command", required=True)
+    run = sub.add_parser("run", help="Run (or resume) the backfill.")
+    run.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+    run.add_argument("--rate", type=float, default=DEFAULT_RATE, help="Documents migrated per second (0 = no limit).")
+    run.add_argument("--limit", type=int, help="Stop after migrating this many documents.")
+    run.add_argument("--dry-run", action="store_true", help="Count documents that need work; write nothing.")
+    sub.add_parser("status", help="Print the stored checkpoint and counters.")
+    sub.add_parser("reset", help="Forget the checkpoint; the next run starts over.")
+    args = parser.parse_args()
+
+    if args.command == "run":
+        signal.signal(signal.SIGTERM, _handle_sigterm)
+        signal.signal(signal.SIGINT, _handle_sigterm)
+        run_backfill(args.batch_size, args.rate, args.limit, args.dry_run)
+    elif args.command == "status":
+        state = get_migration_state(MIGRATION_NAME)
+        print(state or "No backfill has run yet.")
+    else:
+        reset_migration_state(MIGRATION_NAME)
+        print("Backfill checkpoint cleared.")
+
+
+if __name__ == "__main__":
+    main()
@@ -43,6 +43,7 @@ async def process_job(
     """
     try:
         update_job_status(job_id, STATUS_PROCESSING, 5, "Starting processing...")
+        headings: list[dict] = []  # PDF outline / Word headings, for the section index
 
         # ── File: download from S3 to temp, then process ─────────────────────
         if s3_key and s3_bucket:
@@ -91,22 +92,15 @@ async def process_job(
 
             elif input_type == "pdf":
                 update_job_status(job_id, STATUS_PROCESSING, 40, "Extracting text from PDF...")
-                from pypdf import PdfReader
-                reader = PdfReader(local_path)
-                pages_text = []
-                for page in reader.pages:
-                    t = page.extract_text()
-                    if t:
-                        pages_text.append(t)
-                normalized_text = "\n".join(pages_text)
+                from app.services.content_processor import extract_pdf_text
+                normalized_text, headings = extract_pdf_text(local_path)
                 if not normalized_text.strip():
                     raise ValueError("No readable text found in PDF. It may be scanned or image-based.")
 
             elif input_type == "word":
                 update_job_status(job_id, STATUS_PROCESSING, 40, "Extracting text from document...")
-                from docx import Document
-                doc = Document(local_path)
-                normalized_text = "\n".join(p.text for p in doc.paragraphs if p.text)
+                from app.services.content_processor import extract_word_text
+                normalized_text, headings = extract_word_text(local_path)
 
             else:
                 raise ValueError(f"Unsupported file input_type: {input_type}")
@@ -142,7 +136,7 @@ async def process_job(
 
         # ── Compute chunks + save to MongoDB ──────────────────────────────────
         update_job_status(job_id, STATUS_PROCESSING, 85, "Computing content chunks...")
-        chunks, chunk_metadata = build_content_chunk_data(normalized_text)
+        chunks, chunk_metadata, retrieval_index = build_content_chunk_data(normalized_text, headings)
 
         update_job_status(job_id, STATUS_PROCESSING, 92, "Saving content to database...")
         content_data = ContentCreate(
@@ -152,6 +146,7 @@ async def process_job(
             title=title,
             chunks=chunks,
             chunk_metadata=chunk_metadata,
+            retrieval_index=retrieval_index,
         )
         content_id = create_content(content_data)
 
@@ -0,0 +1,303 @@
+"""
+retrieval_benchmark.py — Benchmarks for chunking and retrieval (app/services/chunker.py).
+
+Generates deterministic synthetic corpora (1 KB → 20 MB by default) in two styles:
+  - prose:      capitalized sentences ending in . ! or ?, like PDF / Word text.
+  - transcript: lowercase words with no punctuation at all, like YouTube captions.
+                The chunker splits on sentence punctuation, so this is its worst case.
+
+For every (style, size) it measures:
+  - chunking:  compute_chunks throughput (MB/s), chunk count, peak memory.
+  - indexing:  build_retrieval_index time, peak memory, stored BSON size.
+  - retrieval: retrieve_top_k p50 / p99 latency per backend with the stored index,
+               the legacy no-index path (small corpora only), and
+               get_chunks_for_feature per feature.
+
+Peak memory is measured with tracemalloc in a separate pass, so it never skews timings.
+
+Usage (from backend/):
+    python -m benchmarks.retrieval_benchmark
+    python -m benchmarks.retrieval_benchmark --sizes 1KB,1MB --styles prose --queries 50
+    python -m benchmarks.retrieval_benchmark --compare benchmarks/results/<previous>.json
+
+Results are written as JSON (default: benchmarks/results/retrieval-<UTC timestamp>.json).
+"""
+
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import bson
+import numpy as np
+import scipy
+import sklearn
+from app.services.chunker import (
+    RETRIEVAL_QUERIES,
+    TOP_K_CONFIG,
+    build_retrieval_index,
+    compute_chunks,
+    get_chunks_for_feature,
+    retrieve_top_k,
+)
+from app.services.global_idf import idf_from_texts, set_global_idf
+from app.services.retrievers import RETRIEVERS
+
+DEFAULT_SIZES = "1KB,10KB,100KB,1MB,5MB,20MB"
+DEFAULT_STYLES = "prose,transcript"
+RESULTS_DIR = Path(__file__).parent / "results"
+
+# Vocabulary of pseudo-words drawn with a Zipf-like distribution, like real text.
+VOCABULARY_SIZE = 8000
+ZIPF_EXPONENT = 1.1
+SEED = 1234
+
+# Legacy (no index) retrieval hashes every chunk per query, so it is only run on small corpora.
+LEGACY_MAX_CHUNKS = 3000
+LEGACY_MAX_QUERIES = 20
+
+_UNITS = {"KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+
+# ─── SYNTHETIC CORPORA ───────────────────────────────────────────────────────
+
+def parse_size(value: str) -> int:
+    """'20MB' -> 20971520. Plain integers are bytes."""
+    value = value.strip().upper()
+    for unit, factor in _UNITS.items():
+        if value.endswith(unit):
+            return int(float(value[:-len(unit)]) * factor)
+    return int(value)
+
+
+def build_vocabulary(rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    """Pronounceable pseudo-words and their Zipf sampling probabilities."""
+    syllables = [c + v for c in "bcdfghklmnprstvz" for v in "aeiou"]
+    words = set()
+    while len(words) < VOCABULARY_SIZE:
+        n = rng.integers(1, 5)
+        words.add("".join(rng.choice(syllables, size=n)))
+    ranks = np.arange(1, VOCABULARY_SIZE + 1, dtype=np.float64)
+    probabilities = ranks ** -ZIPF_EXPONENT
+    return np.array(sorted(words, key=len)), probabilities / probabilities.sum()
+
+
+def generate_corpus(size: int, style: str, vocabulary: np.ndarray, probabilities: np.ndarray, seed: int) -> str:
+    """Deterministic synthetic text of roughly `size` characters."""
+    rng = np.random.default_rng(seed)
+    mean_word_len = float((np.char.str_len(vocabulary) * probabilities).sum()) + 1
+    n_words = max(1, int(size / mean_word_len) + 1)
+    words = vocabulary[rng.choice(len(vocabulary), size=n_words, p=probabilities)]
+
+    if style == "transcript":
+        text = " ".join(words)
+    elif style == "prose":
+        sentences = []
+        position = 0
+        while position < n_words:
+            length = int(rng.integers(6, 26))
+            sentence = words[position:position + length]
+            position += length
+            ending = rng.choice([".", ".", ".", "?", "!"])
+            sentences.append(" ".join(sentence).capitalize() + ending)
+        text = " ".join(sentences)
+    else:
+        raise ValueError(f"Unknown corpus style: {style}")
+
+    return text[:size]
+
+
+def generate_queries(count: int, vocabulary: np.ndarray, probabilities: np.ndarray, seed: int) -> list[str]:
+    """Short keyword queries, mixing frequent and rare terms."""
+    rng = np.random.default_rng(seed)
+    queries = []
+    for _ in range(count):
+        n = int(rng.integers(2, 9))
+        queries.append(" ".join(vocabulary[rng.choice(len(vocabulary), size=n, p=probabilities)]))
+    return queries
+
+
+# ─── MEASUREMENT HELPERS ─────────────────────────────────────────────────────
+
+def percentiles_ms(samples: list[float]) -> dict:
+    values = np.array(samples) * 1000
+    return {
+        "n":       len(samples),
+        "p50_ms":  round(float(np.percentile(values, 50)), 4),
+        "p99_ms":  round(float(np.percentile(values, 99)), 4),
+        "mean_ms": round(float(values.mean()), 4),
+    }
+
+
+def time_calls(fn, args_list: list) -> list[float]:
+    """Wall time of fn(*args) for every args tuple."""
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        fn(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def peak_memory_mb(fn, *args) -> float:
+    """Peak Python heap allocated while fn(*args) runs (tracemalloc)."""
+    tracemalloc.start()
+    try:
+        fn(*args)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 ** 2, 3)
+
+
+def best_of(fn, *args, min_total: float = 0.5, max_repeats: int = 1000) -> tuple[float, object]:
+    """Fastest run of fn(*args), repeating small workloads until min_total seconds pass."""
+    best, result, spent, repeats = float("inf"), None, 0.0, 0
+    while repeats < max_repeats and (repeats == 0 or spent < min_total):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        best, spent, repeats = min(best, elapsed), spent + elapsed, repeats + 1
+    return best, result
+
+
+# ─── BENCHMARK ───────────────────────────────────────────────────────────────
+
+def bench_corpus(text: str, queries: list[str], memory: bool) -> dict:
+    """All measurements for one corpus."""
+    result: dict = {"chars": len(text)}
+
+    chunk_seconds, chunks = best_of(compute_chunks, text)
+    lengths = np.array([len(c) for c in chunks])
+    result["chunking"] = {
+        "seconds":        round(chunk_seconds, 6),
+        "throughput_mbs": round(len(text) / 1024 ** 2 / chunk_seconds, 3),
+        "chunk_count":    len(chunks),
+        "mean_chunk_len": round(float(lengths.mean()), 1),
+        "max_chunk_len":  int(lengths.max()),
+    }
+
+    # Stand-in for the corpus-wide statistics, so no database is needed (global_idf.py).
+    set_global_idf(idf_from_texts(chunks))
+
+    start = time.perf_counter()
+    index = build_retrieval_index(chunks)
+    result["index"] = {
+        "seconds":    round(time.perf_counter() - start, 6),
+        "sections":   sorted(k for k in (index or {}) if k in RETRIEVERS),
+        "bson_bytes": len(bson.encode({"index": index})) if index else 0,
+    }
+
+    if memory:
+        result["chunking"]["peak_mb"] = peak_memory_mb(compute_chunks, text)
+        result["index"]["peak_mb"] = peak_memory_mb(build_retrieval_index, chunks)
+
+    chatbot_k = TOP_K_CONFIG["chatbot"]
+    retrieval: dict = {}
+    for backend in result["index"]["sections"]:
+        samples = time_calls(retrieve_top_k, [(chunks, q, chatbot_k, index, backend) for q in queries])
+        retrieval[backend] = percentiles_ms(samples)
+
+    if len(chunks) <= LEGACY_MAX_CHUNKS:
+        legacy_queries = queries[:LEGACY_MAX_QUERIES]
+        samples = time_calls(retrieve_top_k, [(chunks, q, chatbot_k) for q in legacy_queries])
+        retrieval["legacy_no_index"] = percentiles_ms(samples)
+    result["retrieve_top_k"] = retrieval
+
+    features: dict = {}
+    for feature, hint in RETRIEVAL_QUERIES.items():
+        calls = [(chunks, feature, q, index) for q in queries] if hint is None else [(chunks, feature, None, index)] * len(queries)
+        features[feature] = percentiles_ms(time_calls(get_chunks_for_feature, calls))
+    result["get_chunks_for_feature"] = features
+
+    return result
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True, cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+
+    return {
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "git_commit": commit,
+        "python":     platform.python_version(),
+        "platform":   platform.platform(),
+        "numpy":      np.__version__,
+        "scipy":      scipy.__version__,
+        "sklearn":    sklearn.__version__,
+        "backends":   {name: r.version for name, r in RETRIEVERS.items()},
+    }
+
+
+def compare(current: dict, previous_path: str) -> None:
+    """Print the ratios current / previous for the headline numbers of matching runs."""
+    previous = json.loads(Path(previous_path).read_text())
+    before = {(r["style"], r["size"]): r for r in previous["results"]}
+
+    print(f"\nCompared with {previous_path} ({previous['environment'].get('git_commit')}):  ratio = now / before")
+    for run in current["results"]:
+        old = before.get((run["style"], run["size"]))
+        if not old:
+            continue
+        rows = [("chunking MB/s", run["chunking"]["throughput_mbs"], old["chunking"]["throughput_mbs"])]
+        for backend, stats in run["retrieve_top_k"].items():
+            if backend in old["retrieve_top_k"]:
+                rows.append((f"{backend} p99 ms", stats["p99_ms"], old["retrieve_top_k"][backend]["p99_ms"]))
+        for name, now, then in rows:
+            ratio = now / then if then else float("nan")
+            print(f"  {run['style']:<10} {run['size']:>6}  {name:<22} {then:>10.3f} -> {now:>10.3f}  x{ratio:.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark chunking and retrieval on synthetic corpora.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help=f"Comma-separated corpus sizes (default: {DEFAULT_SIZES}).")
+    parser.add_argument("--styles", default=DEFAULT_STYLES, help="Comma-separated: prose, transcript.")
+    parser.add_argument("--queries", type=int, default=200, help="Queries timed per backend and corpus.")
+    parser.add_argument("--no-memory", action="store_true", help="Skip the tracemalloc peak-memory pass.")
+    parser.add_argument("--out", help="Output JSON path (default: benchmarks/results/retrieval-<timestamp>.json).")
+    parser.add_argument("--compare", help="Previous results JSON to compare against.")
+    args = parser.parse_args()
+
+    vocabulary, probabilities = build_vocabulary(np.random.default_rng(SEED))
+    queries = generate_queries(args.queries, vocabulary, probabilities, SEED + 1)
+
+    results = []
+    for style in args.styles.split(","):
+        for size_label in args.sizes.split(","):
+            size = parse_size(size_label)
+            text = generate_corpus(size, style, vocabulary, probabilities, SEED + size)
+            run = {"style": style, "size": size_label.strip(), **bench_corpus(text, queries, not args.no_memory)}
+            results.append(run)
+
+            chunking, retrieval = run["chunking"], run["retrieve_top_k"]
+            latency = "  ".join(f"{b}={s['p50_ms']:.2f}/{s['p99_ms']:.2f}" for b, s in retrieval.items())
+            print(
+                f"{style:<10} {run['size']:>6}  chunks={chunking['chunk_count']:<7} "
+                f"chunk={chunking['throughput_mbs']:.1f}MB/s  index={run['index']['seconds']:.2f}s  "
+                f"p50/p99 ms: {latency}",
+                flush=True,
+            )
+
+    report = {"environment": environment(), "queries": args.queries, "results": results}
+
+    out = Path(args.out) if args.out else RESULTS_DIR / f"retrieval-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"\nWrote {out}")
+
+    if args.compare:
+        compare(report, args.compare)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+storage_benchmark.py — Size and decode cost of content documents (app/models/content.py).
+
+Compares the legacy layout (normalized_text + a `chunks` list of strings) with
+chunk offsets (normalized_text + packed `chunk_offsets`) on the same synthetic
+corpora as retrieval_benchmark.py, reporting:
+  - BSON document size (what MongoDB stores and sends on every get_content_by_id),
+  - BSON decode time (the client-side part of the fetch),
+  - time to read the top-k chunks through get_content_chunks.
+
+Usage (from backend/):
+    python -m benchmarks.storage_benchmark
+    python -m benchmarks.storage_benchmark --sizes 100KB,1MB --out /tmp/storage.json
+"""
+
+import argparse
+import json
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+
+import bson
+import numpy as np
+from app.models.content import get_content_chunks, pack_chunk_offsets
+from app.services.chunker import TOP_K_CONFIG, compute_chunks
+
+from benchmarks.retrieval_benchmark import (
+    RESULTS_DIR,
+    SEED,
+    best_of,
+    build_vocabulary,
+    generate_corpus,
+    parse_size,
+)
+
+DEFAULT_SIZES = "10KB,100KB,1MB,5MB"
+
+
+def bench_layouts(text: str) -> dict:
+    chunks = compute_chunks(text)
+    offsets = pack_chunk_offsets(text, chunks)
+    layouts = {
+        "strings": {"normalized_text": text, "chunks": chunks, "chunk_offsets": None},
+        "offsets": {"normalized_text": text, "chunks": None, "chunk_offsets": offsets},
+    }
+
+    top = np.linspace(0, len(chunks) - 1, num=min(len(chunks), TOP_K_CONFIG["summary"]), dtype=int)
+    result: dict = {"chars": len(text), "chunk_count": len(chunks), "exact_slices": offsets is not None}
+    for name, doc in layouts.items():
+        if name == "offsets" and offsets is None:
+            continue
+        encoded = bson.encode(doc)
+        decode_seconds, decoded = best_of(bson.decode, encoded)
+        read_seconds, _ = best_of(lambda d: [get_content_chunks(d)[i] for i in top], decoded)
+        result[name] = {
+            "bson_bytes":    len(encoded),
+            "decode_ms":     round(decode_seconds * 1000, 4),
+            "read_top_k_ms": round(read_seconds * 1000, 4),
+        }
+
+    if "offsets" in result:
+        result["size_ratio"] = round(result["offsets"]["bson_bytes"] / result["strings"]["bson_bytes"], 3)
+        result["decode_ratio"] = round(result["offsets"]["decode_ms"] / result["strings"]["decode_ms"], 3)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare content document layouts.")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES)
+    parser.add_argument("--styles", default="prose,transcript")
+    parser.add_argument("--out", help="Output JSON path (default: benchmarks/results/storage-<timestamp>.json).")
+    args = parser.parse_args()
+
+    vocabulary, probabilities = build_vocabulary(np.random.default_rng(SEED))
+    results = []
+    for style in args.styles.split(","):
+        for size_label in args.sizes.split(","):
+            size = parse_size(size_label)
+            text = generate_corpus(size, style, vocabulary, probabilities, SEED + size)
+            run = {"style": style, "size": size_label.strip(), **bench_layouts(text)}
+            results.append(run)
+            if "offsets" in run:
+                print(
+                    f"{style:<10} {run['size']:>6}  chunks={run['chunk_count']:<6} "
+                    f"bson {run['strings']['bson_bytes']:>10} -> {run['offsets']['bson_bytes']:>10} (x{run['size_ratio']})  "
+                    f"decode {run['strings']['decode_ms']:.3f} -> {run['offsets']['decode_ms']:.3f} ms",
+                    flush=True,
+                )
+            else:
+                print(f"{style:<10} {run['size']:>6}  chunks are not exact slices; strings kept", flush=True)
+
+    report = {"timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"), "results": results}
+    out = Path(args.out) if args.out else RESULTS_DIR / f"storage-{datetime.now(timezone.utc):%Y%m%dT%H%M%SZ}.json"
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(report, indent=2))
+    print(f"\nWrote {out}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())